@@ -0,0 +1,188 @@
+"""
+Benchmark of the quantized KV cache
+
+For every key/value storage combination the same greedy generation runs
+with a fresh cache, reporting the cache memory after generation (and the
+saving against the full precision cache), decode throughput, and a quality
+check: the next-token loss of a small built-in eval set scored through the
+cache, with the change in loss and the top-1 agreement against the full
+precision cache. The report is printed as JSON:
+
+    python -m benchmarks.kv_cache
+    python -m benchmarks.kv_cache --model Qwen/Qwen2.5-0.5B-Instruct --dtype bfloat16 --context 2048
+    python -m benchmarks.kv_cache --configs none/none,int8/int8,int8/fp8 --key-scale token
+
+Without --model a tiny random model is built (see benchmarks/tiny_model.py);
+its throughput and memory numbers are real, its quality numbers only show
+that the check runs.
+"""
+import argparse
+import json
+import time
+from typing import Any, Dict, List, Optional
+
+EVAL_TEXTS = [
+    "The committee met on Tuesday to review the budget for the coming year. After a long discussion about "
+    "maintenance costs, the members agreed to postpone the new library wing and to spend the savings on "
+    "repairing the roof of the town hall, which had been leaking since the storms in early spring.",
+    "To make bread, mix flour, water, salt and a little yeast, then knead the dough until it is smooth and "
+    "elastic. Let it rise in a warm place for about two hours, shape it into a loaf, let it rise again and "
+    "bake it in a hot oven until the crust is brown and the bottom sounds hollow when tapped.",
+    "The river starts as a small stream in the mountains and grows as it collects water from melting snow. "
+    "By the time it reaches the plains it is wide and slow, and farmers along its banks have used it for "
+    "centuries to water their fields, to power their mills and to carry their grain to the markets.",
+    "A hash table stores values in an array of buckets. A hash function turns each key into the index of a "
+    "bucket, so a lookup only has to examine one bucket instead of the whole table. When two keys land in "
+    "the same bucket, the table either chains them in a list or probes for the next free slot.",
+    "She opened the letter slowly, unsure whether she wanted to know what it said. Her grandmother had "
+    "written it many years ago and asked that it only be read after the house was sold. Inside was a map of "
+    "the garden, with a small cross drawn next to the old apple tree by the wall.",
+    "Regular exercise improves the health of the heart and lungs, helps to control weight and lowers the "
+    "risk of many long term illnesses. Even a brisk walk of half an hour on most days of the week makes a "
+    "measurable difference, and the benefits grow when it is combined with a balanced diet and good sleep.",
+]
+
+
+def make_cache(model, key: str, value: str, key_scale: str, value_scale: str, residual_length: int):
+    """A fresh cache for one generate() call, the plain dynamic cache for none/none"""
+    from transformers import DynamicCache
+
+    from transformers_openai.kv_quant import QuantizedKVCache, make_quantizers
+
+    if key == "none" and value == "none":
+        return DynamicCache()
+    quantizers = make_quantizers(key, value, key_scale, value_scale, residual_length)
+    num_layers = model.config.get_text_config(decoder=True).num_hidden_layers
+    return QuantizedKVCache(num_layers, *quantizers, block=residual_length)
+
+
+def cache_bytes(cache) -> int:
+    if hasattr(cache, "nbytes"):
+        return cache.nbytes()
+    return sum(
+        t.numel() * t.element_size() for layer in cache.layers for t in (layer.keys, layer.values) if t is not None
+    )
+
+
+def measure_generation(model, make, batch: int, context: int, new_tokens: int, vocab: int, repeats: int) -> Dict[str, Any]:
+    """Decode throughput and cache memory of a greedy generation from random prompts"""
+    import torch
+
+    generator = torch.Generator().manual_seed(0)
+    input_ids = torch.randint(3, vocab, (batch, context), generator=generator).to(model.device)
+    kwargs = dict(
+        input_ids=input_ids,
+        attention_mask=torch.ones_like(input_ids),
+        max_new_tokens=new_tokens,
+        min_new_tokens=new_tokens,
+        do_sample=False,
+        pad_token_id=0,
+    )
+    with torch.no_grad():
+        model.generate(**kwargs, past_key_values=make())
+        seconds = []
+        for _ in range(repeats):
+            cache = make()
+            start = time.perf_counter()
+            model.generate(**kwargs, past_key_values=cache)
+            seconds.append(time.perf_counter() - start)
+    best = min(seconds)
+    return {
+        "cache_bytes": cache_bytes(cache),
+        "cache_tokens": batch * (context + new_tokens),
+        "seconds": best,
+        "output_tokens_per_second": batch * new_tokens / best,
+    }
+
+
+def score_eval_set(model, tokenizer, make) -> Dict[str, Any]:
+    """Next-token loss and predictions of the second half of every text, given the first half from the cache.
+
+    The continuation is fed one token at a time, so the history it attends to
+    is quantized as it would be while decoding.
+    """
+    import torch
+
+    losses: List[float] = []
+    predictions: List[int] = []
+    with torch.no_grad():
+        for text in EVAL_TEXTS:
+            ids = tokenizer(text, return_tensors="pt").input_ids.to(model.device)
+            split = ids.shape[1] // 2
+            cache = make()
+            logits = model(input_ids=ids[:, :split], past_key_values=cache, use_cache=True).logits[:, -1]
+            for position in range(split, ids.shape[1]):
+                target = ids[:, position]
+                losses.append(torch.nn.functional.cross_entropy(logits.float(), target).item())
+                predictions.append(int(logits.argmax(dim=-1)))
+                logits = model(input_ids=ids[:, position:position + 1], past_key_values=cache, use_cache=True).logits[:, -1]
+    return {"loss": sum(losses) / len(losses), "predictions": predictions, "scored_tokens": len(losses)}
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Benchmark of the quantized KV cache")
+    parser.add_argument("--model", default=None, help="Model to load (default: build the tiny random model)")
+    parser.add_argument("--model-dir", default=None, help="Where the tiny model is built (default: a temp directory)")
+    parser.add_argument("--dtype", default="float32", help="torch dtype of the model")
+    parser.add_argument("--configs", default="none/none,int8/int8,fp8/fp8,int8/fp8", help="Comma separated key/value storage pairs")
+    parser.add_argument("--key-scale", choices=["channel", "token"], default="channel")
+    parser.add_argument("--value-scale", choices=["channel", "token"], default="token")
+    parser.add_argument("--residual-length", type=int, default=32, help="Newest tokens kept in full precision")
+    parser.add_argument("--batch", type=int, default=4)
+    parser.add_argument("--context", type=int, default=1024, help="Prompt tokens per sequence")
+    parser.add_argument("--new-tokens", type=int, default=64)
+    parser.add_argument("--repeats", type=int, default=3, help="Timed generations per configuration, the best counts")
+    parser.add_argument("--output", default=None, help="Also write the JSON report to this file")
+    args = parser.parse_args(argv)
+
+    import torch
+    from transformers import AutoModelForCausalLM, AutoTokenizer
+
+    if args.model is None:
+        from benchmarks.tiny_model import DEFAULT_PATH, build_tiny_model
+
+        args.model = build_tiny_model(args.model_dir or DEFAULT_PATH)
+    tokenizer = AutoTokenizer.from_pretrained(args.model)
+    model = AutoModelForCausalLM.from_pretrained(args.model, dtype=getattr(torch, args.dtype))
+    model.to("cuda" if torch.cuda.is_available() else "cpu").eval()
+
+    results: Dict[str, Dict[str, Any]] = {}
+    reference = None
+    for pair in args.configs.split(","):
+        key, value = pair.split("/")
+        make = lambda: make_cache(model, key, value, args.key_scale, args.value_scale, args.residual_length)
+        result = measure_generation(
+            model, make, args.batch, args.context, args.new_tokens, len(tokenizer), args.repeats
+        )
+        quality = score_eval_set(model, tokenizer, make)
+        if reference is None:
+            reference = {"cache_bytes": result["cache_bytes"], **quality}
+        predictions = quality.pop("predictions")
+        result["memory_saved"] = 1 - result["cache_bytes"] / reference["cache_bytes"]
+        result["bytes_per_token"] = result["cache_bytes"] / result["cache_tokens"]
+        result["eval_loss"] = quality["loss"]
+        result["eval_loss_delta"] = quality["loss"] - reference["loss"]
+        result["top1_agreement"] = sum(
+            a == b for a, b in zip(predictions, reference["predictions"])
+        ) / len(predictions)
+        result["eval_tokens"] = quality["scored_tokens"]
+        results[pair] = result
+
+    report = {
+        "config": {
+            key: getattr(args, key)
+            for key in ("model", "dtype", "key_scale", "value_scale", "residual_length", "batch", "context", "new_tokens")
+        },
+        "reference": args.configs.split(",")[0],
+        "results": results,
+    }
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+    print(text)
+    return report
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,259 @@
+"""
+Load benchmark for the chat completions endpoint
+
+Boots the server in-process against a tiny random local model (see
+benchmarks/tiny_model.py), or targets a running server with --url, and
+drives either an open-loop workload with Poisson arrivals or a closed loop
+with a fixed number of concurrent clients. Prompt and output lengths are
+drawn from log-normal distributions. The report is printed as JSON:
+
+    python -m benchmarks.load --mode poisson --request-rate 8 --num-requests 200
+    python -m benchmarks.load --mode closed --concurrency 16 --output report.json
+    python -m benchmarks.load --url http://127.0.0.1:7088 --model <name> --tokenizer <name>
+
+Arguments the benchmark does not know are passed on to the in-process
+server, e.g. --continuous-batching-batch-size 8.
+"""
+import argparse
+import asyncio
+import json
+import math
+import random
+import socket
+import threading
+import time
+from collections import Counter
+from typing import Any, Dict, List, Optional, Sequence
+
+WORDS = (
+    "the quick brown fox jumps over the lazy dog hello world this is a tiny model used for "
+    "testing and benchmarking the server explain how a transformer language model generates "
+    "one token at a time reasoning final answer"
+).split()
+
+
+def sample_lengths(rng: random.Random, mean: float, sigma: float, count: int, high: Optional[int] = None) -> List[int]:
+    """Log-normal lengths with the given mean, clipped to [1, high]; sigma 0 gives fixed lengths"""
+    high = high or int(mean * 4) or 1
+    mu = math.log(mean) - sigma * sigma / 2
+    return [max(1, min(high, round(rng.lognormvariate(mu, sigma)))) for _ in range(count)]
+
+
+def make_prompt(rng: random.Random, tokenizer, length: int) -> str:
+    """Random words cut to `length` tokens, or roughly that many words without a tokenizer"""
+    text = " ".join(rng.choice(WORDS) for _ in range(length))
+    if tokenizer is None:
+        return text
+    ids = tokenizer(text, add_special_tokens=False).input_ids[:length]
+    return tokenizer.decode(ids)
+
+
+def percentiles(values: Sequence[float]) -> Dict[str, Optional[float]]:
+    if not values:
+        return {"mean": None, "p50": None, "p90": None, "p99": None}
+    ordered = sorted(values)
+
+    def at(q: float) -> float:
+        # Linear interpolation between closest ranks, like numpy.percentile
+        position = (len(ordered) - 1) * q
+        low = math.floor(position)
+        high = min(low + 1, len(ordered) - 1)
+        return ordered[low] + (ordered[high] - ordered[low]) * (position - low)
+
+    return {"mean": sum(ordered) / len(ordered), "p50": at(0.5), "p90": at(0.9), "p99": at(0.99)}
+
+
+def summarize(results: List[Dict[str, Any]], duration: float) -> Dict[str, Any]:
+    """Throughput, latency percentiles and error rate of a finished run"""
+    succeeded = [r for r in results if r["error"] is None]
+    output_tokens = sum(r["output_tokens"] for r in succeeded)
+    prompt_tokens = sum(r["prompt_tokens"] for r in succeeded)
+    errors = Counter(r["error"] for r in results if r["error"] is not None)
+    return {
+        "duration_s": duration,
+        "requests": len(results),
+        "completed": len(succeeded),
+        "failed": len(results) - len(succeeded),
+        "error_rate": (len(results) - len(succeeded)) / len(results) if results else 0.0,
+        "request_throughput": len(succeeded) / duration if duration > 0 else None,
+        "output_token_throughput": output_tokens / duration if duration > 0 else None,
+        "total_token_throughput": (prompt_tokens + output_tokens) / duration if duration > 0 else None,
+        "prompt_tokens": prompt_tokens,
+        "output_tokens": output_tokens,
+        "ttft_s": percentiles([r["ttft"] for r in succeeded if r["ttft"] is not None]),
+        "tpot_s": percentiles([
+            (r["latency"] - r["ttft"]) / (r["output_tokens"] - 1)
+            for r in succeeded
+            if r["ttft"] is not None and r["output_tokens"] > 1
+        ]),
+        "e2e_latency_s": percentiles([r["latency"] for r in succeeded]),
+        "errors": dict(errors.most_common(5)),
+    }
+
+
+async def send_request(client, url: str, model: str, prompt: str, max_tokens: int, temperature: float) -> Dict[str, Any]:
+    """One streamed chat completion, timed from the moment it is sent"""
+    result = {"ttft": None, "latency": None, "prompt_tokens": 0, "output_tokens": 0, "error": None}
+    body = {
+        "model": model,
+        "messages": [{"role": "user", "content": prompt}],
+        "max_tokens": max_tokens,
+        "temperature": temperature,
+        "stream": True,
+    }
+    start = time.perf_counter()
+    try:
+        async with client.stream("POST", f"{url}/v1/chat/completions", json=body) as response:
+            if response.status_code != 200:
+                await response.aread()
+                result["error"] = f"HTTP {response.status_code}"
+                return result
+            async for line in response.aiter_lines():
+                if not line.startswith("data: ") or line == "data: [DONE]":
+                    continue
+                chunk = json.loads(line[len("data: "):])
+                if "error" in chunk:
+                    result["error"] = chunk["error"].get("message", "stream error")
+                    break
+                if result["ttft"] is None and chunk.get("choices"):
+                    result["ttft"] = time.perf_counter() - start
+                if chunk.get("usage"):
+                    result["prompt_tokens"] = chunk["usage"]["prompt_tokens"]
+                    result["output_tokens"] = chunk["usage"]["completion_tokens"]
+    except Exception as e:
+        result["error"] = type(e).__name__
+    result["latency"] = time.perf_counter() - start
+    return result
+
+
+async def run_workload(args, url: str, prompts: List[str], output_lengths: List[int]) -> Dict[str, Any]:
+    import httpx
+
+    rng = random.Random(args.seed + 1)
+    limits = httpx.Limits(max_connections=None, max_keepalive_connections=None)
+    async with httpx.AsyncClient(timeout=args.timeout, limits=limits) as client:
+        def request(index: int):
+            return send_request(client, url, args.model, prompts[index], output_lengths[index], args.temperature)
+
+        for index in range(min(args.warmup, len(prompts))):
+            await request(index)
+
+        start = time.perf_counter()
+        if args.mode == "poisson":
+            # Open loop: arrivals do not wait for earlier requests to finish
+            tasks = []
+            for index in range(len(prompts)):
+                tasks.append(asyncio.create_task(request(index)))
+                if args.request_rate > 0:
+                    await asyncio.sleep(rng.expovariate(args.request_rate))
+            results = await asyncio.gather(*tasks)
+        else:
+            # Closed loop: each client sends its next request when the previous one is done
+            pending = iter(range(len(prompts)))
+            results = []
+
+            async def worker():
+                for index in pending:
+                    results.append(await request(index))
+
+            await asyncio.gather(*(worker() for _ in range(args.concurrency)))
+        duration = time.perf_counter() - start
+
+    return summarize(list(results), duration)
+
+
+def start_server(model_path: str, server_args: List[str]):
+    """Serve the app on a free local port from a background thread"""
+    import uvicorn
+    from transformers_openai.config import config
+
+    # The app reads its configuration on import, like main.py it is parsed first
+    config.parse([
+        "--hf-model", model_path,
+        "--accelerator-type", "cpu",
+        "--torch-dtype", "float32",
+        "--loglevel", "WARNING",
+        *server_args,
+    ])
+    from transformers_openai.app import app
+
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        port = s.getsockname()[1]
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning"))
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    while not server.started:
+        if not thread.is_alive():
+            raise RuntimeError("The server failed to start")
+        time.sleep(0.05)
+    return f"http://127.0.0.1:{port}", server, thread
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Load benchmark for the chat completions endpoint")
+    parser.add_argument("--mode", choices=["poisson", "closed"], default="poisson")
+    parser.add_argument("--num-requests", type=int, default=100)
+    parser.add_argument("--request-rate", type=float, default=4.0, help="Poisson arrivals per second, 0 sends everything at once")
+    parser.add_argument("--concurrency", type=int, default=8, help="Clients in the closed loop")
+    parser.add_argument("--input-len", type=float, default=128, help="Mean prompt length in tokens")
+    parser.add_argument("--output-len", type=float, default=64, help="Mean max_tokens per request")
+    parser.add_argument("--len-sigma", type=float, default=0.5, help="Log-normal shape of both lengths, 0 for fixed lengths")
+    parser.add_argument("--temperature", type=float, default=1.0)
+    parser.add_argument("--warmup", type=int, default=2, help="Requests sent before measuring")
+    parser.add_argument("--timeout", type=float, default=300.0)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--url", default=None, help="Benchmark a running server instead of the in-process one")
+    parser.add_argument("--model", default=None, help="Model name for --url")
+    parser.add_argument("--tokenizer", default=None, help="Tokenizer used to size prompts (default: the served model)")
+    parser.add_argument("--model-dir", default=None, help="Where the tiny model is built (default: a temp directory)")
+    parser.add_argument("--output", default=None, help="Also write the JSON report to this file")
+    args, server_args = parser.parse_known_args(argv)
+
+    from benchmarks.tiny_model import DEFAULT_PATH, build_tiny_model
+
+    server = None
+    if args.url:
+        if not args.model:
+            parser.error("--model is required with --url")
+        url = args.url.rstrip("/")
+        tokenizer_name = args.tokenizer
+    else:
+        args.model = build_tiny_model(args.model_dir or DEFAULT_PATH)
+        url, server, thread = start_server(args.model, server_args)
+        tokenizer_name = args.tokenizer or args.model
+
+    tokenizer = None
+    if tokenizer_name:
+        from transformers import AutoTokenizer
+        tokenizer = AutoTokenizer.from_pretrained(tokenizer_name)
+
+    rng = random.Random(args.seed)
+    input_lengths = sample_lengths(rng, args.input_len, args.len_sigma, args.num_requests)
+    output_lengths = sample_lengths(rng, args.output_len, args.len_sigma, args.num_requests)
+    prompts = [make_prompt(rng, tokenizer, length) for length in input_lengths]
+
+    try:
+        report = asyncio.run(run_workload(args, url, prompts, output_lengths))
+    finally:
+        if server is not None:
+            server.should_exit = True
+            thread.join(timeout=10)
+
+    report = {
+        "config": {
+            key: getattr(args, key)
+            for key in ("mode", "num_requests", "request_rate", "concurrency", "input_len", "output_len", "len_sigma", "temperature", "seed")
+        } | {"url": args.url, "model": args.model, "server_args": server_args},
+        **report,
+    }
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+    print(text)
+    return report
+
+
+if __name__ == "__main__":
+    main()
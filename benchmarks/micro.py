@@ -0,0 +1,214 @@
+"""
+Microbenchmarks for the per-token CPU work around the model
+
+Each case replays what the server does for one generated sequence of a
+given length, without running a model: stop-sequence scanning, streaming
+reasoning parsing, final reasoning parsing, SSE serialization of every
+chunk and chat prompt formatting.
+
+    python -m benchmarks.micro                                    # print results
+    python -m benchmarks.micro --save benchmarks/baselines/micro.json
+    python -m benchmarks.micro --compare benchmarks/baselines/micro.json
+
+The comparison flags cases that got slower than the baseline by more than
+--tolerance, and cases whose cost per token grows by more than
+--max-growth from the shortest to the longest length, which catches
+super-linear work independently of the machine.
+"""
+import argparse
+import json
+import random
+import sys
+import time
+from typing import Callable, Dict, List, Optional
+
+DEFAULT_LENGTHS = [100, 1000, 8000]
+WORDS = "the quick brown fox jumps over lazy dog model token stream text answer because".split()
+
+CASES: Dict[str, Callable[[int], Callable[[], None]]] = {}
+
+
+def case(name: str):
+    def register(setup: Callable[[int], Callable[[], None]]):
+        CASES[name] = setup
+        return setup
+    return register
+
+
+def _pieces(length: int, seed: int = 0) -> List[str]:
+    """Text deltas as a detokenizer hands them out, about one word per token"""
+    rng = random.Random(seed)
+    return [" " + rng.choice(WORDS) for _ in range(length)]
+
+
+def _reasoning_pieces(length: int) -> List[str]:
+    half = length // 2
+    return ["<think>"] + _pieces(half) + ["</think>"] + _pieces(length - half, seed=1)
+
+
+_manager = None
+
+
+def _model_manager():
+    """A ModelManager without a model, with the DeepSeek R1 reasoning parser switched on"""
+    global _manager
+    if _manager is None:
+        from transformers_openai.config import config
+        from transformers_openai.model_manager import ModelManager
+
+        config.args.reasoning_parser = "deepseek_r1"
+        _manager = ModelManager()
+    return _manager
+
+
+@case("stop_scan")
+def stop_scan(length: int):
+    from transformers_openai.generation import find_stop
+
+    pieces = _pieces(length)
+    stop_sequences = ["<|stop|>", "\n\nUser:"]
+
+    def run():
+        text = ""
+        for piece in pieces:
+            text += piece
+            if find_stop(text, stop_sequences, len(piece)) >= 0:
+                raise AssertionError("unexpected stop")
+    return run
+
+
+@case("streaming_reasoning")
+def streaming_reasoning(length: int):
+    from transformers_openai.generation import ThinkTags
+
+    manager = _model_manager()
+    pieces = _reasoning_pieces(length)
+
+    def run():
+        text = ""
+        tags = ThinkTags()
+        for piece in pieces:
+            text += piece
+            manager._handle_streaming_reasoning(piece, text, tags)
+    return run
+
+
+@case("parse_reasoning")
+def parse_reasoning(length: int):
+    manager = _model_manager()
+    text = "".join(_reasoning_pieces(length))
+
+    def run():
+        manager._parse_deepseek_r1_reasoning(text)
+    return run
+
+
+@case("sse_serialization")
+def sse_serialization(length: int):
+    from transformers_openai.models import ChatCompletionStreamChoice, ChatCompletionStreamResponse
+
+    pieces = _pieces(length)
+
+    def run():
+        # The same models generate_stream builds for every chunk
+        for piece in pieces:
+            response = ChatCompletionStreamResponse(
+                id="chatcmpl-benchmark",
+                model="benchmark",
+                choices=[ChatCompletionStreamChoice(index=0, delta={"content": piece}, finish_reason=None)],
+            )
+            f"data: {response.model_dump_json()}\n\n"
+    return run
+
+
+@case("format_chat_prompt")
+def format_chat_prompt(length: int):
+    from transformers import AutoTokenizer
+
+    from benchmarks.tiny_model import DEFAULT_PATH, build_tiny_model
+
+    manager = _model_manager()
+    if manager.tokenizer is None:
+        manager.tokenizer = AutoTokenizer.from_pretrained(build_tiny_model(DEFAULT_PATH))
+    # A conversation of `length` tokens in turns of about 100
+    pieces = _pieces(length)
+    messages = [
+        {"role": "user" if turn % 2 == 0 else "assistant", "content": "".join(pieces[start:start + 100])}
+        for turn, start in enumerate(range(0, length, 100))
+    ]
+
+    def run():
+        manager.format_chat_prompt(messages)
+    return run
+
+
+def measure(setup: Callable[[int], Callable[[], None]], length: int, repeat: int) -> Dict[str, float]:
+    """Best of `repeat` runs, as total milliseconds and microseconds per token"""
+    run = setup(length)
+    run()
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        run()
+        best = min(best, time.perf_counter() - start)
+    return {"total_ms": best * 1e3, "per_token_us": best * 1e6 / length}
+
+
+def compare(results: Dict, baseline: Dict, tolerance: float, max_growth: float) -> List[str]:
+    """Regressions against the baseline and super-linear growth, as readable lines"""
+    problems = []
+    for name, lengths in results.items():
+        for length, result in lengths.items():
+            reference = baseline.get(name, {}).get(length)
+            if reference and result["total_ms"] > reference["total_ms"] * (1 + tolerance):
+                problems.append(
+                    f"{name} @ {length} tokens: {result['total_ms']:.3f} ms vs baseline "
+                    f"{reference['total_ms']:.3f} ms (+{result['total_ms'] / reference['total_ms'] - 1:.0%})"
+                )
+        ordered = sorted(lengths, key=int)
+        if len(ordered) > 1:
+            growth = lengths[ordered[-1]]["per_token_us"] / lengths[ordered[0]]["per_token_us"]
+            if growth > max_growth:
+                problems.append(
+                    f"{name}: cost per token grows {growth:.1f}x from {ordered[0]} to {ordered[-1]} tokens"
+                )
+    return problems
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Microbenchmarks for per-token hot paths")
+    parser.add_argument("--cases", nargs="*", choices=sorted(CASES), default=sorted(CASES))
+    parser.add_argument("--lengths", nargs="*", type=int, default=DEFAULT_LENGTHS, help="Output lengths in tokens")
+    parser.add_argument("--repeat", type=int, default=5, help="Runs per measurement, the fastest counts")
+    parser.add_argument("--save", default=None, help="Write the results to this baseline file")
+    parser.add_argument("--compare", default=None, help="Baseline file to check the results against")
+    parser.add_argument("--tolerance", type=float, default=0.5, help="Allowed slowdown against the baseline (default: 0.5 = +50%%)")
+    parser.add_argument("--max-growth", type=float, default=3.0, help="Allowed growth of the cost per token from the shortest to the longest length")
+    args = parser.parse_args(argv)
+
+    results = {}
+    for name in args.cases:
+        results[name] = {}
+        for length in args.lengths:
+            result = results[name][str(length)] = measure(CASES[name], length, args.repeat)
+            print(f"{name:<22} {length:>6} tokens  {result['total_ms']:10.3f} ms  {result['per_token_us']:8.3f} us/token")
+
+    if args.save:
+        with open(args.save, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+            f.write("\n")
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)
+        problems = compare(results, baseline, args.tolerance, args.max_growth)
+        for problem in problems:
+            print(f"REGRESSION {problem}")
+        if problems:
+            return 1
+        print("No regressions against the baseline")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
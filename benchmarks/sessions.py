@@ -0,0 +1,140 @@
+"""
+Benchmark of multi-turn chats with and without session KV caches
+
+Boots the server in-process against the tiny random model (see
+benchmarks/tiny_model.py) with --session-cache, or targets a running
+server with --url, and plays the same conversations twice, once with a
+session_id and once without. Every turn appends the reply and a new user
+message, so without a session the prompt, and the time to first token,
+grows with the conversation. The report holds the median TTFT and prompt
+/ cached tokens per turn for both runs as JSON:
+
+    python -m benchmarks.sessions --turns 20 --conversations 4
+    python -m benchmarks.sessions --url http://127.0.0.1:7088 --model <name>
+
+Arguments the benchmark does not know are passed on to the in-process
+server, e.g. --session-device-mb 256.
+"""
+import argparse
+import asyncio
+import json
+import random
+import statistics
+import time
+import uuid
+from typing import Any, Dict, List, Optional
+
+from benchmarks.load import start_server
+
+WORDS = "the order arrived late and the box was damaged so I would like to know how a refund works".split()
+
+
+async def chat_turn(client, url: str, model: str, messages: List[Dict[str, str]], max_tokens: int, session_id: Optional[str]):
+    """One streamed greedy turn: its TTFT, usage and reply"""
+    body = {"model": model, "messages": messages, "max_tokens": max_tokens, "temperature": 0, "stream": True}
+    if session_id:
+        body["session_id"] = session_id
+    start = time.perf_counter()
+    ttft, usage, reply = None, {}, ""
+    async with client.stream("POST", f"{url}/v1/chat/completions", json=body) as response:
+        response.raise_for_status()
+        async for line in response.aiter_lines():
+            if not line.startswith("data: ") or line == "data: [DONE]":
+                continue
+            chunk = json.loads(line[len("data: "):])
+            if ttft is None and chunk.get("choices"):
+                ttft = time.perf_counter() - start
+            for choice in chunk.get("choices", []):
+                reply += choice["delta"].get("content") or ""
+            usage = chunk.get("usage") or usage
+    return ttft, usage, reply
+
+
+async def run_conversations(args, url: str, sessions: bool) -> List[List[Dict[str, Any]]]:
+    """Per conversation, the measurements of each turn"""
+    import httpx
+
+    rng = random.Random(args.seed)
+    runs = []
+    async with httpx.AsyncClient(timeout=args.timeout) as client:
+        for _ in range(args.conversations):
+            session_id = uuid.uuid4().hex if sessions else None
+            messages = [{"role": "system", "content": "You are a support assistant for an online shop."}]
+            turns = []
+            for _ in range(args.turns):
+                messages.append({"role": "user", "content": " ".join(rng.choices(WORDS, k=args.turn_words))})
+                ttft, usage, reply = await chat_turn(client, url, args.model, messages, args.max_tokens, session_id)
+                messages.append({"role": "assistant", "content": reply})
+                turns.append({
+                    "ttft": ttft,
+                    "prompt_tokens": usage.get("prompt_tokens"),
+                    "cached_tokens": usage.get("cached_tokens") or 0,
+                })
+            runs.append(turns)
+    return runs
+
+
+def per_turn(runs: List[List[Dict[str, Any]]]) -> List[Dict[str, Any]]:
+    return [
+        {
+            "turn": index + 1,
+            "ttft_p50": statistics.median(run[index]["ttft"] for run in runs),
+            "prompt_tokens": statistics.median(run[index]["prompt_tokens"] for run in runs),
+            "cached_tokens": statistics.median(run[index]["cached_tokens"] for run in runs),
+        }
+        for index in range(len(runs[0]))
+    ]
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Benchmark of multi-turn chats with and without session KV caches")
+    parser.add_argument("--turns", type=int, default=20)
+    parser.add_argument("--conversations", type=int, default=3)
+    parser.add_argument("--turn-words", type=int, default=40, help="Words in every user message")
+    parser.add_argument("--max-tokens", type=int, default=32, help="Reply length of every turn")
+    parser.add_argument("--timeout", type=float, default=300.0)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--url", default=None, help="Benchmark a running server started with --session-cache True")
+    parser.add_argument("--model", default=None, help="Model name for --url")
+    parser.add_argument("--model-dir", default=None, help="Where the tiny model is built (default: a temp directory)")
+    parser.add_argument("--output", default=None, help="Also write the JSON report to this file")
+    args, server_args = parser.parse_known_args(argv)
+
+    server = None
+    if args.url:
+        if not args.model:
+            parser.error("--model is required with --url")
+        url = args.url.rstrip("/")
+    else:
+        from benchmarks.tiny_model import DEFAULT_PATH, build_tiny_model
+
+        args.model = build_tiny_model(args.model_dir or DEFAULT_PATH)
+        url, server, thread = start_server(args.model, ["--session-cache", "True", *server_args])
+
+    try:
+        # The first request pays for lazy initialization, it is not measured
+        asyncio.run(run_conversations(argparse.Namespace(**{**vars(args), "turns": 1, "conversations": 1}), url, False))
+        without = asyncio.run(run_conversations(args, url, sessions=False))
+        with_sessions = asyncio.run(run_conversations(args, url, sessions=True))
+    finally:
+        if server is not None:
+            server.should_exit = True
+            thread.join(timeout=10)
+
+    report = {
+        "config": {
+            key: getattr(args, key) for key in ("turns", "conversations", "turn_words", "max_tokens", "seed")
+        } | {"url": args.url, "model": args.model, "server_args": server_args},
+        "without_sessions": per_turn(without),
+        "with_sessions": per_turn(with_sessions),
+    }
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+    print(text)
+    return report
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,157 @@
+"""
+Benchmark of the attention sink cache on long dialogs
+
+A long multi-turn dialog is rendered with the model's chat template and
+fed through the model one token at a time, as it would be decoded, once
+with the full KV cache and once per sink tokens / window configuration.
+For every configuration the report holds the next-token loss over the
+dialog and over its last quarter, where the window has long been
+sliding, the change in loss and top-1 agreement against the full cache,
+the cache memory at the end and the decode throughput, as JSON:
+
+    python -m benchmarks.sink_cache
+    python -m benchmarks.sink_cache --model Qwen/Qwen2.5-0.5B-Instruct --dtype bfloat16 --tokens 8192 --configs 4:1024,4:2048,0:1024
+    python -m benchmarks.sink_cache --data dialogs.jsonl
+
+A configuration is sink_tokens:window; 0:window is a plain sliding window,
+the baseline attention sinks are meant to beat. --data reads a JSONL file
+with one {"messages": [...]} dialog per line, they are joined until the
+dialog holds --tokens tokens; without it a dialog is built from the texts
+of benchmarks/kv_cache.py. Without --model a tiny random model is built
+(see benchmarks/tiny_model.py); its memory and throughput numbers are
+real, its quality numbers only show that the check runs.
+"""
+import argparse
+import json
+import time
+from typing import Any, Dict, List, Optional
+
+from benchmarks.kv_cache import EVAL_TEXTS, cache_bytes
+
+
+def load_dialogs(path: Optional[str]) -> List[List[Dict[str, str]]]:
+    """Dialogs from a JSONL file, or one built from the eval texts split into turns"""
+    if path:
+        with open(path, encoding="utf-8") as f:
+            return [json.loads(line)["messages"] for line in f if line.strip()]
+    messages = [{"role": "system", "content": "You are a helpful assistant."}]
+    for text in EVAL_TEXTS:
+        sentences = [s.strip() + "." for s in text.split(".") if s.strip()]
+        messages.append({"role": "user", "content": "Tell me more. " + sentences[0]})
+        messages.append({"role": "assistant", "content": " ".join(sentences[1:]) or sentences[0]})
+    return [messages]
+
+
+def dialog_ids(tokenizer, dialogs: List[List[Dict[str, str]]], tokens: int) -> List[int]:
+    """Token ids of the dialogs, repeated in turn until there are `tokens` of them"""
+    ids: List[int] = []
+    while len(ids) < tokens:
+        for messages in dialogs:
+            try:
+                text = tokenizer.apply_chat_template(messages, tokenize=False)
+            except Exception:
+                text = "".join(f"{m['role']}: {m['content']}\n" for m in messages)
+            ids += tokenizer(text, add_special_tokens=False).input_ids
+    return ids[:tokens]
+
+
+def make_cache(model, sink_tokens: Optional[int], window: Optional[int]):
+    """A fresh cache, the plain dynamic cache without a window"""
+    from transformers import DynamicCache
+
+    from transformers_openai.sink_cache import SinkCache, rotary_inv_freq
+
+    if window is None:
+        return DynamicCache()
+    num_layers = model.config.get_text_config(decoder=True).num_hidden_layers
+    return SinkCache(num_layers, sink_tokens, window, rotary_inv_freq(model))
+
+
+def score_dialog(model, ids: List[int], cache) -> Dict[str, Any]:
+    """Next-token losses and predictions of every token after the first, fed one token at a time"""
+    import torch
+
+    input_ids = torch.tensor([ids], device=model.device)
+    losses: List[float] = []
+    predictions: List[int] = []
+    with torch.no_grad():
+        start = time.perf_counter()
+        for position in range(len(ids) - 1):
+            logits = model(
+                input_ids=input_ids[:, position:position + 1],
+                attention_mask=torch.ones_like(input_ids[:, :position + 1]),
+                past_key_values=cache,
+                use_cache=True,
+            ).logits[:, -1]
+            target = input_ids[:, position + 1]
+            losses.append(torch.nn.functional.cross_entropy(logits.float(), target).item())
+            predictions.append(int(logits.argmax(dim=-1)))
+        seconds = time.perf_counter() - start
+    return {
+        "losses": losses,
+        "predictions": predictions,
+        "cache_bytes": cache_bytes(cache),
+        "tokens_per_second": len(losses) / seconds,
+    }
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Benchmark of the attention sink cache on long dialogs")
+    parser.add_argument("--model", default=None, help="Model to load (default: build the tiny random model)")
+    parser.add_argument("--model-dir", default=None, help="Where the tiny model is built (default: a temp directory)")
+    parser.add_argument("--dtype", default="float32", help="torch dtype of the model")
+    parser.add_argument("--configs", default="4:256,4:512,0:256", help="Comma separated sink_tokens:window pairs")
+    parser.add_argument("--tokens", type=int, default=2048, help="Length of the dialog in tokens")
+    parser.add_argument("--data", default=None, help="JSONL file of {\"messages\": [...]} dialogs")
+    parser.add_argument("--output", default=None, help="Also write the JSON report to this file")
+    args = parser.parse_args(argv)
+
+    import torch
+    from transformers import AutoModelForCausalLM, AutoTokenizer
+
+    if args.model is None:
+        from benchmarks.tiny_model import DEFAULT_PATH, build_tiny_model
+
+        args.model = build_tiny_model(args.model_dir or DEFAULT_PATH)
+    tokenizer = AutoTokenizer.from_pretrained(args.model)
+    model = AutoModelForCausalLM.from_pretrained(args.model, dtype=getattr(torch, args.dtype))
+    model.to("cuda" if torch.cuda.is_available() else "cpu").eval()
+    ids = dialog_ids(tokenizer, load_dialogs(args.data), args.tokens)
+    tail = len(ids) * 3 // 4
+
+    reference = score_dialog(model, ids, make_cache(model, None, None))
+    results: Dict[str, Dict[str, Any]] = {}
+    for name in ["full", *args.configs.split(",")]:
+        if name == "full":
+            scored = reference
+        else:
+            sink_tokens, window = (int(part) for part in name.split(":"))
+            scored = score_dialog(model, ids, make_cache(model, sink_tokens, window))
+        losses, predictions = scored["losses"], scored["predictions"]
+        results[name] = {
+            "eval_loss": sum(losses) / len(losses),
+            "eval_loss_delta": (sum(losses) - sum(reference["losses"])) / len(losses),
+            "tail_loss": sum(losses[tail:]) / len(losses[tail:]),
+            "tail_loss_delta": (sum(losses[tail:]) - sum(reference["losses"][tail:])) / len(losses[tail:]),
+            "top1_agreement": sum(a == b for a, b in zip(predictions, reference["predictions"])) / len(predictions),
+            "cache_bytes": scored["cache_bytes"],
+            "memory_saved": 1 - scored["cache_bytes"] / reference["cache_bytes"],
+            "tokens_per_second": scored["tokens_per_second"],
+        }
+
+    report = {
+        "config": {key: getattr(args, key) for key in ("model", "dtype", "tokens", "data")},
+        "dialog_tokens": len(ids),
+        "reference": "full",
+        "results": results,
+    }
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+    print(text)
+    return report
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+"""
+Builds a tiny randomly initialized chat model for benchmarks and tests
+
+Nothing is downloaded: a byte-level BPE tokenizer is trained on a small
+built-in corpus and a Llama model with random weights is saved next to it.
+The outputs are gibberish, but every code path of the server runs exactly
+as it would for a real model. build_tiny_llama() makes an even smaller one
+in memory, for tests that drive the model directly and need no tokenizer.
+"""
+import argparse
+import os
+import tempfile
+
+DEFAULT_PATH = os.path.join(tempfile.gettempdir(), "transformers-openai-tiny-model")
+
+CHAT_TEMPLATE = (
+    "{% for m in messages %}<|im_start|>{{ m['role'] }}\n{{ m['content'] }}<|im_end|>\n{% endfor %}"
+    "{% if add_generation_prompt %}<|im_start|>assistant\n{% endif %}"
+)
+
+CORPUS = [
+    "hello world this is a tiny model used for testing and benchmarking the server",
+    "the quick brown fox jumps over the lazy dog 0123456789 {}[]\":,.!?",
+    "explain how a transformer language model generates one token at a time",
+    "<think> reasoning happens here </think> and then the final answer follows",
+]
+
+
+def build_tiny_model(
+    path: str = DEFAULT_PATH,
+    vocab_size: int = 512,
+    hidden_size: int = 64,
+    num_layers: int = 2,
+    seed: int = 0,
+) -> str:
+    """Create the model at `path` unless it is already there, and return the path"""
+    if os.path.exists(os.path.join(path, "config.json")):
+        return path
+
+    import torch
+    from tokenizers import Tokenizer, decoders, models, pre_tokenizers, trainers
+    from transformers import LlamaConfig, LlamaForCausalLM, PreTrainedTokenizerFast
+
+    tokenizer = Tokenizer(models.BPE(unk_token=None))
+    tokenizer.pre_tokenizer = pre_tokenizers.ByteLevel(add_prefix_space=False)
+    tokenizer.decoder = decoders.ByteLevel()
+    trainer = trainers.BpeTrainer(
+        vocab_size=vocab_size,
+        special_tokens=["<|endoftext|>", "<|im_start|>", "<|im_end|>"],
+        initial_alphabet=pre_tokenizers.ByteLevel.alphabet(),
+    )
+    tokenizer.train_from_iterator(CORPUS * 50, trainer)
+    tokenizer = PreTrainedTokenizerFast(
+        tokenizer_object=tokenizer,
+        eos_token="<|im_end|>",
+        pad_token="<|endoftext|>",
+        bos_token="<|endoftext|>",
+    )
+    tokenizer.chat_template = CHAT_TEMPLATE
+    tokenizer.save_pretrained(path)
+
+    torch.manual_seed(seed)
+    model_config = LlamaConfig(
+        vocab_size=len(tokenizer),
+        hidden_size=hidden_size,
+        intermediate_size=hidden_size * 2,
+        num_hidden_layers=num_layers,
+        num_attention_heads=4,
+        num_key_value_heads=2,
+        max_position_embeddings=16384,
+        eos_token_id=tokenizer.eos_token_id,
+        pad_token_id=tokenizer.pad_token_id,
+        bos_token_id=tokenizer.bos_token_id,
+    )
+    LlamaForCausalLM(model_config).save_pretrained(path)
+    return path
+
+
+def build_tiny_llama(num_layers: int = 2, seed: int = 0):
+    """A Llama with random weights over 64 token ids, in eval mode; id 0 pads and id 1 ends a sequence"""
+    import torch
+    from transformers import LlamaConfig, LlamaForCausalLM
+
+    torch.manual_seed(seed)
+    model_config = LlamaConfig(
+        vocab_size=64,
+        hidden_size=32,
+        intermediate_size=64,
+        num_hidden_layers=num_layers,
+        num_attention_heads=4,
+        num_key_value_heads=2,
+        eos_token_id=1,
+        pad_token_id=0,
+    )
+    return LlamaForCausalLM(model_config).eval()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build a tiny random chat model")
+    parser.add_argument("path", nargs="?", default=DEFAULT_PATH)
+    parser.add_argument("--hidden-size", type=int, default=64)
+    parser.add_argument("--num-layers", type=int, default=2)
+    args = parser.parse_args()
+    print(build_tiny_model(args.path, hidden_size=args.hidden_size, num_layers=args.num_layers))
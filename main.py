@@ -12,6 +12,8 @@ from transformers_openai.config import config
 
 def main():
     """Main entry point"""
+    config.parse()
+    
     # Configure logging
     logging.basicConfig(
         level=getattr(logging, config.args.loglevel.upper()),
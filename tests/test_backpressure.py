@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+"""
+Tests for bounded stream buffers and stalled stream handling (no server or model required)
+"""
+
+import asyncio
+import threading
+
+import torch
+
+from transformers_openai.generation import StreamStalled, TokenStreamer
+from transformers_openai.scheduler import Scheduler, StreamSlot
+
+
+def _produce(streamer, steps):
+    """Feed the streamer like generate() would, in a thread; the thread and what it raised"""
+    outcome = {}
+
+    def run():
+        try:
+            streamer.put(torch.tensor([0]))  # The prompt, skipped
+            for step in range(steps):
+                streamer.put(torch.tensor([step]))
+        except Exception as e:
+            outcome["error"] = e
+        finally:
+            streamer.end()
+
+    thread = threading.Thread(target=run)
+    thread.start()
+    return thread, outcome
+
+
+def test_full_buffer_pauses_the_producer():
+    """The producer stops at max_buffer unread steps and resumes as the consumer reads"""
+    async def run():
+        events = []
+        streamer = TokenStreamer(
+            max_buffer=4, on_stall=lambda: events.append("stall"), on_resume=lambda: events.append("resume")
+        )
+        thread, outcome = _produce(streamer, 10)
+        await asyncio.sleep(0.1)
+        assert streamer.queue.qsize() == 4 and events == ["stall"]
+        steps = [step async for step, _ in streamer]
+        thread.join(1)
+        assert [step[0] for step in steps] == list(range(10))
+        assert "error" not in outcome and events.count("stall") == events.count("resume") >= 1
+
+    asyncio.run(run())
+
+
+def test_stalled_consumer_aborts_the_generation():
+    """A consumer that does not read for stall_timeout seconds ends the generation with StreamStalled"""
+    async def run():
+        streamer = TokenStreamer(max_buffer=2, stall_timeout=0.05)
+        thread, outcome = _produce(streamer, 10)
+        await asyncio.to_thread(thread.join, 1)
+        assert isinstance(outcome["error"], StreamStalled)
+        # What was buffered before the stall is still delivered
+        assert [step async for step, _ in streamer] == [[0], [1]]
+
+    asyncio.run(run())
+
+
+def test_closing_unblocks_a_paused_producer():
+    """A consumer that goes away frees the producer at once and nothing more is queued"""
+    async def run():
+        streamer = TokenStreamer(max_buffer=1)
+        thread, outcome = _produce(streamer, 10)
+        await asyncio.sleep(0.05)
+        assert thread.is_alive()
+        streamer.close()
+        await asyncio.to_thread(thread.join, 1)
+        assert not thread.is_alive() and "error" not in outcome
+        await asyncio.sleep(0)
+        assert streamer.queue.qsize() == 2  # The one step buffered and the end marker
+
+    asyncio.run(run())
+
+
+def test_paused_stream_hands_its_slot_over():
+    """A stream released from its thread lets a waiter in, and waits for a slot again to resume"""
+    async def run():
+        scheduler = Scheduler(1)
+        slot = StreamSlot(scheduler)
+        await slot.acquire()
+        waiter = asyncio.create_task(scheduler.acquire())
+        await asyncio.sleep(0)
+        await asyncio.to_thread(slot.release_soon)
+        await asyncio.wait_for(waiter, 1)
+        resumed = asyncio.create_task(asyncio.to_thread(slot.reacquire))
+        await asyncio.sleep(0.05)
+        assert not resumed.done()
+        scheduler.release()
+        await asyncio.wait_for(resumed, 1)
+        assert slot.held and scheduler.running == 1
+        # Closing cancels a pending reacquire and releases for good
+        await asyncio.to_thread(slot.release_soon)
+        await asyncio.sleep(0)
+        other = StreamSlot(scheduler)
+        await other.acquire()
+        pending = asyncio.create_task(asyncio.to_thread(slot.reacquire))
+        await asyncio.sleep(0.05)
+        slot.close()
+        await asyncio.wait_for(pending, 1)
+        other.close()
+        assert not slot.held and scheduler.running == 0 and scheduler.num_waiting == 0
+
+    asyncio.run(run())
+
+
+if __name__ == "__main__":
+    test_full_buffer_pauses_the_producer()
+    test_stalled_consumer_aborts_the_generation()
+    test_closing_unblocks_a_paused_producer()
+    test_paused_stream_hands_its_slot_over()
+    print("✅ All backpressure tests passed")
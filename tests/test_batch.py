@@ -0,0 +1,188 @@
+#!/usr/bin/env python3
+"""
+Tests for the offline batch runner (no server or model required)
+"""
+
+import asyncio
+import json
+import tempfile
+
+from transformers_openai.batch import BatchRunner, FileStore
+from transformers_openai.scheduler import Scheduler
+
+
+class FakeModelManager:
+    """Echoes prompts back and records the batches it was asked to generate"""
+
+    model_name = "fake-model"
+
+    def __init__(self):
+        self.calls = []
+        self.kwargs = []
+
+    def format_chat_prompt(self, messages, max_tokens=0):
+        return " ".join(message["content"] for message in messages)
+
+    def generate_text(self, prompt, n=1, **kwargs):
+        self.calls.append(list(prompt))
+        self.kwargs.append(kwargs)
+        choices = [
+            {"index": i, "text": p.upper(), "reasoning_content": None, "finish_reason": "stop", "completion_tokens": 1}
+            for i, p in enumerate(p for p in prompt for _ in range(n))
+        ]
+        return {"choices": choices, "prompt_token_counts": [len(p.split()) for p in prompt]}
+
+
+def _write_input(files, requests):
+    file_id = files.new_id()
+    with open(files.content_path(file_id), "w") as f:
+        for request in requests:
+            f.write(json.dumps(request) + "\n")
+    files.register(file_id, "input.jsonl", "batch")
+    return file_id
+
+
+def _chat(custom_id, content, max_tokens=8):
+    return {
+        "custom_id": custom_id,
+        "method": "POST",
+        "url": "/v1/chat/completions",
+        "body": {"model": "fake-model", "messages": [{"role": "user", "content": content}], "max_tokens": max_tokens},
+    }
+
+
+async def _run_until_done(runner, batch_id):
+    runner.start()
+    for _ in range(200):
+        if runner.get(batch_id)["status"] in ("completed", "failed", "cancelled"):
+            break
+        await asyncio.sleep(0.01)
+    await runner.stop()
+    return runner.get(batch_id)
+
+
+def test_batches_are_grouped_by_params_and_sorted_by_length():
+    """Requests with the same parameters share a generate call, shortest first"""
+    with tempfile.TemporaryDirectory() as root:
+        files = FileStore(root)
+        manager = FakeModelManager()
+        requests = [_chat("a", "x x x"), _chat("b", "x"), _chat("c", "x x", max_tokens=4), _chat("d", "x x")]
+        file_id = _write_input(files, requests)
+
+        async def run():
+            runner = BatchRunner(root, files, Scheduler(1), manager, batch_size=8)
+            batch = runner.create(file_id, "/v1/chat/completions")
+            return await _run_until_done(runner, batch["id"])
+
+        batch = asyncio.run(run())
+        assert batch["status"] == "completed"
+        assert batch["request_counts"] == {"total": 4, "completed": 4, "failed": 0}
+        assert manager.calls == [["x x"], ["x", "x x", "x x x"]]
+
+        with open(files.content_path(batch["output_file_id"])) as f:
+            results = {line["custom_id"]: line for line in map(json.loads, f)}
+        assert results["a"]["response"]["body"]["choices"][0]["message"]["content"] == "X X X"
+
+
+def test_sampling_parameters_are_passed_per_prompt():
+    """Requests differing only in sampling parameters share one generate call"""
+    with tempfile.TemporaryDirectory() as root:
+        files = FileStore(root)
+        manager = FakeModelManager()
+        requests = [_chat("a", "x"), _chat("b", "x x"), _chat("c", "x x x")]
+        requests[0]["body"].update(temperature=0, seed=3)
+        requests[2]["body"].update(top_p=0.5, top_k=4, presence_penalty=1.0)
+        file_id = _write_input(files, requests)
+
+        async def run():
+            runner = BatchRunner(root, files, Scheduler(1), manager, batch_size=8)
+            batch = runner.create(file_id, "/v1/chat/completions")
+            return await _run_until_done(runner, batch["id"])
+
+        assert asyncio.run(run())["status"] == "completed"
+        assert manager.calls == [["x", "x x", "x x x"]]
+        kwargs = manager.kwargs[0]
+        assert kwargs["temperature"] == [0, 1.0, 1.0]
+        assert kwargs["top_p"] == [1.0, 1.0, 0.5]
+        assert kwargs["top_k"] == [0, 0, 4]
+        assert kwargs["presence_penalty"] == [0.0, 0.0, 1.0]
+        assert kwargs["seed"] == [3, None, None]
+
+
+def test_requests_with_and_without_logprobs_are_grouped_apart():
+    """Completions mixing logprobs=None and logprobs=2 run as two groups instead of failing"""
+    with tempfile.TemporaryDirectory() as root:
+        files = FileStore(root)
+        manager = FakeModelManager()
+        requests = [
+            {"custom_id": name, "method": "POST", "url": "/v1/completions", "body": {"model": "fake-model", "prompt": name}}
+            for name in ("a", "b", "c")
+        ]
+        requests[1]["body"]["logprobs"] = 2
+        file_id = _write_input(files, requests)
+
+        async def run():
+            runner = BatchRunner(root, files, Scheduler(1), manager, batch_size=8)
+            batch = runner.create(file_id, "/v1/completions")
+            return await _run_until_done(runner, batch["id"])
+
+        batch = asyncio.run(run())
+        assert batch["status"] == "completed"
+        assert batch["request_counts"] == {"total": 3, "completed": 3, "failed": 0}
+        assert sorted(manager.calls) == [["a", "c"], ["b"]]
+        assert sorted((kwargs["logprobs"], kwargs["top_logprobs"]) for kwargs in manager.kwargs) == [(False, 0), (True, 2)]
+
+
+def test_interrupted_batch_resumes_missing_requests():
+    """Only requests without a result are run again after a restart"""
+    with tempfile.TemporaryDirectory() as root:
+        files = FileStore(root)
+        manager = FakeModelManager()
+        file_id = _write_input(files, [_chat(str(i), f"prompt {i}") for i in range(4)])
+
+        runner = BatchRunner(root, files, Scheduler(1), manager)
+        batch = runner.create(file_id, "/v1/chat/completions")
+        batch["status"] = "in_progress"
+        runner._save(batch)
+        # Two results made it to disk before the crash, the third one was torn
+        with open(files.content_path(batch["output_file_id"]), "w") as f:
+            f.write(json.dumps({"custom_id": "0"}) + "\n" + json.dumps({"custom_id": "1"}) + "\n")
+            f.write('{"custom_id": "2", "resp')
+
+        restarted = BatchRunner(root, files, Scheduler(1), manager)
+        batch = asyncio.run(_run_until_done(restarted, batch["id"]))
+        assert batch["status"] == "completed"
+        assert manager.calls == [["prompt 2", "prompt 3"]]
+        with open(files.content_path(batch["output_file_id"])) as f:
+            assert [json.loads(line)["custom_id"] for line in f] == ["0", "1", "2", "3"]
+
+
+def test_interactive_requests_are_admitted_first():
+    """Waiting interactive work overtakes waiting batch work"""
+    async def run():
+        scheduler = Scheduler(1)
+        order = []
+        await scheduler.acquire()
+
+        async def job(name, priority):
+            async with scheduler.slot(priority):
+                order.append(name)
+
+        batch_job = asyncio.ensure_future(job("batch", 10))
+        await asyncio.sleep(0)
+        interactive_job = asyncio.ensure_future(job("interactive", 0))
+        await asyncio.sleep(0)
+        scheduler.release()
+        await asyncio.gather(batch_job, interactive_job)
+        return order
+
+    assert asyncio.run(run()) == ["interactive", "batch"]
+
+
+if __name__ == "__main__":
+    test_batches_are_grouped_by_params_and_sorted_by_length()
+    test_sampling_parameters_are_passed_per_prompt()
+    test_requests_with_and_without_logprobs_are_grouped_apart()
+    test_interrupted_batch_resumes_missing_requests()
+    test_interactive_requests_are_admitted_first()
+    print("✅ All batch tests passed")
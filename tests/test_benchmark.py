@@ -0,0 +1,59 @@
+#!/usr/bin/env python3
+"""
+Tests for the benchmark helpers (no server or model required)
+"""
+
+import random
+
+from benchmarks.load import percentiles, sample_lengths, summarize
+from benchmarks.micro import compare
+
+
+def test_lengths_follow_the_requested_distribution():
+    """Log-normal lengths have roughly the requested mean and stay in bounds"""
+    lengths = sample_lengths(random.Random(0), 100, 0.5, 5000)
+    assert 90 < sum(lengths) / len(lengths) < 110
+    assert min(lengths) >= 1 and max(lengths) <= 400
+    assert sample_lengths(random.Random(0), 7, 0.0, 3) == [7, 7, 7]
+
+
+def test_percentiles_interpolate():
+    """Percentiles match linear interpolation between ranks"""
+    stats = percentiles([float(v) for v in range(1, 101)])
+    assert stats["mean"] == 50.5
+    assert abs(stats["p50"] - 50.5) < 1e-9
+    assert abs(stats["p99"] - 99.01) < 1e-9
+    assert percentiles([])["p90"] is None
+
+
+def test_summary_excludes_failures_from_latency():
+    """Failed requests count towards the error rate but not towards latency or throughput"""
+    results = [
+        {"ttft": 0.1, "latency": 1.1, "prompt_tokens": 10, "output_tokens": 11, "error": None},
+        {"ttft": 0.3, "latency": 2.3, "prompt_tokens": 10, "output_tokens": 21, "error": None},
+        {"ttft": None, "latency": 0.01, "prompt_tokens": 0, "output_tokens": 0, "error": "HTTP 429"},
+    ]
+    report = summarize(results, duration=2.0)
+    assert report["completed"] == 2 and report["failed"] == 1
+    assert abs(report["error_rate"] - 1 / 3) < 1e-9
+    assert report["output_token_throughput"] == 16.0
+    assert abs(report["tpot_s"]["mean"] - 0.1) < 1e-9
+    assert report["errors"] == {"HTTP 429": 1}
+
+
+def test_micro_compare_flags_slowdowns_and_growth():
+    """Slower than the baseline beyond the tolerance, or super-linear growth, is a regression"""
+    baseline = {"scan": {"100": {"total_ms": 1.0, "per_token_us": 10.0}, "8000": {"total_ms": 80.0, "per_token_us": 10.0}}}
+    steady = {"scan": {"100": {"total_ms": 1.2, "per_token_us": 12.0}, "8000": {"total_ms": 88.0, "per_token_us": 11.0}}}
+    assert compare(steady, baseline, tolerance=0.5, max_growth=3.0) == []
+    quadratic = {"scan": {"100": {"total_ms": 1.0, "per_token_us": 10.0}, "8000": {"total_ms": 800.0, "per_token_us": 100.0}}}
+    problems = compare(quadratic, baseline, tolerance=0.5, max_growth=3.0)
+    assert len(problems) == 2 and "grows 10.0x" in problems[1]
+
+
+if __name__ == "__main__":
+    test_lengths_follow_the_requested_distribution()
+    test_percentiles_interpolate()
+    test_summary_excludes_failures_from_latency()
+    test_micro_compare_flags_slowdowns_and_growth()
+    print("✅ All benchmark tests passed")
@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+"""
+Tests for n and best_of choices over a shared prefill (no server required, a tiny random model is built)
+"""
+
+import asyncio
+
+from benchmarks.tiny_model import DEFAULT_PATH, build_tiny_model
+from transformers_openai.config import config
+from transformers_openai.model_manager import ModelManager
+
+PROMPTS = ["hello world", "explain how a transformer model generates"]
+
+_manager = None
+
+
+def _tiny_manager() -> ModelManager:
+    """A ModelManager serving the tiny model on the CPU, loaded once per run"""
+    global _manager
+    if _manager is None:
+        config.parse(["--hf-model", build_tiny_model(DEFAULT_PATH), "--accelerator-type", "cpu", "--torch-dtype", "float32"])
+        _manager = ModelManager()
+        asyncio.run(_manager.initialize())
+    return _manager
+
+
+def _mean_logprob(choice):
+    entries = choice["logprobs"]
+    return sum(entry["logprob"] for entry in entries) / max(1, len(entries))
+
+
+def _stream_texts(manager, **kwargs):
+    """Text and finish reason per choice index of a streamed generation"""
+    async def run():
+        texts, finish_reasons = {}, {}
+        async for chunk in manager.generate_text_stream(**kwargs):
+            texts[chunk["index"]] = texts.get(chunk["index"], "") + chunk["text"]
+            if chunk["finish_reason"]:
+                finish_reasons[chunk["index"]] = chunk["finish_reason"]
+        return texts, finish_reasons
+
+    return asyncio.run(run())
+
+
+def test_n_choices_are_laid_out_per_prompt():
+    """Choice j of prompt i is index i * n + j, sampled copies of a prompt differ"""
+    manager = _tiny_manager()
+    result = manager.generate_text(PROMPTS, max_tokens=12, temperature=1.0, n=3, seed=7)
+    choices = result["choices"]
+    assert [choice["index"] for choice in choices] == list(range(6))
+    assert len(result["prompt_token_counts"]) == 2
+    assert len({choice["text"] for choice in choices[:3]}) > 1
+    # Seeded copies of a prompt do not depend on the other prompts in the batch
+    alone = manager.generate_text(PROMPTS[1], max_tokens=12, temperature=1.0, n=3, seed=7)
+    assert [c["text"] for c in alone["choices"]] == [c["text"] for c in choices[3:]]
+
+
+def test_greedy_copies_are_identical():
+    """With temperature 0 every copy of a prompt decodes the same tokens as the prompt alone"""
+    manager = _tiny_manager()
+    choices = manager.generate_text(PROMPTS, max_tokens=12, temperature=0, n=2)["choices"]
+    for i, prompt in enumerate(PROMPTS):
+        single = manager.generate_text(prompt, max_tokens=12, temperature=0)["choices"][0]["text"]
+        assert single
+        assert choices[2 * i]["text"] == choices[2 * i + 1]["text"] == single
+
+
+def test_best_of_keeps_the_most_likely_samples():
+    """best_of returns the samples with the highest log probability per token, in that order"""
+    manager = _tiny_manager()
+    kwargs = dict(max_tokens=10, temperature=1.0, seed=3, logprobs=True)
+    samples = manager.generate_text(PROMPTS, n=4, **kwargs)["choices"]
+    best = manager.generate_text(PROMPTS, n=2, best_of=4, **kwargs)["choices"]
+    assert [choice["index"] for choice in best] == [0, 1, 2, 3]
+    for i in range(len(PROMPTS)):
+        ranked = sorted(samples[4 * i:4 * i + 4], key=_mean_logprob, reverse=True)
+        assert [c["text"] for c in best[2 * i:2 * i + 2]] == [c["text"] for c in ranked[:2]]
+        assert _mean_logprob(best[2 * i]) >= _mean_logprob(best[2 * i + 1])
+
+
+def test_stream_indices_match_generate_text():
+    """Streamed choices carry the same indices and texts as the non-streamed ones"""
+    manager = _tiny_manager()
+    kwargs = dict(prompt=PROMPTS, max_tokens=12, temperature=1.0, n=2, seed=5)
+    expected = manager.generate_text(**kwargs)["choices"]
+    texts, finish_reasons = _stream_texts(manager, **kwargs)
+    assert sorted(texts) == sorted(finish_reasons) == list(range(4))
+    assert [texts[i] for i in range(4)] == [choice["text"] for choice in expected]
+    assert [finish_reasons[i] for i in range(4)] == [choice["finish_reason"] for choice in expected]
+
+
+if __name__ == "__main__":
+    test_n_choices_are_laid_out_per_prompt()
+    test_greedy_copies_are_identical()
+    test_best_of_keeps_the_most_likely_samples()
+    test_stream_indices_match_generate_text()
+    print("✅ All choices tests passed")
@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+"""
+Tests for the /v1/completions endpoint (no server required, a tiny random model is served in-process)
+"""
+
+import json
+
+import pytest
+from fastapi.testclient import TestClient
+
+from benchmarks.tiny_model import DEFAULT_PATH, build_tiny_model
+from transformers_openai.app import app, request_limiter
+from transformers_openai.config import config
+from transformers_openai.model_manager import ModelManager, model_manager
+
+MODEL = build_tiny_model(DEFAULT_PATH)
+# Prompts of different lengths, so the batch is left padded
+PROMPTS = ["hello", "explain how a transformer language model generates one token"]
+
+
+def _client() -> TestClient:
+    """A client of the app serving the tiny model on the CPU, loaded when the client starts"""
+    config.parse(["--hf-model", MODEL, "--accelerator-type", "cpu", "--torch-dtype", "float32"])
+    model_manager.current = ModelManager(MODEL)
+    return TestClient(app)
+
+
+def _complete(client, **body):
+    response = client.post("/v1/completions", json={"model": MODEL, "max_tokens": 8, "temperature": 0, **body})
+    assert response.status_code == 200, response.text
+    return response.json()
+
+
+def _stream(client, **body):
+    """The JSON frames of a streamed completion, the [DONE] marker checked and dropped"""
+    response = client.post(
+        "/v1/completions", json={"model": MODEL, "max_tokens": 8, "temperature": 0, "stream": True, **body}
+    )
+    assert response.status_code == 200, response.text
+    frames = [line[len("data: "):] for line in response.text.splitlines() if line.startswith("data: ")]
+    assert frames[-1] == "[DONE]"
+    return [json.loads(frame) for frame in frames[:-1]]
+
+
+def test_padded_batch_matches_prompts_alone():
+    """Every prompt of a left-padded batch completes as it does on its own, choice i * n + j"""
+    with _client() as client:
+        alone = [_complete(client, prompt=prompt)["choices"][0]["text"] for prompt in PROMPTS]
+        assert all(alone)
+        batch = _complete(client, prompt=PROMPTS, n=2)
+        assert [choice["index"] for choice in batch["choices"]] == [0, 1, 2, 3]
+        assert [choice["text"] for choice in batch["choices"]] == [text for text in alone for _ in range(2)]
+        assert batch["usage"]["completion_tokens"] > 0
+
+
+def test_echo_and_stop():
+    """echo prepends the prompt, a stop sequence cuts the text before it"""
+    with _client() as client:
+        text = _complete(client, prompt=PROMPTS[0], max_tokens=12)["choices"][0]["text"]
+        echoed = _complete(client, prompt=PROMPTS[0], max_tokens=12, echo=True)["choices"][0]
+        assert echoed["text"] == PROMPTS[0] + text
+        stop = text[len(text) // 2:len(text) // 2 + 2]
+        stopped = _complete(client, prompt=PROMPTS[0], max_tokens=12, stop=[stop])["choices"][0]
+        assert stopped["finish_reason"] == "stop"
+        assert stopped["text"] == text[:text.index(stop)]
+
+
+def test_stream_matches_non_streamed():
+    """A streamed batch echoes first, then carries the same texts per index and usage on its last frame"""
+    with _client() as client:
+        expected = _complete(client, prompt=PROMPTS, echo=True)["choices"]
+        frames = _stream(client, prompt=PROMPTS, echo=True)
+        texts = {}
+        for frame in frames:
+            for choice in frame["choices"]:
+                texts[choice["index"]] = texts.get(choice["index"], "") + choice["text"]
+        assert [choice["text"] for choice in frames[0]["choices"]] == PROMPTS
+        assert [texts[i] for i in range(len(PROMPTS))] == [choice["text"] for choice in expected]
+        assert frames[-1]["usage"]["completion_tokens"] > 0
+        assert all(frame.get("usage") is None for frame in frames[:-1])
+
+
+def test_unsupported_parameters_are_rejected():
+    with _client() as client:
+        response = client.post("/v1/completions", json={"model": MODEL, "prompt": "hello", "suffix": "end"})
+        assert response.status_code == 400 and "suffix" in response.json()["detail"]
+        response = client.post("/v1/completions", json={"model": MODEL, "prompt": []})
+        assert response.status_code == 400
+        response = client.post("/v1/completions", json={"model": MODEL, "prompt": "hello", "n": 2, "best_of": 1})
+        assert response.status_code == 400
+
+
+def test_request_stays_on_the_manager_it_started_on(monkeypatch):
+    """A reload while a request waits for its place does not move it to the new model, the old one drains it"""
+    with _client() as client:
+        served = model_manager.current
+        acquire = request_limiter.acquire
+        in_flight = []
+
+        async def swap_then_acquire():
+            model_manager.current = ModelManager("another-model")
+            in_flight.append(served.in_flight)
+            await acquire()
+
+        monkeypatch.setattr(request_limiter, "acquire", swap_then_acquire)
+        for stream in (False, True):
+            if stream:
+                frames = _stream(client, prompt=PROMPTS[0])
+                assert {frame["model"] for frame in frames} == {MODEL}
+            else:
+                assert _complete(client, prompt=PROMPTS[0])["model"] == MODEL
+            model_manager.current = served
+        assert in_flight == [1, 1] and served.in_flight == 0
+
+
+if __name__ == "__main__":
+    test_padded_batch_matches_prompts_alone()
+    test_echo_and_stop()
+    test_stream_matches_non_streamed()
+    test_unsupported_parameters_are_rejected()
+    pytest.main([__file__, "-q", "-k", "manager_it_started_on"])
+    print("✅ All completions tests passed")
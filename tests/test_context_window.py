@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+"""
+Tests for fitting chat prompts into the context window (no server or model required)
+"""
+
+import types
+
+import pytest
+
+from transformers_openai.model_manager import ModelManager
+
+
+class WordTokenizer:
+    """One token per word, without a chat template so the plain prompt format is used"""
+
+    def __init__(self):
+        self.calls = 0
+
+    def __call__(self, text):
+        self.calls += 1
+        return types.SimpleNamespace(input_ids=text.split())
+
+
+def _manager(context_length):
+    manager = ModelManager()
+    manager.tokenizer = WordTokenizer()
+    manager.context_length = context_length
+    return manager
+
+
+def _conversation(turns):
+    messages = [{"role": "system", "content": "be brief"}]
+    for turn in range(turns):
+        messages.append({"role": "user", "content": f"question {turn} " + "word " * 8})
+        messages.append({"role": "assistant", "content": f"answer {turn} " + "word " * 8})
+    messages.append({"role": "user", "content": "latest question"})
+    return messages
+
+
+def test_fitting_conversations_are_unchanged():
+    messages = _conversation(3)
+    manager = _manager(context_length=1000)
+    assert manager.format_chat_prompt(messages, 100) == manager._render_chat(messages)
+
+
+def test_oldest_turns_are_dropped_first():
+    """The system prompt and latest turns stay, the history left starts at a user message"""
+    messages = _conversation(6)
+    manager = _manager(context_length=80)
+    prompt = manager.format_chat_prompt(messages, 20)
+    assert manager.count_tokens(prompt) <= 60
+    assert prompt.startswith("System: be brief\nHuman: question ")
+    assert "question 0 " not in prompt and "answer 5 " in prompt
+    assert prompt.endswith("Human: latest question\nAssistant: ")
+    # As many turns as fit are kept: adding back the next older one would not fit
+    kept = int(prompt.split("Human: question ")[1].split()[0])
+    longer = manager._render_chat(messages[:1] + messages[1 + 2 * (kept - 1):])
+    assert manager.count_tokens(longer) > 60
+
+
+def test_impossible_requests_are_rejected():
+    """When the system prompt and latest turn leave no room for max_tokens the request fails"""
+    manager = _manager(context_length=80)
+    with pytest.raises(ValueError, match="maximum context length is 80 tokens"):
+        manager.format_chat_prompt(_conversation(6), 76)
+    manager.context_length = None
+    assert manager.format_chat_prompt(_conversation(6), 10 ** 6)
+
+
+def test_token_counts_are_cached():
+    """Counting a prompt again, and generating from it, does not tokenize it again"""
+    manager = _manager(context_length=1000)
+    prompt = manager.format_chat_prompt(_conversation(2), 10)
+    calls = manager.tokenizer.calls
+    assert manager.count_tokens(prompt) == len(prompt.split())
+    assert manager.tokenizer.calls == calls
+
+
+if __name__ == "__main__":
+    test_fitting_conversations_are_unchanged()
+    test_oldest_turns_are_dropped_first()
+    test_impossible_requests_are_rejected()
+    test_token_counts_are_cached()
+    print("✅ All context window tests passed")
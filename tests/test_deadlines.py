@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+"""
+Tests for request deadlines in the scheduler and during generation (no server required)
+"""
+
+import asyncio
+import time
+
+import pytest
+import torch
+import transformers
+
+from benchmarks.tiny_model import build_tiny_llama
+from transformers_openai.generation import DeadlineCriteria
+from transformers_openai.scheduler import Scheduler
+from transformers_openai.timing import DeadlineExceeded
+
+
+def test_expired_requests_leave_the_queue_without_running():
+    """A waiter whose deadline passes gives up, and the freed slot goes to the next waiter"""
+    async def run():
+        scheduler = Scheduler(1)
+        await scheduler.acquire()
+        now = time.perf_counter()
+        with pytest.raises(DeadlineExceeded):
+            await scheduler.acquire(deadline=now - 1)
+        doomed = asyncio.create_task(scheduler.acquire(deadline=now + 0.05))
+        patient = asyncio.create_task(scheduler.acquire())
+        await asyncio.sleep(0.1)
+        assert doomed.done() and isinstance(doomed.exception(), DeadlineExceeded)
+        scheduler.release()
+        await asyncio.wait_for(patient, 1)
+        assert scheduler.running == 1 and scheduler.num_waiting == 0
+
+    asyncio.run(run())
+
+
+def test_earliest_deadline_is_admitted_first():
+    """Within a priority, waiters with the earliest deadline go first and those without one last"""
+    async def run():
+        scheduler = Scheduler(1)
+        await scheduler.acquire()
+        now = time.perf_counter()
+        order = []
+
+        async def wait(name, deadline):
+            await scheduler.acquire(deadline=deadline)
+            order.append(name)
+            scheduler.release()
+
+        tasks = [
+            asyncio.create_task(wait("none", None)),
+            asyncio.create_task(wait("late", now + 10)),
+            asyncio.create_task(wait("early", now + 5)),
+        ]
+        await asyncio.sleep(0.01)
+        scheduler.release()
+        await asyncio.gather(*tasks)
+        return order
+
+    assert asyncio.run(run()) == ["early", "late", "none"]
+
+
+def test_generation_stops_at_the_deadline():
+    """generate() stops every row at the first step past the deadline"""
+    model = build_tiny_llama(num_layers=1)
+    input_ids = torch.randint(3, 64, (2, 5))
+    criteria = DeadlineCriteria(time.perf_counter() - 1)
+    with torch.no_grad():
+        outputs = model.generate(
+            input_ids=input_ids, max_new_tokens=50, do_sample=False, pad_token_id=0, eos_token_id=None,
+            stopping_criteria=transformers.StoppingCriteriaList([criteria]),
+        )
+    assert criteria.expired
+    assert outputs.shape[1] == input_ids.shape[1] + 1
+
+
+if __name__ == "__main__":
+    test_expired_requests_leave_the_queue_without_running()
+    test_earliest_deadline_is_admitted_first()
+    test_generation_stops_at_the_deadline()
+    print("✅ All deadline tests passed")
@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+"""
+Tests for embedding dynamic batching and caching (no server required)
+"""
+
+import asyncio
+
+from transformers_openai.embeddings import EmbeddingBatcher
+
+
+class FakeEmbedder:
+    """Records every batch it is asked to embed"""
+
+    def __init__(self):
+        self.batches = []
+
+    def __call__(self, texts):
+        self.batches.append(list(texts))
+        return [[float(len(text))] for text in texts], [len(text.split()) for text in texts]
+
+
+def test_concurrent_requests_share_a_batch():
+    """Requests arriving within the window are embedded in one call"""
+    embedder = FakeEmbedder()
+
+    async def run():
+        batcher = EmbeddingBatcher(embedder, max_batch_size=16, window=0.01)
+        return await asyncio.gather(
+            *(batcher.embed([f"text {i}"], "m", "mean") for i in range(5))
+        )
+
+    results = asyncio.run(run())
+    assert len(embedder.batches) == 1
+    assert sorted(embedder.batches[0]) == [f"text {i}" for i in range(5)]
+    assert [r[0][0] for r in results] == [[6.0]] * 5
+
+
+def test_cache_and_duplicates_skip_the_model():
+    """Repeated inputs are deduplicated and then answered from the cache"""
+    embedder = FakeEmbedder()
+
+    async def run():
+        batcher = EmbeddingBatcher(embedder, max_batch_size=16, window=0.001)
+        first = await batcher.embed(["a b", "c", "a b"], "m", "mean")
+        second = await batcher.embed(["a b", "c"], "m", "mean")
+        return batcher, first, second
+
+    batcher, first, second = asyncio.run(run())
+    assert embedder.batches == [["c", "a b"]]
+    assert first[0] == first[2] == second[0]
+    assert batcher.cache.hits == 2
+
+
+def test_large_requests_are_split():
+    """Inputs beyond the maximum batch size go into several batches"""
+    embedder = FakeEmbedder()
+
+    async def run():
+        batcher = EmbeddingBatcher(embedder, max_batch_size=4, window=0.001)
+        return await batcher.embed([str(i) for i in range(10)], "m", "mean")
+
+    results = asyncio.run(run())
+    assert len(results) == 10
+    assert [len(batch) for batch in embedder.batches] == [4, 4, 2]
+
+
+if __name__ == "__main__":
+    test_concurrent_requests_share_a_batch()
+    test_cache_and_duplicates_skip_the_model()
+    test_large_requests_are_split()
+    print("✅ All embedding tests passed")
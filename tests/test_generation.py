@@ -0,0 +1,52 @@
+#!/usr/bin/env python3
+"""
+Tests for incremental stop-sequence and reasoning tag scanning (no server or model required)
+"""
+
+import random
+
+from transformers_openai.generation import ThinkTags, find_stop
+
+
+def _stream(pieces):
+    text = ""
+    for piece in pieces:
+        text += piece
+        yield piece, text
+
+
+def test_stop_found_across_deltas():
+    """A stop sequence split over deltas is found once its last character arrives"""
+    positions = []
+    for piece, text in _stream(["Hello", " wor", "ld\n\nUs", "er: hi"]):
+        positions.append(find_stop(text, ["\n\nUser:", "STOP"], len(piece)))
+    assert positions == [-1, -1, -1, 11]
+
+
+def test_stop_matches_full_scan():
+    """Scanning only the tail finds the same earliest stop as scanning everything"""
+    rng = random.Random(0)
+    atoms = ["a", "b", "ab", "ba", "aab", " "]
+    stops = ["aba", "bb", "b a"]
+    for _ in range(2000):
+        for piece, text in _stream([rng.choice(atoms) for _ in range(rng.randint(1, 10))]):
+            position = find_stop(text, stops, len(piece))
+            expected = min((p for p in (text.find(s) for s in stops) if p >= 0), default=-1)
+            if position >= 0 or expected >= 0:
+                assert position == expected, (text, piece)
+                break
+
+
+def test_think_tags_are_tracked_incrementally():
+    """Tags split over deltas are found, and the close is reported exactly once"""
+    tags = ThinkTags()
+    closed = [tags.update(text) for _, text in _stream(["<th", "ink>reason", "ing</thi", "nk>", " answer"])]
+    assert closed == [False, False, False, True, False]
+    assert (tags.open, tags.close) == (0, 16)
+
+
+if __name__ == "__main__":
+    test_stop_found_across_deltas()
+    test_stop_matches_full_scan()
+    test_think_tags_are_tracked_incrementally()
+    print("✅ All generation tests passed")
@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+"""
+Tests for guided JSON/regex decoding (no server or model required)
+"""
+
+import json
+
+import torch
+
+from transformers_openai.generation import GuidedDecodingProcessor
+from transformers_openai.guided import (
+    CharacterDFA,
+    TokenIndex,
+    TokenVocabulary,
+    guide_pattern,
+    json_schema_regex,
+)
+
+
+class FakeTokenizer:
+    """Tokens are fixed strings, id 0 is EOS"""
+
+    def __init__(self, tokens):
+        self.vocab = ["</s>"] + tokens
+        self.eos_token_id = 0
+        self.all_special_ids = [0]
+
+    def __len__(self):
+        return len(self.vocab)
+
+    def encode(self, text, add_special_tokens=False):
+        return [self.vocab.index(text)]
+
+    def decode(self, ids):
+        return "".join(self.vocab[i] for i in ids if i != 0)
+
+
+TOKENS = ["a", "b", "ab", "ba", "1", "12", "{", "}", '"', '":', ",", " ", "x", "true", "false", '{"', '"}']
+
+
+def test_regex_matching():
+    """Classes, repetition counts, alternation and escapes behave like re.fullmatch"""
+    dfa = CharacterDFA(r"(?:ab|c)[0-9]{2,3}\.x?")
+    for text, expected in [("ab12.", True), ("c123.x", True), ("c1.", False), ("ab1234.", False), ("abc12.", False)]:
+        assert dfa.matches(text) == expected, text
+
+
+def test_schema_regex():
+    """Generated patterns accept valid instances and reject invalid ones"""
+    schema = {
+        "type": "object",
+        "properties": {
+            "name": {"type": "string", "maxLength": 5},
+            "age": {"type": "integer"},
+            "tags": {"type": "array", "items": {"enum": ["a", "b"]}, "maxItems": 2},
+        },
+        "required": ["name"],
+    }
+    dfa = CharacterDFA(json_schema_regex(schema))
+    assert dfa.matches(json.dumps({"name": "Bob", "age": 3, "tags": ["a"]}))
+    assert dfa.matches(json.dumps({"name": "Bob"}))
+    assert not dfa.matches(json.dumps({"age": 3}))
+    assert not dfa.matches(json.dumps({"name": "Robert"}))
+    assert not dfa.matches(json.dumps({"name": "Bob", "tags": ["a", "b", "a"]}))
+
+
+def test_schema_pattern_alternation():
+    """An alternation in a string pattern stays between the quotes, anchors included"""
+    schema = {
+        "type": "object",
+        "properties": {"a": {"type": "string"}, "b": {"type": "string", "pattern": "cat|dog"}},
+        "required": ["a", "b"],
+    }
+    dfa = CharacterDFA(json_schema_regex(schema))
+    assert dfa.matches('{"a":"x","b":"cat"}') and dfa.matches('{"a":"x","b":"dog"}')
+    assert not dfa.matches('{"a":"x","b":"cow"}')
+    anchored = CharacterDFA(json_schema_regex({"type": "string", "pattern": "^a$|^b$"}))
+    assert anchored.matches('"a"') and anchored.matches('"b"')
+    assert not anchored.matches('"a') and not anchored.matches('"ab"')
+
+
+def test_index_matches_brute_force():
+    """Every state allows exactly the tokens whose text keeps the DFA alive"""
+    tokenizer = FakeTokenizer(TOKENS)
+    vocabulary = TokenVocabulary(tokenizer)
+    for pattern in [guide_pattern({"type": "json_object"}, None, 1), r"(?:ab)+1?", r'"[^"]*"']:
+        index = TokenIndex(pattern, vocabulary)
+        dfa = index.dfa
+        for state, allowed in index.transitions.items():
+            for token_id, text in vocabulary.tokens:
+                target = state
+                for char in text:
+                    target = dfa.step(target, dfa.char_class(char))
+                    if target is None:
+                        break
+                assert allowed.get(token_id) == target, (pattern, state, text)
+
+
+def test_processor_masks_only_guided_rows():
+    """Guided rows follow their index step by step, unguided rows are untouched"""
+    tokenizer = FakeTokenizer(TOKENS)
+    index = TokenIndex(r"ab1", TokenVocabulary(tokenizer))
+    processor = GuidedDecodingProcessor([index, None])
+    ids = {text: tokenizer.vocab.index(text) for text in ("a", "ab", "b", "1")}
+
+    scores = torch.zeros(2, len(tokenizer))
+    out = processor(torch.zeros((2, 1), dtype=torch.long), scores)
+    assert set(torch.isfinite(out[0]).nonzero().flatten().tolist()) == {ids["a"], ids["ab"]}
+    assert torch.isfinite(out[1]).all()
+
+    out = processor(torch.tensor([[0, ids["a"]], [0, ids["a"]]]), scores)
+    assert set(torch.isfinite(out[0]).nonzero().flatten().tolist()) == {ids["b"]}
+
+    out = processor(torch.tensor([[0, ids["a"], ids["b"]], [0, ids["a"], ids["b"]]]), scores)
+    out = processor(torch.tensor([[0, ids["a"], ids["b"], ids["1"]]] * 2), scores)
+    assert torch.isfinite(out[0]).nonzero().flatten().tolist() == [tokenizer.eos_token_id]
+
+
+def test_guide_pattern_validation():
+    """Unsupported or conflicting options are rejected"""
+    assert guide_pattern(None, None) is None
+    assert guide_pattern({"type": "text"}, None) is None
+    for response_format, guided_regex in [
+        ({"type": "xml"}, None),
+        ({"type": "json_schema", "json_schema": {}}, None),
+        ({"type": "json_object"}, "a+"),
+        (None, "(a"),
+    ]:
+        try:
+            guide_pattern(response_format, guided_regex)
+        except ValueError:
+            continue
+        raise AssertionError((response_format, guided_regex))
+
+
+if __name__ == "__main__":
+    test_regex_matching()
+    test_schema_regex()
+    test_schema_pattern_alternation()
+    test_index_matches_brute_force()
+    test_processor_masks_only_guided_rows()
+    test_guide_pattern_validation()
+    print("✅ All guided decoding tests passed")
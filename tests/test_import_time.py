@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+"""
+Tests for the import cost of the package (no server or model required)
+"""
+
+import json
+import os
+import subprocess
+import sys
+
+# Importing the app without torch takes well under a second, torch alone takes seconds
+IMPORT_BUDGET_SECONDS = 1.5
+HEAVY_MODULES = ("torch", "transformers")
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _import_in_fresh_interpreter(module: str, argv=("prog",)):
+    """Seconds the import took and the heavy modules it pulled in, measured in a new process"""
+    code = (
+        "import json, sys, time\n"
+        f"sys.argv = {list(argv)!r}\n"
+        "start = time.perf_counter()\n"
+        f"import {module}\n"
+        "seconds = time.perf_counter() - start\n"
+        f"print(json.dumps({{'seconds': seconds, 'heavy': [m for m in {HEAVY_MODULES!r} if m in sys.modules]}}))\n"
+    )
+    output = subprocess.run(
+        [sys.executable, "-c", code], cwd=ROOT, capture_output=True, text=True, check=True
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def test_app_imports_within_budget_without_torch():
+    """The server module defers torch and transformers to model loading"""
+    result = _import_in_fresh_interpreter("transformers_openai.app")
+    assert result["heavy"] == []
+    assert result["seconds"] < IMPORT_BUDGET_SECONDS, f"import took {result['seconds']:.2f}s"
+
+
+def test_imports_ignore_the_command_line():
+    """Importing under another CLI does not parse its arguments"""
+    result = _import_in_fresh_interpreter(
+        "transformers_openai.monitor, transformers_openai.app", argv=("pytest", "-q", "--unknown-flag")
+    )
+    assert result["heavy"] == []
+
+
+def test_entry_point_parses_explicitly():
+    """Defaults come from the environment until the entry point parses its arguments"""
+    from transformers_openai.config import Config
+
+    config = Config()
+    assert config.args.port == int(os.getenv("PORT", 7088))
+    assert config.parse(["--port", "9000"]).port == 9000
+    assert config.args.port == 9000
+
+
+if __name__ == "__main__":
+    test_app_imports_within_budget_without_torch()
+    test_imports_ignore_the_command_line()
+    test_entry_point_parses_explicitly()
+    print("✅ All import time tests passed")
@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+"""
+Tests for the quantized KV cache (no server required, a tiny random model is built)
+"""
+
+import torch
+from transformers import DynamicCache
+
+from benchmarks.tiny_model import build_tiny_llama
+from transformers_openai.kv_quant import KVQuantizer, QuantizedKVCache, QuantizedKVLayer, make_quantizers
+
+BLOCK = 4
+
+
+def test_round_trip_error_is_bounded():
+    """Every element comes back within half a quantization step (int8) or fp8's relative precision"""
+    torch.manual_seed(0)
+    states = torch.randn(2, 3, 2 * BLOCK, 16)
+    states[..., 5] *= 20  # an outlier channel, as keys tend to have
+    for dtype, granularity in (("int8", "token"), ("int8", "channel"), ("fp8", "token"), ("fp8", "channel")):
+        quantizer = KVQuantizer(dtype, granularity, BLOCK)
+        quantized, scales = quantizer.quantize(states)
+        assert quantized.dtype == quantizer.storage_dtype
+        restored = quantizer.dequantize(quantized, scales, states.dtype)
+        assert restored.shape == states.shape
+        if granularity == "channel":
+            absmax = states.view(2, 3, 2, BLOCK, 16).abs().amax(dim=-2, keepdim=True).expand(-1, -1, -1, BLOCK, -1)
+            absmax = absmax.reshape(states.shape)
+        else:
+            absmax = states.abs().amax(dim=-1, keepdim=True)
+        bound = absmax / 254 if dtype == "int8" else states.abs() / 16 + absmax / 448 * 2 ** -6
+        assert ((restored - states).abs() <= bound + 1e-5).all(), (dtype, granularity)
+
+
+def test_layer_keeps_a_full_precision_residual_window():
+    """Whole blocks move to quantized storage, the newest tokens stay exact"""
+    layer = QuantizedKVLayer(*make_quantizers("int8", "int8", "channel", "token", BLOCK), BLOCK)
+    states = torch.randn(1, 2, 6, 8)
+    keys, values = layer.update(states, states.clone())
+    assert keys.shape == (1, 2, 6, 8)
+    assert layer.quantized[0].shape[-2] == BLOCK and layer.keys.shape[-2] == 2
+    step = torch.randn(1, 2, 1, 8)
+    keys, values = layer.update(step, step.clone())
+    assert layer.get_seq_length() == 7
+    assert keys.shape[-2] == 7
+    # The residual window and the new token are returned unchanged, the history approximately
+    assert torch.equal(keys[..., BLOCK:, :], torch.cat([states[..., BLOCK:, :], step], dim=-2))
+    assert torch.allclose(keys[..., :BLOCK, :], states[..., :BLOCK, :], atol=0.05)
+    assert layer.nbytes() < 2 * 7 * 2 * 8 * 4
+
+    layer.batch_repeat_interleave(3)
+    assert layer.quantized[0].shape[0] == 3 and layer.scales[1].shape[0] == 3 and layer.keys.shape[0] == 3
+    layer.batch_select_indices(torch.tensor([0, 2]))
+    assert layer.get_seq_length() == 7 and layer.quantized[1].shape[0] == 2
+
+
+def test_generation_stays_close_to_the_full_precision_cache():
+    """Greedy decoding through an int8 cache follows the full precision cache, in less memory"""
+    model = build_tiny_llama()
+    input_ids = torch.randint(3, 64, (2, 3 * BLOCK + 1), generator=torch.Generator().manual_seed(1))
+    kwargs = dict(input_ids=input_ids, max_new_tokens=6, do_sample=False, pad_token_id=0, eos_token_id=None)
+    with torch.no_grad():
+        full = DynamicCache()
+        reference = model.generate(**kwargs, past_key_values=full)
+        cache = QuantizedKVCache(2, *make_quantizers("int8", "int8", "channel", "token", BLOCK), block=BLOCK)
+        quantized = model.generate(**kwargs, past_key_values=cache)
+    assert quantized.shape == reference.shape
+    assert torch.equal(quantized[:, :input_ids.shape[1] + 2], reference[:, :input_ids.shape[1] + 2])
+    assert cache.get_seq_length() == full.get_seq_length()
+    full_bytes = sum(t.numel() * t.element_size() for layer in full.layers for t in (layer.keys, layer.values))
+    assert cache.nbytes() < full_bytes
+
+
+if __name__ == "__main__":
+    test_round_trip_error_is_bounded()
+    test_layer_keeps_a_full_precision_residual_window()
+    test_generation_stays_close_to_the_full_precision_cache()
+    print("✅ All KV cache quantization tests passed")
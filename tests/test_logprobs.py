@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+"""
+Tests for on-device logprob recording and token bytes (no server required, a tiny tokenizer is built)
+"""
+
+import torch
+import transformers
+
+from benchmarks.tiny_model import DEFAULT_PATH, build_tiny_model
+from transformers_openai.config import config
+from transformers_openai.generation import LogprobsProcessor, completion_mask
+from transformers_openai.model_manager import ModelManager
+
+
+def _run_steps(processor, steps, tokens):
+    """Feed per-step scores through the processor the way generate() does"""
+    input_ids = torch.zeros((tokens.shape[0], 1), dtype=torch.long)
+    for step, scores in enumerate(steps):
+        assert processor(input_ids, scores) is scores
+        input_ids = torch.cat([input_ids, tokens[:, step:step + 1]], dim=1)
+    return input_ids[:, 1:]
+
+
+def test_logprobs_match_log_softmax():
+    """Chosen and top-k values equal a full log-softmax over the vocabulary"""
+    torch.manual_seed(0)
+    steps = [torch.randn(2, 50) for _ in range(4)]
+    tokens = torch.randint(0, 50, (2, 4))
+    processor = LogprobsProcessor(top_k=3)
+    generated = _run_steps(processor, steps, tokens)
+
+    chosen, top_logprobs, top_ids = processor.finalize(generated)
+    expected = torch.stack([torch.log_softmax(s, dim=-1) for s in steps], dim=1)
+    assert chosen.shape == (2, 4) and top_logprobs.shape == top_ids.shape == (2, 4, 3)
+    assert torch.allclose(chosen, expected.gather(-1, tokens.unsqueeze(-1)).squeeze(-1), atol=1e-5)
+    assert torch.allclose(top_logprobs, expected.topk(3, dim=-1).values, atol=1e-5)
+    assert torch.equal(top_ids, expected.topk(3, dim=-1).indices)
+
+
+def test_streamer_resolves_each_step():
+    """Steps resolved as tokens are streamed are not recorded twice"""
+    steps = [torch.randn(1, 10) for _ in range(3)]
+    processor = LogprobsProcessor()
+    input_ids = torch.zeros((1, 1), dtype=torch.long)
+    for scores in steps:
+        processor(input_ids, scores)
+        token = scores.argmax(dim=-1)
+        chosen, top_logprobs, _ = processor.resolve(token)
+        assert top_logprobs.shape == (1, 0)
+        assert torch.allclose(chosen, torch.log_softmax(scores, dim=-1).max(dim=-1).values)
+        input_ids = torch.cat([input_ids, token.view(1, 1)], dim=1)
+
+    chosen, _, _ = processor.finalize(input_ids[:, 1:])
+    assert chosen.shape == (1, 3)
+
+
+def test_completion_mask_stops_after_eos():
+    """Tokens after the first EOS of a row are masked out"""
+    generated = torch.tensor([[5, 2, 7, 2], [5, 6, 7, 8]])
+    assert completion_mask(generated, 2).tolist() == [
+        [True, True, False, False],
+        [True, True, True, True],
+    ]
+
+
+def test_token_bytes_keep_partial_characters():
+    """Byte-level tokens report their raw bytes, which join back into multi-byte characters"""
+    model = build_tiny_model(DEFAULT_PATH)
+    config.parse(["--hf-model", model])
+    manager = ModelManager(model)
+    manager.tokenizer = transformers.AutoTokenizer.from_pretrained(model)
+    text = "é€ hello"
+    token_ids = manager.tokenizer(text, add_special_tokens=False).input_ids
+    entries = manager._logprob_entries(token_ids, [0.0] * len(token_ids), [[0.0]] * len(token_ids), [[i] for i in token_ids])
+    assert bytes(b for entry in entries for b in entry["bytes"]).decode("utf-8") == text
+    assert any(entry["token"] == "\ufffd" and entry["bytes"] != list("\ufffd".encode("utf-8")) for entry in entries)
+    assert all(entry["top_logprobs"][0]["bytes"] == entry["bytes"] for entry in entries)
+
+
+if __name__ == "__main__":
+    test_logprobs_match_log_softmax()
+    test_streamer_resolves_each_step()
+    test_completion_mask_stops_after_eos()
+    test_token_bytes_keep_partial_characters()
+    print("✅ All logprobs tests passed")
@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+"""
+Tests for the Prometheus metrics (no server or model required)
+"""
+
+import threading
+
+from transformers_openai import metrics as metrics_module
+from transformers_openai.metrics import Metrics
+
+
+def _samples(text):
+    return dict(line.rsplit(" ", 1) for line in text.splitlines() if not line.startswith("#"))
+
+
+def test_histogram_buckets_are_cumulative():
+    """Bucket counts include every observation at or below their bound"""
+    registry = Metrics(prefix="test")
+    for value in (0.001, 0.05, 0.05, 3.0, 1000.0):
+        registry.queue_time.observe(value)
+    samples = _samples(registry.render())
+    assert samples['test_request_queue_time_seconds_bucket{le="0.001"}'] == "1"
+    assert samples['test_request_queue_time_seconds_bucket{le="0.06"}'] == "3"
+    assert samples['test_request_queue_time_seconds_bucket{le="5.0"}'] == "4"
+    assert samples['test_request_queue_time_seconds_bucket{le="+Inf"}'] == "5"
+    assert samples["test_request_queue_time_seconds_count"] == "5"
+    assert float(samples["test_request_queue_time_seconds_sum"]) == sum((0.001, 0.05, 0.05, 3.0, 1000.0))
+
+
+def test_generation_record_and_gauges():
+    """A finished generation feeds the latency and length metrics, gauges are read on scrape"""
+    registry = Metrics(prefix="test")
+    running = [2]
+    registry.gauge("running", "Running", lambda: running[0])
+    registry.gauge("unknown", "Not available", lambda: None)
+    registry.record_generation(10.0, 10.5, 12.5, 5, [7, 9], [4, 5])
+    running[0] = 3
+
+    samples = _samples(registry.render())
+    assert samples["test_time_to_first_token_seconds_sum"] == "0.5"
+    assert samples["test_time_per_output_token_seconds_sum"] == "0.5"
+    assert samples["test_e2e_request_latency_seconds_sum"] == "2.5"
+    assert samples["test_request_prompt_tokens_count"] == "2"
+    assert samples["test_generation_tokens_total"] == "9"
+    assert samples["test_running"] == "3"
+    assert not any(name.startswith("test_unknown") for name in samples)
+
+
+def test_concurrent_recording_loses_nothing():
+    """Threads record without locks while observations are folded in between"""
+    registry = Metrics(prefix="test")
+    original = metrics_module.FOLD_THRESHOLD
+    metrics_module.FOLD_THRESHOLD = 64
+    try:
+        def record():
+            for _ in range(5000):
+                registry.generation_tokens.inc()
+                registry.prompt_length.observe(3)
+
+        threads = [threading.Thread(target=record) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for _ in range(20):
+            registry.render()
+        for thread in threads:
+            thread.join()
+    finally:
+        metrics_module.FOLD_THRESHOLD = original
+
+    samples = _samples(registry.render())
+    assert samples["test_generation_tokens_total"] == "20000"
+    assert samples["test_request_prompt_tokens_count"] == "20000"
+
+
+if __name__ == "__main__":
+    test_histogram_buckets_are_cumulative()
+    test_generation_record_and_gauges()
+    test_concurrent_recording_loses_nothing()
+    print("✅ All metrics tests passed")
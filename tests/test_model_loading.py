@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+"""
+Tests for background model loading and readiness (no server or model required)
+"""
+
+import asyncio
+import threading
+
+import pytest
+
+from transformers_openai.model_manager import ModelManager, ServedModel
+
+
+def _manager(load):
+    """A ModelManager whose loading step is `load`, run in the worker thread like the real one"""
+    manager = ModelManager()
+    manager._load = lambda: load(manager)
+    return manager
+
+
+def test_requests_wait_for_readiness():
+    """Waiters are released when loading finishes, a short timeout gives up while it is still loading"""
+    release = threading.Event()
+
+    def load(manager):
+        manager._stage("model")
+        release.wait(5)
+        manager._stage("ready")
+
+    async def run():
+        manager = _manager(load)
+        loading = asyncio.create_task(manager.initialize())
+        await asyncio.sleep(0.05)
+        status = manager.load_status()
+        assert status["status"] == "loading" and status["stage"] == "model"
+        assert 0 < status["progress"] < 1
+        assert await manager.wait_ready(0.01) is False
+
+        waiter = asyncio.create_task(manager.wait_ready(5))
+        release.set()
+        assert await waiter is True
+        await loading
+        return manager.load_status()
+
+    status = asyncio.run(run())
+    assert status["status"] == "ready" and status["progress"] == 1.0
+    assert status["elapsed_seconds"] is not None
+
+
+def test_failed_load_releases_waiters():
+    """A load failure is reported and waiting requests are turned away at once"""
+    def load(manager):
+        manager._stage("tokenizer")
+        raise OSError("no such model")
+
+    async def run():
+        manager = _manager(load)
+        loading = asyncio.create_task(manager.initialize())
+        waiter = asyncio.create_task(manager.wait_ready(5))
+        with pytest.raises(OSError):
+            await loading
+        return manager, await waiter
+
+    manager, ready = asyncio.run(run())
+    assert ready is False
+    status = manager.load_status()
+    assert status["status"] == "failed" and status["stage"] == "tokenizer"
+    assert status["error"] == "OSError: no such model"
+
+
+def _fake_load(manager):
+    """Loads instantly, a model named "broken" fails"""
+    manager._stage("model")
+    if manager.model_name == "broken":
+        raise OSError("no such model")
+    manager.model = object()
+    manager.model_version = f"{manager.model_name}@{manager.revision}"
+    manager._stage("ready")
+
+
+def test_reload_switches_then_drains_the_previous_model(monkeypatch):
+    """New lookups go to the new model, the old one is freed once the requests sent to it finish"""
+    monkeypatch.setattr(ModelManager, "_load", _fake_load)
+
+    async def run():
+        served = ServedModel(ModelManager("base"))
+        await served.initialize()
+        pinned = served.load_status
+        # Sent to the current model before the switch, but not started yet
+        stream = served.generate_text_stream("hello")
+
+        previous = await served.reload("base", revision="v2")
+        assert served.model_version == "base@v2" and previous.model_version == "base@None"
+        assert pinned.__self__ is previous
+        with pytest.raises(RuntimeError):
+            await served.reload("other")
+
+        retiring = asyncio.create_task(served.retire(previous, timeout=5))
+        await asyncio.sleep(0.15)
+        status = served.reload_status()
+        assert status["state"] == "draining" and status["in_flight"] == 1
+        assert previous.model is not None
+
+        del stream
+        await retiring
+        return served, previous
+
+    served, previous = asyncio.run(run())
+    assert previous.model is None
+    assert served.reload_status()["state"] == "completed"
+    assert not served.reloading
+
+
+def test_failed_reload_keeps_the_current_model(monkeypatch):
+    """A model that does not load is reported and never switched to"""
+    monkeypatch.setattr(ModelManager, "_load", _fake_load)
+
+    async def run():
+        served = ServedModel(ModelManager("base"))
+        await served.initialize()
+        current = served.current
+        assert await served.reload("broken") is None
+        return served, current
+
+    served, current = asyncio.run(run())
+    assert served.current is current and served.ready
+    status = served.reload_status()
+    assert status["state"] == "failed" and status["error"] == "OSError: no such model"
+    assert status["load"]["stage"] == "model"
+    assert not served.reloading
+
+
+if __name__ == "__main__":
+    test_requests_wait_for_readiness()
+    test_failed_load_releases_waiters()
+    pytest.main([__file__, "-q", "-k", "reload"])
+    print("✅ All model loading tests passed")
@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+"""
+Tests for the request profiler (no server or model required)
+"""
+
+import json
+import tempfile
+
+import torch
+
+from transformers_openai.profiling import RequestProfiler
+
+
+def _sampled(profiler: RequestProfiler, requests: int):
+    """Numbers of the requests the profiler picks, without starting a real session"""
+    picked = []
+    for number in range(1, requests + 1):
+        if profiler._sampled():
+            picked.append(number)
+    return picked
+
+
+def test_every_nth_request_is_sampled():
+    """One in `every` requests is profiled and 0 disables sampling"""
+    assert _sampled(RequestProfiler(every=3), 10) == [3, 6, 9]
+    assert _sampled(RequestProfiler(every=0), 10) == []
+
+
+def test_triggered_requests_are_profiled_next():
+    """Triggered requests come first and are used up one per request"""
+    profiler = RequestProfiler(every=0)
+    assert profiler.trigger(2) == 2
+    assert _sampled(profiler, 5) == [1, 2]
+    assert profiler.pending == 0
+
+
+def test_trace_labels_prefill_and_decode():
+    """A profiled generate loop writes a Chrome trace with prefill and decode regions"""
+    weight = torch.randn(32, 32)
+    with tempfile.TemporaryDirectory() as output_dir:
+        profiler = RequestProfiler(every=1, output_dir=output_dir, warmup=2, active=3)
+        with profiler.profile("generate") as steps:
+            assert steps is not None
+            # Stands in for generate(): a forward pass, then the logits processors
+            for _ in range(6):
+                scores = torch.relu(weight @ weight)
+                steps(None, scores)
+        assert len(profiler.recent_traces) == 1
+        with open(profiler.recent_traces[0], encoding="utf-8") as f:
+            names = [event.get("name") for event in json.load(f)["traceEvents"]]
+    assert names.count("prefill") == 1
+    # The active window holds the prefill and the first two decode steps
+    assert names.count("decode") == 2
+
+
+def test_overlapping_requests_are_skipped():
+    """Only one profiler runs at a time, a triggered request waits for the next one"""
+    profiler = RequestProfiler(every=0, output_dir=tempfile.gettempdir())
+    profiler.trigger(1)
+    with profiler.busy:
+        with profiler.profile("stream") as steps:
+            assert steps is None
+    assert profiler.pending == 1
+
+
+if __name__ == "__main__":
+    test_every_nth_request_is_sampled()
+    test_triggered_requests_are_profiled_next()
+    test_trace_labels_prefill_and_decode()
+    test_overlapping_requests_are_skipped()
+    print("✅ All profiling tests passed")
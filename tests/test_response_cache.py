@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+"""
+Tests for the deterministic response cache (no server or model required)
+"""
+
+import asyncio
+import os
+import tempfile
+import time
+
+from transformers_openai.response_cache import ResponseCache, record_chunks, replay_chunks
+
+
+def _result(text):
+    return {
+        "choices": [{"index": 0, "text": text, "reasoning_content": None, "finish_reason": "stop"}],
+        "prompt_tokens": 3,
+        "completion_tokens": 2,
+        "total_tokens": 5,
+    }
+
+
+def test_keys_are_canonical():
+    """Parameter order does not matter, parameter values do"""
+    assert ResponseCache.make_key(a=1, b=[1, 2]) == ResponseCache.make_key(b=[1, 2], a=1)
+    assert ResponseCache.make_key(a=1, b=[1, 2]) != ResponseCache.make_key(a=1, b=[2, 1])
+
+
+def test_memory_tier_is_lru():
+    """The least recently used entry is evicted first"""
+    cache = ResponseCache(memory_entries=2)
+    cache.put("a", _result("a"))
+    cache.put("b", _result("b"))
+    assert cache.get("a")["choices"][0]["text"] == "a"
+    cache.put("c", _result("c"))
+    assert cache.get("b") is None
+    assert cache.get("a") is not None and cache.get("c") is not None
+    assert (cache.hits, cache.misses) == (3, 1)
+
+
+def test_entries_expire():
+    """Entries older than the TTL are misses"""
+    cache = ResponseCache(ttl=0.05)
+    cache.put("a", _result("a"))
+    assert cache.get("a") is not None
+    time.sleep(0.1)
+    assert cache.get("a") is None
+
+
+def test_disk_tier_survives_restart_and_respects_size():
+    """Entries are read back from SQLite and the file stays within its budget"""
+    with tempfile.TemporaryDirectory() as root:
+        path = os.path.join(root, "cache.sqlite")
+        cache = ResponseCache(memory_entries=0, path=path)
+        cache.put("a", _result("a"))
+        assert ResponseCache(path=path).get("a")["choices"][0]["text"] == "a"
+
+        entry_size = cache.disk_bytes
+        small = ResponseCache(memory_entries=0, path=path, max_bytes=entry_size * 2)
+        small.put("b", _result("b"))
+        small.get("a")
+        small.put("c", _result("c"))
+        assert small.get("b") is None
+        assert small.get("a") is not None and small.get("c") is not None
+
+
+def test_streams_are_recorded_and_replayed():
+    """A recorded stream is stored once complete and replays to the same text"""
+    async def stream():
+        for index, text in [(0, "Hel"), (1, "Bye"), (0, "lo")]:
+            yield {"index": index, "text": text, "finish_reason": None}
+        for index in (0, 1):
+            yield {"index": index, "text": "", "finish_reason": "stop", "prompt_tokens": 4, "completion_tokens": 6, "total_tokens": 10}
+
+    async def run():
+        stored = []
+
+        async def on_complete(result):
+            stored.append(result)
+
+        chunks = [chunk async for chunk in record_chunks(stream(), 2, on_complete)]
+        replayed = [chunk async for chunk in replay_chunks(stored[0])]
+        return chunks, stored, replayed
+
+    chunks, stored, replayed = asyncio.run(run())
+    assert len(chunks) == 5 and len(stored) == 1
+    assert [choice["text"] for choice in stored[0]["choices"]] == ["Hello", "Bye"]
+    assert stored[0]["total_tokens"] == 10
+    assert [(chunk["index"], chunk["text"], chunk["finish_reason"]) for chunk in replayed] == [(0, "Hello", "stop"), (1, "Bye", "stop")]
+
+
+if __name__ == "__main__":
+    test_keys_are_canonical()
+    test_memory_tier_is_lru()
+    test_entries_expire()
+    test_disk_tier_survives_restart_and_respects_size()
+    test_streams_are_recorded_and_replayed()
+    print("✅ All response cache tests passed")
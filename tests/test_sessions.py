@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+"""
+Tests for the tiered session KV store (no server or model required)
+"""
+
+import os
+import tempfile
+import time
+
+import torch
+
+from transformers_openai.sessions import SessionStore
+
+CPU = torch.device("cpu")
+
+
+def _layers(tokens: int, layers: int = 2):
+    """KV of one sequence, 2 layers of [1, 2 heads, tokens, 4] float32: 128 bytes per token"""
+    return [(torch.randn(1, 2, tokens, 4), torch.randn(1, 2, tokens, 4)) for _ in range(layers)]
+
+
+def test_take_restores_and_removes():
+    """A session's KV comes back unchanged once, then the turn puts its extended KV back"""
+    store = SessionStore(CPU, device_bytes=1 << 20, host_bytes=1 << 20)
+    layers = _layers(3)
+    store.put("a", [1, 2, 3], layers)
+    token_ids, restored = store.take("a")
+    assert token_ids == [1, 2, 3]
+    assert all(torch.equal(k, rk) and torch.equal(v, rv) for (k, v), (rk, rv) in zip(layers, restored))
+    assert store.take("a") is None
+    assert (store.hits, store.misses) == (1, 1)
+    assert store.stats()["device_bytes"] == 0
+
+
+def test_idle_sessions_move_down_the_tiers():
+    """Idle entries go from the device to host memory to disk, and come back from disk intact"""
+    with tempfile.TemporaryDirectory() as path:
+        store = SessionStore(
+            CPU, device_bytes=1 << 20, host_bytes=1 << 20, disk_dir=path, disk_bytes=1 << 20,
+            host_after=0.05, disk_after=0.2, ttl=60,
+        )
+        layers = _layers(4)
+        store.put("a", [1, 2, 3, 4], layers)
+        time.sleep(0.1)
+        store.maintain()
+        assert store.stats()["host_sessions"] == 1
+        time.sleep(0.15)
+        store.maintain()
+        stats = store.stats()
+        assert stats["disk_sessions"] == 1 and stats["disk_bytes"] == 4 * 128
+        assert len(os.listdir(path)) == 1
+
+        token_ids, restored = store.take("a")
+        assert token_ids == [1, 2, 3, 4]
+        assert torch.equal(restored[1][0], layers[1][0])
+        assert os.listdir(path) == []
+
+
+def test_budgets_demote_least_recently_used_first():
+    """A full tier pushes its oldest entries down, the last tier drops them, and ttl expires them"""
+    store = SessionStore(CPU, device_bytes=2 * 4 * 128, host_bytes=4 * 128, ttl=60)
+    for session_id in "abc":
+        store.put(session_id, [1, 2, 3, 4], _layers(4))
+    assert store.entries["a"].tier == "host"
+    assert store.entries["b"].tier == store.entries["c"].tier == "device"
+    store.put("d", [1, 2, 3, 4], _layers(4))
+    # a left host memory for b and there is no disk tier
+    assert "a" not in store.entries and store.entries["b"].tier == "host"
+
+    store.ttl = 0.01
+    time.sleep(0.02)
+    store.maintain()
+    assert not store.entries and store.stats()["device_bytes"] == store.stats()["host_bytes"] == 0
+
+
+def test_clear_removes_disk_files():
+    with tempfile.TemporaryDirectory() as path:
+        store = SessionStore(CPU, device_bytes=0, host_bytes=0, disk_dir=path, disk_bytes=1 << 20)
+        store.put("a", [1], _layers(1))
+        assert store.entries["a"].tier == "disk" and len(os.listdir(path)) == 1
+        store.clear()
+        assert os.listdir(path) == [] and not store.entries
+
+
+if __name__ == "__main__":
+    test_take_restores_and_removes()
+    test_idle_sessions_move_down_the_tiers()
+    test_budgets_demote_least_recently_used_first()
+    test_clear_removes_disk_files()
+    print("✅ All session store tests passed")
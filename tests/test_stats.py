@@ -0,0 +1,59 @@
+#!/usr/bin/env python3
+"""
+Tests for the live stats stream (no server or model required)
+"""
+
+import asyncio
+import json
+
+from transformers_openai.stats import ProcessStats, StatsHub
+
+
+def test_one_sample_feeds_every_subscriber():
+    """Subscribers share each snapshot, and sampling stops when the last one leaves"""
+    calls = []
+
+    def sample():
+        calls.append(1)
+        return {"generation_tokens_total": 10 * len(calls)}
+
+    async def run():
+        hub = StatsHub(sample, interval=0.02)
+
+        async def take(count, interval=None):
+            messages = []
+            async for message in hub.subscribe(interval):
+                messages.append(json.loads(message))
+                if len(messages) == count:
+                    break
+            return messages
+
+        fast, slow = await asyncio.gather(take(6), take(2, interval=0.1))
+        await asyncio.sleep(0.05)
+        return hub, fast, slow
+
+    hub, fast, slow = asyncio.run(run())
+    # Both subscribers were served by one sampler
+    assert len(calls) <= 8
+    assert [m["generation_tokens_total"] for m in fast] == [10 * (i + 1) for i in range(6)]
+    assert fast[0]["generation_tokens_per_second"] is None
+    assert fast[1]["generation_tokens_per_second"] > 0
+    # The slow subscriber skipped the snapshots in between
+    assert slow[1]["timestamp"] - slow[0]["timestamp"] >= 0.08
+    assert hub.task is None and not hub.subscribers
+
+
+def test_process_stats_do_not_block():
+    """CPU usage is measured from the previous sample instead of waiting"""
+    stats = ProcessStats()
+    assert stats.sample()["process_cpu_percent"] is None
+    sum(i * i for i in range(200000))
+    second = stats.sample()
+    assert second["process_cpu_percent"] >= 0
+    assert second["process_rss_bytes"] is None or second["process_rss_bytes"] > 0
+
+
+if __name__ == "__main__":
+    test_one_sample_feeds_every_subscriber()
+    test_process_stats_do_not_block()
+    print("✅ All stats tests passed")
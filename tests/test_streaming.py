@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+"""
+Tests for SSE chunk coalescing (no server required)
+"""
+
+import asyncio
+
+from transformers_openai.config import config
+from transformers_openai.models import StreamOptions
+from transformers_openai.streaming import coalesce_chunks, coalesce_policy, merge_chunks
+
+
+async def _source(texts, delay=0.0):
+    for i, text in enumerate(texts):
+        if delay:
+            await asyncio.sleep(delay)
+        yield {"text": text, "finish_reason": "stop" if i == len(texts) - 1 else None}
+
+
+async def _collect(source, **policy):
+    return [batch async for batch in coalesce_chunks(source, **policy)]
+
+
+def test_passthrough_by_default():
+    """Without a policy every chunk is its own frame, also with the deployment defaults"""
+    batches = asyncio.run(_collect(_source(["a", "b", "c"])))
+    assert [len(b) for b in batches] == [1, 1, 1]
+    config.parse([])
+    max_latency, max_tokens = coalesce_policy()
+    batches = asyncio.run(_collect(_source(["a", "b", "c"]), max_latency=max_latency, max_tokens=max_tokens))
+    assert [len(b) for b in batches] == [1, 1, 1]
+
+
+def test_coalesce_by_tokens():
+    """First chunk is flushed alone, the rest in groups, the final chunk immediately"""
+    texts = [str(i) for i in range(8)]
+    batches = asyncio.run(_collect(_source(texts), max_tokens=3))
+    assert [len(b) for b in batches] == [1, 3, 3, 1]
+    assert "".join(merge_chunks(b)[0]["text"] for b in batches) == "".join(texts)
+    assert merge_chunks(batches[-1])[0]["finish_reason"] == "stop"
+
+
+def test_coalesce_by_latency():
+    """Buffered chunks are flushed once the latency budget runs out, a request setting only coalesce_ms is enough"""
+    config.parse([])
+    max_latency, max_tokens = coalesce_policy(StreamOptions(coalesce_ms=50))
+    assert max_latency == 0.05
+    texts = [str(i) for i in range(6)]
+    for tokens in (max_tokens, 1):
+        batches = asyncio.run(
+            _collect(_source(texts, delay=0.02), max_latency=max_latency, max_tokens=tokens)
+        )
+        assert len(batches[0]) == 1
+        assert 2 < len(batches) < len(texts)
+        assert sum(len(b) for b in batches) == len(texts)
+
+
+def test_merge_keeps_choices_apart():
+    """Deltas of different choices are merged per index in arrival order"""
+    chunks = [
+        {"index": 0, "text": "a"},
+        {"index": 1, "text": "x"},
+        {"index": 0, "text": "b", "finish_reason": "stop"},
+    ]
+    merged = merge_chunks(chunks)
+    assert [(c["index"], c["text"]) for c in merged] == [(0, "ab"), (1, "x")]
+    assert merged[0]["finish_reason"] == "stop"
+
+
+if __name__ == "__main__":
+    test_passthrough_by_default()
+    test_coalesce_by_tokens()
+    test_coalesce_by_latency()
+    test_merge_keeps_choices_apart()
+    print("✅ All streaming tests passed")
@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+"""
+Tests for CPU tensor parallelism over gloo (no server required, a tiny random model is built)
+"""
+
+import tempfile
+
+import pytest
+import torch
+import transformers
+from transformers import LogitsProcessor, StoppingCriteria
+
+from benchmarks.tiny_model import build_tiny_llama
+from transformers_openai.generation import BatchedSampler
+from transformers_openai.tensor_parallel import load_sharded
+
+WORLD_SIZE = 2
+
+
+def _tiny_model(path: str):
+    model = build_tiny_llama()
+    model.save_pretrained(path)
+    return model
+
+
+class StopAtLength(StoppingCriteria):
+    """Stops row i once it holds lengths[i] tokens, judged from the ids like a stop sequence is"""
+
+    def __init__(self, lengths):
+        self.lengths = torch.tensor(lengths)
+
+    def __call__(self, input_ids, scores, **kwargs):
+        return torch.full_like(self.lengths, input_ids.shape[1]) >= self.lengths
+
+
+class FailAt(LogitsProcessor):
+    """Raises at a given step, like a guided decoding error or a stream stalled on rank 0"""
+
+    def __init__(self, step: int):
+        self.step = step
+
+    def __call__(self, input_ids, scores):
+        self.step -= 1
+        if self.step <= 0:
+            raise RuntimeError("rank 0 failed")
+        return scores
+
+    def put(self, value):
+        self(None, None)
+
+    def end(self):
+        pass
+
+
+def test_sharded_generation_follows_rank_zero():
+    """Greedy output matches the unsharded model, sampling and early stops run on rank 0 without the ranks drifting"""
+    input_ids = torch.tensor([[5, 9, 12, 7], [0, 0, 3, 8]])
+    attention_mask = torch.tensor([[1, 1, 1, 1], [0, 0, 1, 1]])
+    kwargs = dict(input_ids=input_ids, attention_mask=attention_mask, max_new_tokens=8, do_sample=False, pad_token_id=0)
+
+    with tempfile.TemporaryDirectory() as path:
+        tiny = _tiny_model(path)
+        reference = tiny.generate(**kwargs, eos_token_id=None)
+        reference_stopped = tiny.generate(
+            **kwargs, eos_token_id=None, stopping_criteria=transformers.StoppingCriteriaList([StopAtLength([7, 9])])
+        )
+        model = load_sharded(path, None, torch.float32, WORLD_SIZE)
+        try:
+            with torch.no_grad():
+                sharded = model.generate(**kwargs, eos_token_id=None)
+                sharded_stopped = model.generate(
+                    **kwargs, eos_token_id=None, stopping_criteria=transformers.StoppingCriteriaList([StopAtLength([7, 9])])
+                )
+                sampler = BatchedSampler(
+                    temperature=[1.0, 1.0], top_p=[1.0, 1.0], top_k=[0, 0],
+                    frequency_penalty=[0.0, 0.0], presence_penalty=[0.0, 0.0], seed=[None, None],
+                )
+                stopped = model.generate(
+                    **kwargs,
+                    eos_token_id=None,
+                    logits_processor=transformers.LogitsProcessorList([sampler]),
+                    stopping_criteria=transformers.StoppingCriteriaList([StopAtLength([7, 7])]),
+                )
+                # Hidden states of the sharded base model, as pooled for embeddings
+                hidden = model.base_model(input_ids=input_ids, attention_mask=attention_mask).last_hidden_state
+            assert all(worker.is_alive() for worker in model.workers)
+        finally:
+            model.close()
+
+    assert torch.equal(sharded, reference)
+    # Stopping criteria see this step's token on rank 0, so the ranks stop where a single process does
+    assert torch.equal(sharded_stopped, reference_stopped) and sharded_stopped.shape == (2, 9)
+    # Every rank left the decoding loop after the third token
+    assert stopped.shape == (2, 7)
+    assert hidden.shape == (2, 4, 32)
+
+
+def test_rank_zero_failure_stops_every_rank():
+    """A rank 0 logits processor or streamer that raises ends generate() on every rank, the next call runs normally"""
+    input_ids = torch.tensor([[5, 9, 12, 7]])
+    kwargs = dict(input_ids=input_ids, max_new_tokens=8, do_sample=False, pad_token_id=0, eos_token_id=None)
+
+    with tempfile.TemporaryDirectory() as path:
+        reference = _tiny_model(path).generate(**kwargs)
+        model = load_sharded(path, None, torch.float32, WORLD_SIZE)
+        try:
+            with torch.no_grad():
+                with pytest.raises(RuntimeError, match="rank 0 failed"):
+                    model.generate(**kwargs, logits_processor=transformers.LogitsProcessorList([FailAt(3)]))
+                with pytest.raises(RuntimeError, match="rank 0 failed"):
+                    model.generate(**kwargs, streamer=FailAt(3))
+                outputs = model.generate(**kwargs)
+            assert all(worker.is_alive() for worker in model.workers)
+        finally:
+            model.close()
+
+    assert torch.equal(outputs, reference)
+
+
+if __name__ == "__main__":
+    test_sharded_generation_follows_rank_zero()
+    test_rank_zero_failure_stops_every_rank()
+    print("✅ All tensor parallel tests passed")
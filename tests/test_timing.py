@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+"""
+Tests for the per-request latency breakdown (no server or model required)
+"""
+
+import asyncio
+import time
+
+from transformers_openai.metrics import Metrics
+from transformers_openai.scheduler import Scheduler
+from transformers_openai.timing import RequestTiming
+
+
+def test_phases_accumulate_and_report_in_order():
+    """Repeated phases add up, phases never entered are None and Server-Timing lists the known ones in ms"""
+    timing = RequestTiming(start=time.perf_counter() - 1.0)
+    timing.add("serialization", 0.002)
+    timing.add("serialization", 0.003)
+    timing.set("decode", 0.5)
+    timing.set("decode", 0.75)
+    with timing.phase("templating"):
+        pass
+
+    report = timing.report()
+    assert list(report) == ["queue", "templating", "tokenization", "prefill", "decode", "serialization", "total"]
+    assert report["queue"] is None and report["tokenization"] is None
+    assert abs(report["serialization"] - 0.005) < 1e-12
+    assert report["decode"] == 0.75
+    assert report["total"] >= 1.0
+
+    entries = [entry.split(";dur=") for entry in timing.server_timing().split(", ")]
+    assert [name for name, _ in entries] == ["templating", "decode", "serialization", "total"]
+    assert dict(entries)["decode"] == "750.000"
+
+
+def test_phases_feed_the_metrics():
+    """Every phase but the queue, which the scheduler records itself, gets a histogram observation"""
+    registry = Metrics(prefix="test")
+    registry.record_phases({"queue": 0.1, "tokenization": 0.002, "prefill": 0.05, "decode": 1.5})
+    rendered = registry.render()
+    assert "test_request_tokenization_time_seconds_count 1" in rendered
+    assert "test_request_decode_time_seconds_sum 1.5" in rendered
+    assert "test_request_templating_time_seconds_count 0" in rendered
+    assert "test_request_queue_time_seconds_count 0" in rendered
+
+
+def test_scheduler_reports_queue_time():
+    """A job that waits for a slot gets its waiting time back from the scheduler"""
+    async def run():
+        scheduler = Scheduler(1)
+        assert await scheduler.acquire() == 0.0
+
+        async def release_later():
+            await asyncio.sleep(0.05)
+            scheduler.release()
+
+        asyncio.create_task(release_later())
+        async with scheduler.slot() as queue_time:
+            return queue_time
+
+    assert asyncio.run(run()) >= 0.04
+
+
+if __name__ == "__main__":
+    test_phases_accumulate_and_report_in_order()
+    test_phases_feed_the_metrics()
+    test_scheduler_reports_queue_time()
+    print("✅ All timing tests passed")
@@ -1,11 +1,16 @@
-from fastapi import FastAPI, HTTPException
-from fastapi.responses import StreamingResponse
+from fastapi import FastAPI, HTTPException, UploadFile, File, Form, Header, Response
+from fastapi.responses import StreamingResponse, FileResponse, JSONResponse
 from fastapi.middleware.cors import CORSMiddleware
 import uuid
 import json
+import time
 import logging
-from typing import AsyncGenerator
+from contextlib import asynccontextmanager
+from typing import Any, AsyncGenerator, AsyncIterator, Callable, Dict, List, Optional, Sequence
 import asyncio
+import base64
+import hmac
+import struct
 
 from transformers_openai.models import (
     ChatCompletionRequest,
@@ -15,17 +20,43 @@ from transformers_openai.models import (
     ChatCompletionStreamResponse,
     ChatCompletionStreamChoice,
     ChatMessage,
+    UsageTiming,
+    CompletionRequest,
+    CompletionResponse,
+    CompletionChoice,
+    EmbeddingRequest,
+    EmbeddingResponse,
+    EmbeddingData,
+    EmbeddingUsage,
+    FileObject,
+    FileListResponse,
+    BatchCreateRequest,
+    BatchObject,
+    BatchListResponse,
+    ReloadRequest,
     ModelListResponse,
     ModelInfo,
     ErrorResponse
 )
-from transformers_openai.model_manager import model_manager
+from transformers_openai.model_manager import ModelManager, model_manager
+from transformers_openai.streaming import coalesce_chunks, coalesce_policy, merge_chunks
+from transformers_openai.embeddings import EmbeddingBatcher
+from transformers_openai.scheduler import Scheduler, StreamSlot
+from transformers_openai.batch import BatchRunner, FileStore, SUPPORTED_ENDPOINTS
+from transformers_openai.guided import guide_pattern
+from transformers_openai.response_cache import ResponseCache, cache_entry, record_chunks, replay_chunks
+from transformers_openai.metrics import metrics
+from transformers_openai.stats import ProcessStats, StatsHub
+from transformers_openai.timing import DeadlineExceeded, RequestTiming
 from transformers_openai.config import config
 
 # Configure logging
 logging.basicConfig(level=getattr(logging, config.args.loglevel.upper()))
 logger = logging.getLogger(__name__)
 
+# Seconds between passes that move idle session KV caches to slower tiers
+SESSION_MAINTENANCE_INTERVAL = 5.0
+
 app = FastAPI(
     title="Transformers OpenAI API",
     description="OpenAI compatible API for Transformers models",
@@ -60,203 +91,932 @@ class RequestLimiter:
 
 request_limiter = RequestLimiter(config.args.max_concurrent)
 
+# Generation slots, interactive requests are admitted before offline batches
+scheduler = Scheduler(config.args.continuous_batching_batch_size)
+
+file_store = FileStore(config.args.batch_storage_dir)
+batch_runner = BatchRunner(
+    config.args.batch_storage_dir,
+    file_store,
+    scheduler,
+    model_manager,
+    batch_size=config.args.batch_api_batch_size,
+    guided_json_depth=config.args.guided_json_depth,
+)
+response_cache = ResponseCache(
+    memory_entries=config.args.response_cache_entries,
+    path=config.args.response_cache_path,
+    ttl=config.args.response_cache_ttl,
+    max_bytes=config.args.response_cache_max_mb * 1024 * 1024,
+) if config.args.response_cache else None
+
+
+def request_guide(request) -> Optional[str]:
+    """Pattern the output of a request is constrained to, rejecting unsupported formats with a 400"""
+    try:
+        return guide_pattern(
+            request.response_format.model_dump() if request.response_format else None,
+            request.guided_regex,
+            config.args.guided_json_depth,
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+def set_deadline(timing: RequestTiming, timeout: Optional[float], header: Optional[str]):
+    """When the client stops waiting: the body's timeout, else the X-Request-Timeout header, else --request-timeout"""
+    if timeout is None and header:
+        try:
+            timeout = float(header)
+        except ValueError:
+            raise HTTPException(status_code=400, detail="X-Request-Timeout must be a number of seconds")
+        if timeout <= 0:
+            raise HTTPException(status_code=400, detail="X-Request-Timeout must be positive")
+    if timeout is None and config.args.request_timeout > 0:
+        timeout = config.args.request_timeout
+    if timeout is not None:
+        timing.deadline = timing.start + timeout
+
+
+async def wait_until_ready(timing: Optional[RequestTiming] = None):
+    """Hold a request that arrives while the model loads, 503 if it is not ready within --ready-timeout"""
+    if model_manager.ready:
+        return
+    start = time.perf_counter()
+    if not await model_manager.wait_ready(config.args.ready_timeout):
+        status = model_manager.load_status()
+        raise HTTPException(
+            status_code=503,
+            detail=f"Model is not ready ({status['status']} at stage {status['stage']})",
+            headers={"Retry-After": "5"},
+        )
+    if timing is not None:
+        timing.add("queue", time.perf_counter() - start)
+
+
+def finish_timing(timing: RequestTiming) -> UsageTiming:
+    """The latency breakdown of a finished request, recorded in the metrics as it is reported"""
+    metrics.record_phases(timing.phases)
+    return UsageTiming(**timing.report())
+
+
+def response_cache_key(endpoint: str, manager: ModelManager, temperature: float, **params) -> Optional[str]:
+    """Cache key for a greedy request served by `manager`, None when the response cache does not apply"""
+    if response_cache is None or temperature > 0:
+        return None
+    return ResponseCache.make_key(
+        endpoint=endpoint, model=manager.model_name, version=manager.model_version, **params
+    )
+
+
+def sampling_params(request) -> dict:
+    """Per-request sampling parameters shared by the generation endpoints, beside temperature and top_p"""
+    return {
+        "top_k": request.top_k or 0,
+        "frequency_penalty": request.frequency_penalty or 0.0,
+        "presence_penalty": request.presence_penalty or 0.0,
+        "seed": request.seed,
+    }
+
+
+def stop_list(stop) -> Optional[List[str]]:
+    if not stop:
+        return None
+    return [stop] if isinstance(stop, str) else stop
+
+
+class LimiterHold:
+    """A place in request_limiter and an in-flight count on the serving manager, see limited_generation()"""
+
+    def __init__(self, manager: ModelManager):
+        self.streaming = False
+        self.release_manager = manager.track_request()
+
+    async def release(self):
+        self.release_manager()
+        await request_limiter.release()
+
+
+@asynccontextmanager
+async def limited_generation(endpoint: str, manager: ModelManager):
+    """Hold a request_limiter place for a generation request and turn its errors into HTTP errors.
+
+    The request counts as in flight on `manager` from the start, so a reload
+    drains it even while it waits for a place. Both are released on exit
+    unless a streamed response took them over by setting `streaming`,
+    stream_frames() releases them when the stream ends.
+    """
+    hold = LimiterHold(manager)
+    try:
+        await request_limiter.acquire()
+    except BaseException:
+        hold.release_manager()
+        raise
+    try:
+        yield hold
+    except HTTPException:
+        raise
+    except DeadlineExceeded as e:
+        raise HTTPException(status_code=504, detail=str(e))
+    except Exception as e:
+        logger.error(f"Error in {endpoint}: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+    finally:
+        if not hold.streaming:
+            await hold.release()
+
+
+async def stream_frames(
+    hold: LimiterHold,
+    timing: RequestTiming,
+    stream_options,
+    cached,
+    cache_key: Optional[str],
+    num_choices: int,
+    start: Callable[[StreamSlot], AsyncIterator[Dict[str, Any]]],
+    render: Callable[[List[Dict[str, Any]], Optional[Dict[str, Any]]], Any],
+    leading_frames: Sequence[Any] = (),
+) -> AsyncGenerator[str, None]:
+    """SSE frames of a streamed generation, ending with [DONE] or an error event.
+
+    `start` begins the generation once a slot is held, unless the response
+    comes from the cache. Chunks are coalesced by the request's
+    stream_options and handed to `render` merged per choice, together with
+    the last chunk once every choice has finished so it can report usage.
+    The slot and `hold` are released when the stream ends.
+    """
+    slot = StreamSlot(scheduler, timing.deadline)
+    max_latency, max_tokens = coalesce_policy(stream_options)
+    try:
+        for frame in leading_frames:
+            yield f"data: {frame.model_dump_json()}\n\n"
+
+        if cached is not None:
+            source = replay_chunks(cached)
+        else:
+            timing.add("queue", await slot.acquire())
+            source = start(slot)
+            if cache_key:
+                source = record_chunks(source, num_choices, lambda result: asyncio.to_thread(response_cache.put, cache_key, result))
+
+        finished_choices = 0
+        async for chunks in coalesce_chunks(source, max_latency=max_latency, max_tokens=max_tokens):
+            serialize_start = time.perf_counter()
+            merged = merge_chunks(chunks)
+            finished_choices += sum(1 for chunk in merged if chunk.get("finish_reason"))
+            finished = finished_choices == num_choices
+            data = render(merged, chunks[-1] if finished else None).model_dump_json()
+            timing.add("serialization", time.perf_counter() - serialize_start)
+            yield f"data: {data}\n\n"
+            if finished:
+                break
+        yield "data: [DONE]\n\n"
+
+    except Exception as e:
+        logger.error(f"Error in streaming generation: {str(e)}")
+        error_response = {
+            "error": {
+                "message": str(e),
+                "type": "timeout" if isinstance(e, DeadlineExceeded) else "server_error"
+            }
+        }
+        yield f"data: {json.dumps(error_response)}\n\n"
+        yield "data: [DONE]\n\n"
+
+    finally:
+        slot.close()
+        await hold.release()
+
+
+def stream_usage(chunk: Dict[str, Any], timing: RequestTiming, cached_tokens: bool = True) -> ChatCompletionUsage:
+    """Usage reported with the last frame of a stream"""
+    return ChatCompletionUsage(
+        prompt_tokens=chunk.get("prompt_tokens", 0),
+        cached_tokens=chunk.get("cached_tokens") if cached_tokens else None,
+        completion_tokens=chunk.get("completion_tokens", 0),
+        total_tokens=chunk.get("total_tokens", 0),
+        time_to_first_token=chunk.get("time_to_first_token"),
+        total_time=chunk.get("total_time"),
+        tokens_per_second=chunk.get("tokens_per_second"),
+        timing=finish_timing(timing)
+    )
+
+
+def streaming_response(frames: AsyncGenerator[str, None], hold: LimiterHold, timing: RequestTiming, cached, cache_key) -> StreamingResponse:
+    """The SSE response of stream_frames(), which takes over `hold`"""
+    hold.streaming = True
+    return StreamingResponse(
+        frames,
+        media_type="text/event-stream",
+        headers={
+            "Cache-Control": "no-cache", 
+            "Connection": "keep-alive",
+            "Content-Type": "text/event-stream",
+            # Only the phases before the stream are known here, the full breakdown is in the final usage
+            "Server-Timing": timing.server_timing(),
+            **({"X-Cache": "HIT" if cached is not None else "MISS"} if cache_key else {})
+        }
+    )
+
+# Gauges are read when /metrics is scraped, from whichever model is being served at the time
+metrics.gauge("num_requests_running", "Generation jobs holding a slot", lambda: scheduler.running)
+metrics.gauge("num_requests_waiting", "Generation jobs waiting for a slot", lambda: scheduler.num_waiting)
+metrics.gauge("model_ready", "1 once the model is loaded and warmed up", lambda: int(model_manager.ready))
+metrics.gauge("concurrent_requests", "Requests admitted by the concurrency limit", lambda: request_limiter.current_requests)
+metrics.gauge("kv_cache_tokens", "Token positions in the KV caches of running generations", lambda: model_manager.kv_cache_tokens())
+metrics.gauge("kv_cache_bytes", "Estimated size of the KV caches of running generations", lambda: model_manager.kv_cache_bytes())
+metrics.gauge("kv_cache_usage_ratio", "Share of the device memory taken by running KV caches", lambda: model_manager.kv_cache_usage())
+metrics.gauge("streams_stalled", "Streams paused until their client reads again", lambda: len(model_manager.stalled_streams))
+for tier in ("device", "host", "disk"):
+    metrics.gauge(
+        f"session_cache_{tier}_bytes",
+        f"Size of the session KV caches kept in {tier} storage",
+        lambda tier=tier: model_manager.sessions.tier_bytes[tier] if model_manager.sessions is not None else None,
+    )
+if response_cache is not None:
+    metrics.gauge(
+        "response_cache_usage_ratio",
+        "Share of the response cache memory entries in use",
+        lambda: len(response_cache.memory) / max(1, response_cache.memory_entries),
+    )
+    metrics.gauge(
+        "response_cache_hit_ratio",
+        "Share of response cache lookups that were hits",
+        lambda: response_cache.hits / max(1, response_cache.hits + response_cache.misses),
+    )
+
+# One sampler feeds every /stats/stream subscriber
+process_stats = ProcessStats()
+stats_hub = StatsHub(
+    lambda: {
+        "model": model_manager.model_name,
+        **metrics.values(),
+        **process_stats.sample(),
+        **model_manager.device_stats(),
+    },
+    interval=config.args.stats_interval,
+)
+
+embedding_batcher = EmbeddingBatcher(
+    lambda texts: model_manager.embed(texts),
+    max_batch_size=config.args.embedding_batch_size,
+    window=config.args.embedding_batch_window_ms / 1000,
+    cache_size=config.args.embedding_cache_size,
+)
+
+
+async def load_model():
+    """Load the model, then start the work that needs it"""
+    try:
+        await model_manager.initialize()
+    except Exception:
+        # Logged and reported by the health endpoints
+        return
+    # Resumes batches that were interrupted by a restart
+    batch_runner.start()
+    logger.info("Application startup completed")
+
+
+async def reload_model(model: str, revision: Optional[str]):
+    """Swap in another model or revision, then drain and free the previous one"""
+    previous = await model_manager.reload(model, revision)
+    if previous is None:
+        return
+    if not config.args.embedding_model:
+        # Embeddings of the chat model changed with it
+        embedding_batcher.cache.entries.clear()
+    if batch_runner.task is None:
+        # The initial load had failed, batches start with the first working model
+        batch_runner.start()
+    await model_manager.retire(previous, config.args.drain_timeout)
+
+
+async def maintain_sessions():
+    """Demote idle session KV caches even while no request touches the store"""
+    while True:
+        await asyncio.sleep(SESSION_MAINTENANCE_INTERVAL)
+        sessions = model_manager.sessions
+        if sessions is not None:
+            await asyncio.to_thread(sessions.maintain)
+
 
 @app.on_event("startup")
 async def startup_event():
-    """Initialize the model on startup"""
+    """Load the model in the background, the server answers health checks meanwhile"""
     logger.info("Starting up the application...")
-    await model_manager.initialize()
-    logger.info("Application startup completed")
+    app.state.model_loader = asyncio.create_task(load_model())
+    app.state.session_maintainer = asyncio.create_task(maintain_sessions()) if config.args.session_cache else None
+
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    """Stop background work"""
+    app.state.model_loader.cancel()
+    if getattr(app.state, "model_reloader", None) is not None:
+        app.state.model_reloader.cancel()
+    await batch_runner.stop()
+    if getattr(app.state, "session_maintainer", None) is not None:
+        app.state.session_maintainer.cancel()
+    if model_manager.sessions is not None:
+        # Files of the disk tier are only meaningful to this process
+        model_manager.sessions.clear()
+    if model_manager.tensor_parallel and model_manager.model is not None:
+        # Lets the worker ranks leave the process group
+        model_manager.model.close()
 
 
 @app.get("/v1/models")
 async def list_models() -> ModelListResponse:
     """List available models"""
-    return ModelListResponse(
-        data=[
+    data = [
+        ModelInfo(
+            id=model_manager.model_name,
+            owned_by="transformers-openai-api"
+        )
+    ]
+    if model_manager.embedding_model_name != model_manager.model_name:
+        data.append(
             ModelInfo(
-                id=model_manager.model_name,
+                id=model_manager.embedding_model_name,
                 owned_by="transformers-openai-api"
             )
-        ]
-    )
+        )
+    return ModelListResponse(data=data)
 
 
 @app.post("/v1/chat/completions")
-async def create_chat_completion(request: ChatCompletionRequest):
+async def create_chat_completion(
+    request: ChatCompletionRequest, http_response: Response, x_request_timeout: Optional[str] = Header(None)
+):
     """Create a chat completion"""
-    try:
-        # DEBUG level logging - print incoming request
-        if logger.isEnabledFor(logging.DEBUG):
-            logger.debug("=== Incoming Chat Completion Request ===")
-            logger.debug(f"Request data: {request.model_dump_json(indent=2)}")
-            logger.debug("=" * 45)
-        
-        await request_limiter.acquire()
-        
-        # DEBUG level logging for incoming requests
-        if logger.isEnabledFor(logging.DEBUG):
-            logger.debug(f"Incoming request: {request.model_dump_json()}")
-        
+    timing = RequestTiming()
+    set_deadline(timing, request.timeout, x_request_timeout)
+    n = request.n or 1
+    best_of = request.best_of or n
+    if n < 1 or best_of < n:
+        raise HTTPException(status_code=400, detail="n must be >= 1 and best_of must be >= n")
+    if request.stream and best_of > n:
+        raise HTTPException(status_code=400, detail="best_of is not supported when streaming")
+    if request.top_logprobs and not request.logprobs:
+        raise HTTPException(status_code=400, detail="top_logprobs requires logprobs to be true")
+    logprobs = bool(request.logprobs)
+    top_logprobs = request.top_logprobs or 0
+    guide = request_guide(request)
+    await wait_until_ready(timing)
+    # One manager serves the whole request, a reload meanwhile only affects later requests
+    manager = model_manager.current
+
+    # DEBUG level logging - print incoming request
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("=== Incoming Chat Completion Request ===")
+        logger.debug(f"Request data: {request.model_dump_json(indent=2)}")
+        logger.debug("=" * 45)
+
+    async with limited_generation("chat completion", manager) as hold:
         # Validate model
-        if request.model != model_manager.model_name:
+        if request.model != manager.model_name:
             raise HTTPException(
                 status_code=400, 
-                detail=f"Model {request.model} not found. Available: {model_manager.model_name}"
+                detail=f"Model {request.model} not found. Available: {manager.model_name}"
             )
         
-        # Format prompt
-        prompt = model_manager.format_chat_prompt([msg.model_dump() for msg in request.messages])
-          # Prepare generation parameters
+        # Format prompt, the oldest turns are dropped until it fits the context window with max_tokens
         max_tokens = request.max_tokens or 100
-        temperature = request.temperature or 1.0
+        with timing.phase("templating"):
+            try:
+                prompt = manager.format_chat_prompt(
+                    [msg.model_dump() for msg in request.messages], max_tokens
+                )
+            except ValueError as e:
+                raise HTTPException(status_code=400, detail=str(e))
+        # Prepare generation parameters
+        temperature = request.temperature if request.temperature is not None else 1.0
         top_p = request.top_p or 1.0
+        sampling = sampling_params(request)
+        stop_sequences = stop_list(request.stop)
         
-        stop_sequences = None
-        if request.stop:
-            if isinstance(request.stop, str):
-                stop_sequences = [request.stop]
-            else:
-                stop_sequences = request.stop
+        # Greedy requests can be answered from the response cache
+        cache_key = response_cache_key(
+            "/v1/chat/completions",
+            manager,
+            temperature,
+            prompt=prompt,
+            max_tokens=max_tokens,
+            top_p=top_p,
+            stop=stop_sequences,
+            n=n,
+            best_of=best_of,
+            logprobs=logprobs,
+            top_logprobs=top_logprobs,
+            **sampling,
+            guide=guide,
+            reasoning_parser=config.args.reasoning_parser,
+        )
+        cached = await asyncio.to_thread(response_cache.get, cache_key) if cache_key else None
+        completion_id = f"chatcmpl-{uuid.uuid4().hex}"
         
         if request.stream:
-            # Streaming response
-            async def generate_stream() -> AsyncGenerator[str, None]:
-                try:
-                    completion_id = f"chatcmpl-{uuid.uuid4().hex}"
-                    
-                    async for chunk in model_manager.generate_text_stream(
-                        prompt=prompt,
-                        max_tokens=max_tokens,
-                        temperature=temperature,
-                        top_p=top_p,
-                        stop_sequences=stop_sequences
-                    ):
-                        # Create delta content
-                        delta = {}
-                        if chunk.get("text"):
-                            delta["content"] = chunk["text"]
-                        
-                        # Add reasoning content if available
-                        if chunk.get("reasoning_content"):
-                            delta["reasoning_content"] = chunk["reasoning_content"]
-                        
-                        # Create choice
-                        choice = ChatCompletionStreamChoice(
-                            index=0,
-                            delta=delta,
-                            finish_reason=chunk.get("finish_reason")
-                        )
-                        
-                        # Create stream response with usage info
-                        stream_response = ChatCompletionStreamResponse(
-                            id=completion_id,
-                            model=request.model,
-                            choices=[choice]
-                        )
-                        
-                        # Add usage information if available
-                        if chunk.get("finish_reason"):
-                            stream_response.usage = ChatCompletionUsage(
-                                prompt_tokens=chunk.get("prompt_tokens", 0),
-                                completion_tokens=chunk.get("completion_tokens", 0),
-                                total_tokens=chunk.get("total_tokens", 0),
-                                time_to_first_token=chunk.get("time_to_first_token"),
-                                total_time=chunk.get("total_time"),
-                                tokens_per_second=chunk.get("tokens_per_second")
-                            )
-                        
-                        # Send the chunk
-                        data = stream_response.model_dump_json()
-                        yield f"data: {data}\n\n"
-                        
-                        # Break if finished
-                        if chunk.get("finish_reason"):
-                            break
-                      # Send final done message
-                    yield "data: [DONE]\n\n"
-                
-                except Exception as e:
-                    logger.error(f"Error in streaming generation: {str(e)}")
-                    # Send error in stream format
-                    error_response = {
-                        "error": {
-                            "message": str(e),
-                            "type": "server_error"
-                        }
-                    }
-                    yield f"data: {json.dumps(error_response)}\n\n"
-                    yield "data: [DONE]\n\n"
-                
-                finally:
-                    await request_limiter.release()
-            
-            return StreamingResponse(
-                generate_stream(),
-                media_type="text/event-stream",
-                headers={
-                    "Cache-Control": "no-cache", 
-                    "Connection": "keep-alive",
-                    "Content-Type": "text/event-stream"
-                }
-            )
+            def start(slot: StreamSlot):
+                return manager.generate_text_stream(
+                    prompt=prompt,
+                    max_tokens=max_tokens,
+                    temperature=temperature,
+                    top_p=top_p,
+                    stop_sequences=stop_sequences,
+                    n=n,
+                    logprobs=logprobs,
+                    top_logprobs=top_logprobs,
+                    **sampling,
+                    guide=guide,
+                    timing=timing,
+                    session_id=request.session_id,
+                    slot=slot
+                )
+
+            def render(chunks, last_chunk):
+                choices = []
+                for chunk in chunks:
+                    # Create delta content, with the reasoning content if available
+                    delta = {}
+                    if chunk.get("text"):
+                        delta["content"] = chunk["text"]
+                    if chunk.get("reasoning_content"):
+                        delta["reasoning_content"] = chunk["reasoning_content"]
+                    choices.append(ChatCompletionStreamChoice(
+                        index=chunk.get("index", 0),
+                        delta=delta,
+                        logprobs={"content": chunk["logprobs"]} if chunk.get("logprobs") is not None else None,
+                        finish_reason=chunk.get("finish_reason")
+                    ))
+                # Usage information once every choice has finished
+                return ChatCompletionStreamResponse(
+                    id=completion_id,
+                    model=manager.model_name,
+                    choices=choices,
+                    usage=stream_usage(last_chunk, timing) if last_chunk is not None else None
+                )
+
+            frames = stream_frames(hold, timing, request.stream_options, cached, cache_key, n, start, render)
+            return streaming_response(frames, hold, timing, cached, cache_key)
         
+        # Non-streaming response
+        if cached is not None:
+            result = cached
         else:
-            # Non-streaming response
-            try:
-                result = model_manager.generate_text(
+            async with scheduler.slot(deadline=timing.deadline) as queue_time:
+                timing.add("queue", queue_time)
+                result = await manager.generate_text_async(
                     prompt=prompt,
                     max_tokens=max_tokens,
                     temperature=temperature,
                     top_p=top_p,
-                    stop_sequences=stop_sequences
+                    stop_sequences=stop_sequences,
+                    n=n,
+                    best_of=best_of,
+                    logprobs=logprobs,
+                    top_logprobs=top_logprobs,
+                    **sampling,
+                    guide=guide,
+                    timing=timing,
+                    session_id=request.session_id
                 )
-                
-                completion_id = f"chatcmpl-{uuid.uuid4().hex}"
-                
-                # Create message with reasoning content if available
-                message = ChatMessage(
-                    role="assistant", 
-                    content=result["text"],
-                    reasoning_content=result.get("reasoning_content")
+            if cache_key:
+                await asyncio.to_thread(response_cache.put, cache_key, cache_entry(result))
+        if cache_key:
+            http_response.headers["X-Cache"] = "HIT" if cached is not None else "MISS"
+        
+        serialize_start = time.perf_counter()
+        response = ChatCompletionResponse(
+            id=completion_id,
+            model=manager.model_name,
+            choices=[
+                ChatCompletionChoice(
+                    index=choice["index"],
+                    # Create message with reasoning content if available
+                    message=ChatMessage(
+                        role="assistant", 
+                        content=choice["text"],
+                        reasoning_content=choice.get("reasoning_content")
+                    ),
+                    logprobs={"content": choice["logprobs"]} if choice.get("logprobs") is not None else None,
+                    finish_reason=choice["finish_reason"]
                 )
-                
-                response = ChatCompletionResponse(
-                    id=completion_id,
-                    model=request.model,
-                    choices=[
-                        ChatCompletionChoice(
-                            index=0,
-                            message=message,
-                            finish_reason="stop"
+                for choice in result["choices"]
+            ],                    
+            usage=ChatCompletionUsage(
+                prompt_tokens=result["prompt_tokens"],
+                cached_tokens=result.get("cached_tokens"),
+                completion_tokens=result["completion_tokens"],
+                total_tokens=result["total_tokens"],
+                total_time=result.get("total_time"),
+                tokens_per_second=result.get("tokens_per_second")
+            )                
+        )
+        timing.add("serialization", time.perf_counter() - serialize_start)
+        response.usage.timing = finish_timing(timing)
+        http_response.headers["Server-Timing"] = timing.server_timing()
+        return response
+
+
+@app.post("/v1/completions")
+async def create_completion(
+    request: CompletionRequest, http_response: Response, x_request_timeout: Optional[str] = Header(None)
+):
+    """Create a completion for one prompt or a batch of prompts"""
+    timing = RequestTiming()
+    set_deadline(timing, request.timeout, x_request_timeout)
+    prompts = [request.prompt] if isinstance(request.prompt, str) else request.prompt
+    n = request.n or 1
+    best_of = request.best_of or n
+    if not prompts:
+        raise HTTPException(status_code=400, detail="prompt must not be empty")
+    if request.suffix:
+        raise HTTPException(status_code=400, detail="suffix is not supported")
+    if n < 1 or best_of < n:
+        raise HTTPException(status_code=400, detail="n must be >= 1 and best_of must be >= n")
+    if request.stream and best_of > n:
+        raise HTTPException(status_code=400, detail="best_of is not supported when streaming")
+    logprobs = request.logprobs is not None
+    top_logprobs = request.logprobs or 0
+    guide = request_guide(request)
+    await wait_until_ready(timing)
+    # One manager serves the whole request, a reload meanwhile only affects later requests
+    manager = model_manager.current
+
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug(f"Incoming completion request: {request.model_dump_json()}")
+
+    async with limited_generation("completion", manager) as hold:
+        # Validate model
+        if request.model != manager.model_name:
+            raise HTTPException(
+                status_code=400, 
+                detail=f"Model {request.model} not found. Available: {manager.model_name}"
+            )
+        
+        # Prepare generation parameters
+        max_tokens = request.max_tokens or 16
+        temperature = request.temperature if request.temperature is not None else 1.0
+        top_p = request.top_p or 1.0
+        sampling = sampling_params(request)
+        stop_sequences = stop_list(request.stop)
+        
+        completion_id = f"cmpl-{uuid.uuid4().hex}"
+        num_choices = len(prompts) * n
+        
+        # Greedy requests can be answered from the response cache, echo is applied on top
+        cache_key = response_cache_key(
+            "/v1/completions",
+            manager,
+            temperature,
+            prompt=prompts,
+            max_tokens=max_tokens,
+            top_p=top_p,
+            stop=stop_sequences,
+            n=n,
+            best_of=best_of,
+            logprobs=logprobs,
+            top_logprobs=top_logprobs,
+            **sampling,
+            guide=guide,
+        )
+        cached = await asyncio.to_thread(response_cache.get, cache_key) if cache_key else None
+        
+        if request.stream:
+            # Text offset of the next token per choice, for legacy logprobs
+            text_offsets = [len(prompts[index // n]) if request.echo else 0 for index in range(num_choices)]
+
+            def start(slot: StreamSlot):
+                return manager.generate_text_stream(
+                    prompt=prompts,
+                    max_tokens=max_tokens,
+                    temperature=temperature,
+                    top_p=top_p,
+                    stop_sequences=stop_sequences,
+                    n=n,
+                    parse_reasoning=False,
+                    logprobs=logprobs,
+                    top_logprobs=top_logprobs,
+                    **sampling,
+                    guide=guide,
+                    timing=timing,
+                    slot=slot
+                )
+
+            def render(chunks, last_chunk):
+                choices = []
+                for chunk in chunks:
+                    choice_logprobs = None
+                    if chunk.get("logprobs") is not None:
+                        choice_logprobs = manager.completion_logprobs(
+                            chunk["logprobs"], text_offsets[chunk["index"]]
                         )
-                    ],                    
-                    usage=ChatCompletionUsage(
-                        prompt_tokens=result["prompt_tokens"],
-                        completion_tokens=result["completion_tokens"],
-                        total_tokens=result["total_tokens"],
-                        total_time=result.get("total_time"),
-                        tokens_per_second=result.get("tokens_per_second")
-                    )                
+                        text_offsets[chunk["index"]] += sum(len(entry["token"]) for entry in chunk["logprobs"])
+                    choices.append(CompletionChoice(
+                        index=chunk["index"],
+                        text=chunk.get("text") or "",
+                        logprobs=choice_logprobs,
+                        finish_reason=chunk.get("finish_reason")
+                    ))
+                # Usage information once every choice has finished
+                return CompletionResponse(
+                    id=completion_id,
+                    model=manager.model_name,
+                    choices=choices,
+                    usage=stream_usage(last_chunk, timing, cached_tokens=False) if last_chunk is not None else None
                 )
-                
-                await request_limiter.release()
-                return response
-            
-            except Exception as e:
-                await request_limiter.release()
-                raise
-    
+
+            # Echo the prompts before any generated text
+            echo = [CompletionResponse(
+                id=completion_id,
+                model=manager.model_name,
+                choices=[CompletionChoice(index=index, text=prompts[index // n]) for index in range(num_choices)]
+            )] if request.echo else []
+            frames = stream_frames(hold, timing, request.stream_options, cached, cache_key, num_choices, start, render, echo)
+            return streaming_response(frames, hold, timing, cached, cache_key)
+        
+        if cached is not None:
+            result = cached
+        else:
+            # All prompts are padded and generated as one batch
+            async with scheduler.slot(deadline=timing.deadline) as queue_time:
+                timing.add("queue", queue_time)
+                result = await manager.generate_text_async(
+                    prompt=prompts,
+                    max_tokens=max_tokens,
+                    temperature=temperature,
+                    top_p=top_p,
+                    stop_sequences=stop_sequences,
+                    n=n,
+                    best_of=best_of,
+                    parse_reasoning=False,
+                    logprobs=logprobs,
+                    top_logprobs=top_logprobs,
+                    **sampling,
+                    guide=guide,
+                    timing=timing
+                )
+            if cache_key:
+                await asyncio.to_thread(response_cache.put, cache_key, cache_entry(result))
+        if cache_key:
+            http_response.headers["X-Cache"] = "HIT" if cached is not None else "MISS"
+        
+        serialize_start = time.perf_counter()
+        response = CompletionResponse(
+            id=completion_id,
+            model=manager.model_name,
+            choices=[
+                CompletionChoice(
+                    index=choice["index"],
+                    text=(prompts[choice["index"] // n] if request.echo else "") + choice["text"],
+                    logprobs=manager.completion_logprobs(
+                        choice["logprobs"],
+                        len(prompts[choice["index"] // n]) if request.echo else 0
+                    ) if choice.get("logprobs") is not None else None,
+                    finish_reason=choice["finish_reason"]
+                )
+                for choice in result["choices"]
+            ],
+            usage=ChatCompletionUsage(
+                prompt_tokens=result["prompt_tokens"],
+                completion_tokens=result["completion_tokens"],
+                total_tokens=result["total_tokens"],
+                total_time=result.get("total_time"),
+                tokens_per_second=result.get("tokens_per_second")
+            )
+        )
+        timing.add("serialization", time.perf_counter() - serialize_start)
+        response.usage.timing = finish_timing(timing)
+        http_response.headers["Server-Timing"] = timing.server_timing()
+        return response
+
+
+@app.post("/v1/embeddings")
+async def create_embedding(request: EmbeddingRequest):
+    """Create embeddings, dynamically batched with other concurrent requests"""
+    texts = [request.input] if isinstance(request.input, str) else request.input
+    if not texts:
+        raise HTTPException(status_code=400, detail="input must not be empty")
+    if request.encoding_format not in (None, "float", "base64"):
+        raise HTTPException(status_code=400, detail="encoding_format must be float or base64")
+    if request.model != model_manager.embedding_model_name:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Model {request.model} not found. Available: {model_manager.embedding_model_name}"
+        )
+    await wait_until_ready()
+
+    await request_limiter.acquire()
+    try:
+        results = await embedding_batcher.embed(
+            texts, model_manager.embedding_model_name, config.args.embedding_pooling
+        )
     except Exception as e:
-        await request_limiter.release()
-        logger.error(f"Error in chat completion: {str(e)}")
+        logger.error(f"Error in embeddings: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
+    finally:
+        await request_limiter.release()
+
+    data = []
+    for index, (embedding, _) in enumerate(results):
+        if request.encoding_format == "base64":
+            embedding = base64.b64encode(struct.pack(f"<{len(embedding)}f", *embedding)).decode("ascii")
+        data.append(EmbeddingData(embedding=embedding, index=index))
+
+    prompt_tokens = sum(token_count for _, token_count in results)
+    return EmbeddingResponse(
+        data=data,
+        model=request.model,
+        usage=EmbeddingUsage(prompt_tokens=prompt_tokens, total_tokens=prompt_tokens)
+    )
+
+
+@app.post("/v1/files")
+async def upload_file(file: UploadFile = File(...), purpose: str = Form(...)) -> FileObject:
+    """Upload a JSONL file, streamed to the local batch storage"""
+    file_id = file_store.new_id()
+    with open(file_store.content_path(file_id), "wb") as f:
+        while True:
+            chunk = await file.read(1024 * 1024)
+            if not chunk:
+                break
+            f.write(chunk)
+    return FileObject(**file_store.register(file_id, file.filename or file_id, purpose))
+
+
+@app.get("/v1/files")
+async def list_files(purpose: Optional[str] = None) -> FileListResponse:
+    """List uploaded and generated files"""
+    return FileListResponse(data=[FileObject(**meta) for meta in file_store.list(purpose)])
+
+
+@app.get("/v1/files/{file_id}")
+async def retrieve_file(file_id: str) -> FileObject:
+    """Retrieve file metadata"""
+    meta = file_store.get(file_id)
+    if meta is None:
+        raise HTTPException(status_code=404, detail=f"File {file_id} not found")
+    return FileObject(**meta)
+
+
+@app.get("/v1/files/{file_id}/content")
+async def retrieve_file_content(file_id: str):
+    """Download the content of a file"""
+    if file_store.get(file_id) is None:
+        raise HTTPException(status_code=404, detail=f"File {file_id} not found")
+    return FileResponse(file_store.content_path(file_id), media_type="application/jsonl")
+
+
+@app.delete("/v1/files/{file_id}")
+async def delete_file(file_id: str):
+    """Delete a file"""
+    if not file_store.delete(file_id):
+        raise HTTPException(status_code=404, detail=f"File {file_id} not found")
+    return {"id": file_id, "object": "file", "deleted": True}
+
+
+@app.post("/v1/batches")
+async def create_batch(request: BatchCreateRequest) -> BatchObject:
+    """Create a batch from an uploaded JSONL file of requests"""
+    if request.endpoint not in SUPPORTED_ENDPOINTS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Unsupported endpoint {request.endpoint}. Supported: {', '.join(SUPPORTED_ENDPOINTS)}"
+        )
+    if file_store.get(request.input_file_id) is None:
+        raise HTTPException(status_code=404, detail=f"File {request.input_file_id} not found")
+    batch = batch_runner.create(
+        request.input_file_id, request.endpoint, request.completion_window, request.metadata
+    )
+    return BatchObject(**batch)
+
+
+@app.get("/v1/batches")
+async def list_batches(limit: int = 20, after: Optional[str] = None) -> BatchListResponse:
+    """List batches, most recent first"""
+    batches = batch_runner.list(limit + 1, after)
+    return BatchListResponse(
+        data=[BatchObject(**batch) for batch in batches[:limit]],
+        has_more=len(batches) > limit
+    )
+
+
+@app.get("/v1/batches/{batch_id}")
+async def retrieve_batch(batch_id: str) -> BatchObject:
+    """Retrieve a batch with its progress"""
+    batch = batch_runner.get(batch_id)
+    if batch is None:
+        raise HTTPException(status_code=404, detail=f"Batch {batch_id} not found")
+    return BatchObject(**batch)
+
+
+@app.post("/v1/batches/{batch_id}/cancel")
+async def cancel_batch(batch_id: str) -> BatchObject:
+    """Cancel a batch, requests already completed are kept"""
+    batch = batch_runner.cancel(batch_id)
+    if batch is None:
+        raise HTTPException(status_code=404, detail=f"Batch {batch_id} not found")
+    return BatchObject(**batch)
 
 
 @app.get("/health")
 async def health_check():
-    """Health check endpoint"""
-    return {"status": "healthy", "model": model_manager.model_name}
+    """Health check endpoint, with the model load progress"""
+    status = model_manager.load_status()
+    return JSONResponse(
+        status_code=503 if status["status"] == "failed" else 200,
+        content={
+            "status": "healthy" if status["status"] == "ready" else status["status"],
+            "model": model_manager.model_name,
+            "load": status,
+        },
+    )
+
+
+@app.get("/health/live")
+async def liveness():
+    """Liveness probe: the process serves requests, a failed model load is not recovered from"""
+    status = model_manager.load_status()
+    if status["status"] == "failed":
+        return JSONResponse(status_code=503, content={"status": "failed", "error": status["error"]})
+    return {"status": "alive"}
+
+
+@app.get("/health/ready")
+async def readiness():
+    """Readiness probe: the model is loaded and warmed up, otherwise 503 with the load progress"""
+    status = model_manager.load_status()
+    return JSONResponse(status_code=200 if status["status"] == "ready" else 503, content=status)
+
+
+@app.get("/metrics")
+async def get_metrics():
+    """Engine metrics in the Prometheus text format"""
+    return Response(content=metrics.render(), media_type="text/plain; version=0.0.4")
+
+
+@app.get("/stats/stream")
+async def stats_stream(interval: Optional[float] = None):
+    """Server-sent events with engine counters and process resource usage"""
+    async def events() -> AsyncGenerator[str, None]:
+        async for message in stats_hub.subscribe(interval):
+            yield f"data: {message}\n\n"
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "Connection": "keep-alive"},
+    )
+
+
+def _require_admin(authorization: Optional[str]):
+    """Admin endpoints need --admin-token and do not exist without it"""
+    token = config.args.admin_token
+    if not token:
+        raise HTTPException(status_code=404, detail="Not Found")
+    if not authorization or not hmac.compare_digest(authorization, f"Bearer {token}"):
+        raise HTTPException(status_code=401, detail="Invalid admin token")
+
+
+@app.post("/admin/profile")
+async def trigger_profile(count: int = 1, authorization: Optional[str] = Header(None)):
+    """Write torch.profiler traces of the next `count` generation requests"""
+    _require_admin(authorization)
+    if count < 1:
+        raise HTTPException(status_code=400, detail="count must be >= 1")
+    profiler = model_manager.profiler
+    if profiler is None:
+        raise HTTPException(status_code=503, detail="The model is not loaded yet")
+    return {
+        "pending": profiler.trigger(count),
+        "output_dir": profiler.output_dir,
+        "recent_traces": profiler.recent_traces,
+    }
+
+
+@app.post("/admin/reload", status_code=202)
+async def start_reload(request: ReloadRequest, authorization: Optional[str] = Header(None)):
+    """Load a model or revision next to the current one and switch to it once it is warmed up"""
+    _require_admin(authorization)
+    if not model_manager.ready and model_manager.load_error is None:
+        raise HTTPException(status_code=409, detail="The model is still loading")
+    if model_manager.reloading:
+        raise HTTPException(status_code=409, detail="A reload is already in progress")
+    if model_manager.tensor_parallel:
+        raise HTTPException(status_code=409, detail="Reloading is not supported with tensor parallelism")
+    app.state.model_reloader = asyncio.create_task(
+        reload_model(request.model or model_manager.model_name, request.revision)
+    )
+    # Let the task register the candidate, so the status shows it loading
+    await asyncio.sleep(0)
+    return model_manager.reload_status()
+
+
+@app.get("/admin/reload")
+async def reload_status(authorization: Optional[str] = Header(None)):
+    """Progress of the latest reload"""
+    _require_admin(authorization)
+    return model_manager.reload_status()
 
 
 @app.get("/")
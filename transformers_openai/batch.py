@@ -0,0 +1,496 @@
+import asyncio
+import json
+import logging
+import os
+import time
+import uuid
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+from transformers_openai.models import (
+    ChatCompletionChoice,
+    ChatCompletionRequest,
+    ChatCompletionResponse,
+    ChatCompletionUsage,
+    ChatMessage,
+    CompletionChoice,
+    CompletionRequest,
+    CompletionResponse,
+)
+from transformers_openai.guided import guide_pattern
+from transformers_openai.scheduler import PRIORITY_BATCH
+
+
+logger = logging.getLogger(__name__)
+
+SUPPORTED_ENDPOINTS = ("/v1/chat/completions", "/v1/completions")
+
+# Batches in these states still have work left, also after a restart
+ACTIVE_STATUSES = ("validating", "in_progress", "finalizing", "cancelling")
+
+
+def _write_json(path: str, data: Dict[str, Any]):
+    """Atomically replace a JSON file"""
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(data, f)
+    os.replace(tmp_path, path)
+
+
+def _completed_ids(path: str) -> Set[str]:
+    """custom_ids already written to a result file, dropping a torn last line"""
+    if not os.path.exists(path):
+        return set()
+    with open(path, "rb") as f:
+        content = f.read()
+    if content and not content.endswith(b"\n"):
+        content = content[: content.rfind(b"\n") + 1]
+        with open(path, "wb") as f:
+            f.write(content)
+    return {json.loads(line)["custom_id"] for line in content.splitlines() if line.strip()}
+
+
+class FileStore:
+    """Stores uploaded and generated JSONL files on the local disk"""
+
+    def __init__(self, root: str):
+        self.root = os.path.join(root, "files")
+        os.makedirs(self.root, exist_ok=True)
+
+    @staticmethod
+    def new_id() -> str:
+        return f"file-{uuid.uuid4().hex}"
+
+    def content_path(self, file_id: str) -> str:
+        return os.path.join(self.root, f"{file_id}.jsonl")
+
+    def _meta_path(self, file_id: str) -> str:
+        return os.path.join(self.root, f"{file_id}.json")
+
+    def register(self, file_id: str, filename: str, purpose: str) -> Dict[str, Any]:
+        """Record the metadata of a file whose content has been written"""
+        meta = {
+            "id": file_id,
+            "object": "file",
+            "bytes": os.path.getsize(self.content_path(file_id)),
+            "created_at": int(time.time()),
+            "filename": filename,
+            "purpose": purpose,
+        }
+        _write_json(self._meta_path(file_id), meta)
+        return meta
+
+    def get(self, file_id: str) -> Optional[Dict[str, Any]]:
+        path = self._meta_path(file_id)
+        if os.path.sep in file_id or not os.path.exists(path):
+            return None
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)
+
+    def list(self, purpose: Optional[str] = None) -> List[Dict[str, Any]]:
+        files = []
+        for name in os.listdir(self.root):
+            if name.endswith(".json"):
+                meta = self.get(name[: -len(".json")])
+                if meta and (purpose is None or meta["purpose"] == purpose):
+                    files.append(meta)
+        return sorted(files, key=lambda meta: meta["created_at"])
+
+    def delete(self, file_id: str) -> bool:
+        if self.get(file_id) is None:
+            return False
+        for path in (self.content_path(file_id), self._meta_path(file_id)):
+            if os.path.exists(path):
+                os.remove(path)
+        return True
+
+
+class BatchRunner:
+    """Runs OpenAI style batches over local JSONL files in the background.
+
+    Requests are sorted by length and grouped by sampling parameters into
+    large generate() batches, and every group waits for a low priority
+    scheduler slot so interactive traffic goes first. Results are appended
+    to the output file group by group and the batch state is saved after
+    each group, so an interrupted batch resumes with the requests whose
+    custom_id has no result yet.
+    """
+
+    def __init__(
+        self,
+        root: str,
+        files: FileStore,
+        scheduler,
+        model_manager,
+        batch_size: int = 32,
+        guided_json_depth: int = 3,
+    ):
+        self.root = os.path.join(root, "batches")
+        os.makedirs(self.root, exist_ok=True)
+        self.files = files
+        self.scheduler = scheduler
+        self.model_manager = model_manager
+        self.batch_size = max(1, batch_size)
+        self.guided_json_depth = guided_json_depth
+        self.batches: Dict[str, Dict[str, Any]] = {}
+        self.wakeup: Optional[asyncio.Event] = None
+        self.task: Optional[asyncio.Task] = None
+
+        for name in os.listdir(self.root):
+            if name.endswith(".json"):
+                with open(os.path.join(self.root, name), encoding="utf-8") as f:
+                    batch = json.load(f)
+                self.batches[batch["id"]] = batch
+
+    def _save(self, batch: Dict[str, Any]):
+        _write_json(os.path.join(self.root, f"{batch['id']}.json"), batch)
+
+    def create(
+        self,
+        input_file_id: str,
+        endpoint: str,
+        completion_window: str = "24h",
+        metadata: Optional[Dict[str, str]] = None,
+    ) -> Dict[str, Any]:
+        batch = {
+            "id": f"batch_{uuid.uuid4().hex}",
+            "object": "batch",
+            "endpoint": endpoint,
+            "errors": None,
+            "input_file_id": input_file_id,
+            "completion_window": completion_window,
+            "status": "validating",
+            "output_file_id": FileStore.new_id(),
+            "error_file_id": FileStore.new_id(),
+            "created_at": int(time.time()),
+            "in_progress_at": None,
+            "finalizing_at": None,
+            "completed_at": None,
+            "failed_at": None,
+            "cancelling_at": None,
+            "cancelled_at": None,
+            "request_counts": {"total": 0, "completed": 0, "failed": 0},
+            "metadata": metadata,
+        }
+        self.batches[batch["id"]] = batch
+        self._save(batch)
+        if self.wakeup is not None:
+            self.wakeup.set()
+        return batch
+
+    def get(self, batch_id: str) -> Optional[Dict[str, Any]]:
+        return self.batches.get(batch_id)
+
+    def list(self, limit: int = 20, after: Optional[str] = None) -> List[Dict[str, Any]]:
+        batches = sorted(self.batches.values(), key=lambda b: b["created_at"], reverse=True)
+        if after is not None:
+            ids = [batch["id"] for batch in batches]
+            batches = batches[ids.index(after) + 1:] if after in ids else []
+        return batches[:limit]
+
+    def cancel(self, batch_id: str) -> Optional[Dict[str, Any]]:
+        batch = self.batches.get(batch_id)
+        if batch is None:
+            return None
+        if batch["status"] in ("validating", "in_progress"):
+            batch["status"] = "cancelling"
+            batch["cancelling_at"] = int(time.time())
+            self._save(batch)
+            if self.wakeup is not None:
+                self.wakeup.set()
+        return batch
+
+    def start(self):
+        self.wakeup = asyncio.Event()
+        self.task = asyncio.create_task(self._worker())
+
+    async def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            await asyncio.gather(self.task, return_exceptions=True)
+            self.task = None
+
+    async def _worker(self):
+        while True:
+            active = [b for b in self.batches.values() if b["status"] in ACTIVE_STATUSES]
+            if not active:
+                self.wakeup.clear()
+                await self.wakeup.wait()
+                continue
+
+            batch = min(active, key=lambda b: b["created_at"])
+            try:
+                await self._process(batch)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Batch {batch['id']} failed: {e}")
+                batch["status"] = "failed"
+                batch["failed_at"] = int(time.time())
+                batch["errors"] = {"object": "list", "data": [{"code": "batch_failed", "message": str(e)}]}
+                self._save(batch)
+
+    def _load_requests(
+        self, batch: Dict[str, Any], done: Set[str]
+    ) -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]], int]:
+        """Parse the input file into runnable requests and per-line errors"""
+        requests, errors, total = [], [], 0
+        with open(self.files.content_path(batch["input_file_id"]), encoding="utf-8") as f:
+            for line_number, line in enumerate(f, start=1):
+                if not line.strip():
+                    continue
+                total += 1
+                try:
+                    entry = json.loads(line)
+                    custom_id = entry.get("custom_id") or f"line-{line_number}"
+                except ValueError:
+                    entry, custom_id = None, f"line-{line_number}"
+                if custom_id in done:
+                    continue
+
+                try:
+                    if entry is None:
+                        raise ValueError("line is not valid JSON")
+                    if not entry.get("custom_id"):
+                        raise ValueError("custom_id is required")
+                    if entry.get("url") != batch["endpoint"]:
+                        raise ValueError(f"url must be {batch['endpoint']}")
+
+                    if batch["endpoint"] == "/v1/chat/completions":
+                        request = ChatCompletionRequest(**entry.get("body", {}))
+                        prompts = [self.model_manager.format_chat_prompt(
+                            [msg.model_dump() for msg in request.messages], request.max_tokens or 100
+                        )]
+                    else:
+                        request = CompletionRequest(**entry.get("body", {}))
+                        prompts = [request.prompt] if isinstance(request.prompt, str) else request.prompt
+
+                    if request.model != self.model_manager.model_name:
+                        raise ValueError(f"Model {request.model} not found")
+                    n = request.n or 1
+                    if not prompts or n < 1 or (request.best_of or n) < n:
+                        raise ValueError("prompt must not be empty and best_of must be >= n >= 1")
+                    guide = guide_pattern(
+                        request.response_format.model_dump() if request.response_format else None,
+                        request.guided_regex,
+                        self.guided_json_depth,
+                    )
+                except Exception as e:
+                    errors.append(self._error_line(custom_id, str(e)))
+                    continue
+
+                requests.append({
+                    "custom_id": custom_id,
+                    "request": request,
+                    "prompts": prompts,
+                    "guide": guide,
+                    "length": sum(len(prompt) for prompt in prompts),
+                })
+        return requests, errors, total
+
+    def _plan(self, requests: List[Dict[str, Any]]) -> List[List[Dict[str, Any]]]:
+        """Group requests with identical decoding parameters, shortest first, into large batches.
+
+        Temperature, top-p, top-k, penalties and seeds are applied per row, so
+        they do not split groups.
+        """
+        def params(item):
+            request = item["request"]
+            stop = request.stop if isinstance(request.stop, list) else [request.stop] if request.stop else []
+            # Normalized as in _run_group, the raw values may be None and would not sort against numbers
+            if hasattr(request, "top_logprobs"):
+                logprobs = (bool(request.logprobs), request.top_logprobs or 0)
+            else:
+                logprobs = (request.logprobs is not None, request.logprobs or 0)
+            return (
+                request.max_tokens or 0,
+                request.n or 1,
+                request.best_of or request.n or 1,
+                tuple(stop),
+                *logprobs,
+            )
+
+        groups, current, current_size, current_params = [], [], 0, None
+        for item in sorted(requests, key=lambda item: (params(item), item["length"])):
+            if current and (params(item) != current_params or current_size >= self.batch_size):
+                groups.append(current)
+                current, current_size = [], 0
+            current.append(item)
+            current_size += len(item["prompts"])
+            current_params = params(item)
+        if current:
+            groups.append(current)
+        return groups
+
+    @staticmethod
+    def _error_line(custom_id: str, message: str) -> Dict[str, Any]:
+        return {
+            "id": f"batch_req_{uuid.uuid4().hex}",
+            "custom_id": custom_id,
+            "response": None,
+            "error": {"code": "invalid_request", "message": message},
+        }
+
+    def _run_group(self, endpoint: str, group: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Generate one group as a single batch and build its output lines"""
+        request = group[0]["request"]
+        n = request.n or 1
+        chat = endpoint == "/v1/chat/completions"
+        stop_sequences = None
+        if request.stop:
+            stop_sequences = [request.stop] if isinstance(request.stop, str) else request.stop
+        if chat:
+            logprobs, top_logprobs = bool(request.logprobs), request.top_logprobs or 0
+        else:
+            logprobs, top_logprobs = request.logprobs is not None, request.logprobs or 0
+
+        def per_prompt(value):
+            return [value(item["request"]) for item in group for _ in item["prompts"]]
+
+        result = self.model_manager.generate_text(
+            prompt=[prompt for item in group for prompt in item["prompts"]],
+            max_tokens=request.max_tokens or (100 if chat else 16),
+            temperature=per_prompt(lambda r: r.temperature if r.temperature is not None else 1.0),
+            top_p=per_prompt(lambda r: r.top_p or 1.0),
+            top_k=per_prompt(lambda r: r.top_k or 0),
+            frequency_penalty=per_prompt(lambda r: r.frequency_penalty or 0.0),
+            presence_penalty=per_prompt(lambda r: r.presence_penalty or 0.0),
+            seed=per_prompt(lambda r: r.seed),
+            guide=[item["guide"] for item in group for _ in item["prompts"]],
+            stop_sequences=stop_sequences,
+            n=n,
+            best_of=request.best_of or n,
+            parse_reasoning=chat,
+            logprobs=logprobs,
+            top_logprobs=top_logprobs,
+        )
+
+        lines, offset = [], 0
+        for item in group:
+            count = len(item["prompts"])
+            choices = result["choices"][offset * n:(offset + count) * n]
+            prompt_tokens = sum(result["prompt_token_counts"][offset:offset + count])
+            completion_tokens = sum(choice["completion_tokens"] for choice in choices)
+            usage = ChatCompletionUsage(
+                prompt_tokens=prompt_tokens,
+                completion_tokens=completion_tokens,
+                total_tokens=prompt_tokens + completion_tokens,
+            )
+
+            if chat:
+                body = ChatCompletionResponse(
+                    id=f"chatcmpl-{uuid.uuid4().hex}",
+                    model=item["request"].model,
+                    choices=[
+                        ChatCompletionChoice(
+                            index=index,
+                            message=ChatMessage(
+                                role="assistant",
+                                content=choice["text"],
+                                reasoning_content=choice.get("reasoning_content"),
+                            ),
+                            logprobs={"content": choice["logprobs"]} if choice.get("logprobs") is not None else None,
+                            finish_reason=choice["finish_reason"],
+                        )
+                        for index, choice in enumerate(choices)
+                    ],
+                    usage=usage,
+                )
+            else:
+                body = CompletionResponse(
+                    id=f"cmpl-{uuid.uuid4().hex}",
+                    model=item["request"].model,
+                    choices=[
+                        CompletionChoice(
+                            index=index,
+                            text=(item["prompts"][index // n] if item["request"].echo else "") + choice["text"],
+                            logprobs=self.model_manager.completion_logprobs(
+                                choice["logprobs"],
+                                len(item["prompts"][index // n]) if item["request"].echo else 0,
+                            ) if choice.get("logprobs") is not None else None,
+                            finish_reason=choice["finish_reason"],
+                        )
+                        for index, choice in enumerate(choices)
+                    ],
+                    usage=usage,
+                )
+
+            lines.append({
+                "id": f"batch_req_{uuid.uuid4().hex}",
+                "custom_id": item["custom_id"],
+                "response": {
+                    "status_code": 200,
+                    "request_id": body.id,
+                    "body": body.model_dump(),
+                },
+                "error": None,
+            })
+            offset += count
+        return lines
+
+    @staticmethod
+    def _append(path: str, lines: List[Dict[str, Any]]):
+        if not lines:
+            return
+        with open(path, "a", encoding="utf-8") as f:
+            f.write("".join(json.dumps(line) + "\n" for line in lines))
+            f.flush()
+            os.fsync(f.fileno())
+
+    async def _process(self, batch: Dict[str, Any]):
+        output_path = self.files.content_path(batch["output_file_id"])
+        error_path = self.files.content_path(batch["error_file_id"])
+
+        if batch["status"] in ("validating", "in_progress"):
+            done = _completed_ids(output_path) | _completed_ids(error_path)
+            requests, errors, total = await asyncio.to_thread(self._load_requests, batch, done)
+            self._append(error_path, errors)
+
+            batch["request_counts"] = {
+                "total": total,
+                "completed": len(_completed_ids(output_path)),
+                "failed": len(_completed_ids(error_path)),
+            }
+            if batch["status"] == "validating":
+                batch["status"] = "in_progress"
+                batch["in_progress_at"] = int(time.time())
+            self._save(batch)
+
+            for group in self._plan(requests):
+                if batch["status"] != "in_progress":
+                    break
+
+                # Offline work only gets slots interactive requests leave idle
+                async with self.scheduler.slot(PRIORITY_BATCH):
+                    try:
+                        lines = await asyncio.to_thread(self._run_group, batch["endpoint"], group)
+                    except Exception as e:
+                        logger.error(f"Batch {batch['id']} group failed: {e}")
+                        lines = None
+
+                if lines is None:
+                    failed = [self._error_line(item["custom_id"], "generation failed") for item in group]
+                    self._append(error_path, failed)
+                    batch["request_counts"]["failed"] += len(failed)
+                else:
+                    self._append(output_path, lines)
+                    batch["request_counts"]["completed"] += len(lines)
+                self._save(batch)
+
+            if batch["status"] == "in_progress":
+                batch["status"] = "finalizing"
+                batch["finalizing_at"] = int(time.time())
+                self._save(batch)
+
+        # Register whatever results exist as files
+        for file_id, path in ((batch["output_file_id"], output_path), (batch["error_file_id"], error_path)):
+            if not os.path.exists(path):
+                open(path, "a").close()
+            self.files.register(file_id, os.path.basename(path), "batch_output")
+
+        if batch["status"] == "cancelling":
+            batch["status"] = "cancelled"
+            batch["cancelled_at"] = int(time.time())
+        else:
+            batch["status"] = "completed"
+            batch["completed_at"] = int(time.time())
+        self._save(batch)
@@ -1,12 +1,37 @@
 import argparse
 import os
+from typing import List, Optional
 
 
 class Config:
+    """Server settings from the command line and the environment.
+
+    Nothing is parsed on import: the entry point calls `parse()` with its
+    command line before the app is imported. Until then `args` holds the
+    defaults and environment variables, so the package can be imported under
+    any other CLI (uvicorn, pytest, the monitor) without reading its argv.
+    """
+
     def __init__(self):
-        self.parser = argparse.ArgumentParser(description="Configuration parser")
-        self._add_arguments()
-        self.args = self.parser.parse_args()
+        self.parser: Optional[argparse.ArgumentParser] = None
+        self._args: Optional[argparse.Namespace] = None
+
+    def _build_parser(self) -> argparse.ArgumentParser:
+        if self.parser is None:
+            self.parser = argparse.ArgumentParser(description="Configuration parser")
+            self._add_arguments()
+        return self.parser
+
+    def parse(self, argv: Optional[List[str]] = None) -> argparse.Namespace:
+        """Parse the command line, sys.argv[1:] by default"""
+        self._args = self._build_parser().parse_args(argv)
+        return self._args
+
+    @property
+    def args(self) -> argparse.Namespace:
+        if self._args is None:
+            self._args = self._build_parser().parse_args([])
+        return self._args
     
     def _add_arguments(self):
         self.parser.add_argument(
@@ -107,23 +132,141 @@ class Config:
             default=int(os.getenv("STATIC_CACHE_DECODER_MAX_LENGTH", 256)),
             help="Maximum concurrent requests (default: 256, env: STATIC_CACHE_DECODER_MAX_LENGTH)"
         )
+        self.parser.add_argument(
+            "--kv-cache-key-quant", 
+            type=str, 
+            choices=["none", "int8", "fp8"],
+            default=os.getenv("KV_CACHE_KEY_QUANT", "none"),
+            help="Store cached keys quantized, fp8 is emulated with float8_e4m3fn storage (default: none, env: KV_CACHE_KEY_QUANT)"
+        )
+        self.parser.add_argument(
+            "--kv-cache-value-quant", 
+            type=str, 
+            choices=["none", "int8", "fp8"],
+            default=os.getenv("KV_CACHE_VALUE_QUANT", "none"),
+            help="Store cached values quantized (default: none, env: KV_CACHE_VALUE_QUANT)"
+        )
+        self.parser.add_argument(
+            "--kv-cache-key-scale", 
+            type=str, 
+            choices=["channel", "token"],
+            default=os.getenv("KV_CACHE_KEY_SCALE", "channel"),
+            help="Quantization scales of keys per head and channel or per head and token (default: channel, env: KV_CACHE_KEY_SCALE)"
+        )
+        self.parser.add_argument(
+            "--kv-cache-value-scale", 
+            type=str, 
+            choices=["channel", "token"],
+            default=os.getenv("KV_CACHE_VALUE_SCALE", "token"),
+            help="Quantization scales of values per head and channel or per head and token (default: token, env: KV_CACHE_VALUE_SCALE)"
+        )
+        self.parser.add_argument(
+            "--kv-cache-residual-length", 
+            type=int, 
+            default=int(os.getenv("KV_CACHE_RESIDUAL_LENGTH", 128)),
+            help="Newest tokens kept in full precision, they are quantized together once there are this many (default: 128, env: KV_CACHE_RESIDUAL_LENGTH)"
+        )
+        self.parser.add_argument(
+            "--attention-window", 
+            type=int, 
+            default=int(os.getenv("ATTENTION_WINDOW", 0)),
+            help="Keep only the sink tokens and the last this many tokens in the KV cache, so prompts are no longer truncated and memory stays bounded; 0 keeps the whole context (default: 0, env: ATTENTION_WINDOW)"
+        )
+        self.parser.add_argument(
+            "--attention-sink-tokens", 
+            type=int, 
+            default=int(os.getenv("ATTENTION_SINK_TOKENS", 4)),
+            help="First tokens of every sequence kept next to the attention window (default: 4, env: ATTENTION_SINK_TOKENS)"
+        )
+        self.parser.add_argument(
+            "--attention-window-models", 
+            type=str, 
+            default=os.getenv("ATTENTION_WINDOW_MODELS", ""),
+            help="Per model attention windows overriding the two settings above, comma separated model=window or model=window:sink_tokens (default: none, env: ATTENTION_WINDOW_MODELS)"
+        )
+        self.parser.add_argument(
+            "--max-context-tokens", 
+            type=int, 
+            default=int(os.getenv("MAX_CONTEXT_TOKENS", 0)),
+            help="Context window chat prompts plus max_tokens must fit in, the oldest turns are dropped to make room; 0 uses the model's maximum position embeddings (default: 0, env: MAX_CONTEXT_TOKENS)"
+        )
         self.parser.add_argument(
             "--accelerator-type", 
             type=str, 
             default=os.getenv("ACCELERATOR_TYPE", "cuda"),
             help="Accelerator type (default: cuda, env: ACCELERATOR_TYPE)"
         )
+        self.parser.add_argument(
+            "--tensor-parallel-size", 
+            type=int, 
+            default=int(os.getenv("TENSOR_PARALLEL_SIZE", 1)),
+            help="Shard the attention and MLP weights over this many local CPU processes, this one serving HTTP as rank 0 (default: 1, env: TENSOR_PARALLEL_SIZE)"
+        )
+        self.parser.add_argument(
+            "--request-timeout", 
+            type=float, 
+            default=float(os.getenv("REQUEST_TIMEOUT", 0)),
+            help="Seconds after arrival a generation request is dropped from the queue or aborted, unless the request sets its own timeout; 0 for no deadline (default: 0, env: REQUEST_TIMEOUT)"
+        )
         self.parser.add_argument(
             "--max-concurrent", 
             type=int, 
             default=int(os.getenv("MAX_CONCURRENT", 100)),
             help="Maximum concurrent requests (default: 100, env: MAX_CONCURRENT)"
         )
+        self.parser.add_argument(
+            "--ready-timeout", 
+            type=float, 
+            default=float(os.getenv("READY_TIMEOUT", 60.0)),
+            help="Seconds a request that arrives while the model is loading waits for it before a 503 (default: 60, env: READY_TIMEOUT)"
+        )
+        self.parser.add_argument(
+            "--warmup-tokens", 
+            type=int, 
+            default=int(os.getenv("WARMUP_TOKENS", 8)),
+            help="Tokens generated to warm the model up before it is reported ready, 0 to skip the warmup (default: 8, env: WARMUP_TOKENS)"
+        )
+        self.parser.add_argument(
+            "--drain-timeout", 
+            type=float, 
+            default=float(os.getenv("DRAIN_TIMEOUT", 600.0)),
+            help="Seconds a reload waits for generations on the previous model before freeing it (default: 600, env: DRAIN_TIMEOUT)"
+        )
         self.parser.add_argument(
             "--torch-profiling", 
             type=bool, 
             default=os.getenv("TORCH_PROFILING", "False").lower() == "true",
-            help="Use torch.autograd.profiler.profile() to profile prefill and step (default: False, env: TORCH_PROFILING)"
+            help="Write torch.profiler traces of sampled requests, see --torch-profiling-every (default: False, env: TORCH_PROFILING)"
+        )
+        self.parser.add_argument(
+            "--torch-profiling-every", 
+            type=int, 
+            default=int(os.getenv("TORCH_PROFILING_EVERY", 100)),
+            help="With --torch-profiling, profile one in this many requests, 0 only profiles requests triggered through POST /admin/profile (default: 100, env: TORCH_PROFILING_EVERY)"
+        )
+        self.parser.add_argument(
+            "--torch-profiling-dir", 
+            type=str, 
+            default=os.getenv("TORCH_PROFILING_DIR", "profiles"),
+            help="Directory for the Chrome/Perfetto trace files (default: profiles, env: TORCH_PROFILING_DIR)"
+        )
+        self.parser.add_argument(
+            "--torch-profiling-warmup", 
+            type=int, 
+            default=int(os.getenv("TORCH_PROFILING_WARMUP", 1)),
+            help="Profiler warmup steps before recording starts (default: 1, env: TORCH_PROFILING_WARMUP)"
+        )
+        self.parser.add_argument(
+            "--torch-profiling-active", 
+            type=int, 
+            default=int(os.getenv("TORCH_PROFILING_ACTIVE", 32)),
+            help="Steps recorded per profiled request, the prefill and the first decode steps (default: 32, env: TORCH_PROFILING_ACTIVE)"
+        )
+        self.parser.add_argument(
+            "--admin-token", 
+            type=str, 
+            default=os.getenv("ADMIN_TOKEN", ""),
+            help="Bearer token for the /admin endpoints, which are disabled without it (default: disabled, env: ADMIN_TOKEN)"
         )
         self.parser.add_argument(
             "--hqq", 
@@ -150,6 +293,169 @@ class Config:
             default=os.getenv("REASONING_PARSER", "none"),
             help="Reasoning parser type to extract thinking content (default: none, env: REASONING_PARSER)"
         )
+        self.parser.add_argument(
+            "--stream-coalesce-ms", 
+            type=float, 
+            default=float(os.getenv("STREAM_COALESCE_MS", 0)),
+            help="Hold streamed deltas up to this many milliseconds before flushing them as one SSE frame, 0 to disable (default: 0, env: STREAM_COALESCE_MS)"
+        )
+        self.parser.add_argument(
+            "--stream-coalesce-tokens", 
+            type=int, 
+            default=int(os.getenv("STREAM_COALESCE_TOKENS", 0)),
+            help="Flush streamed deltas once this many are buffered, 0 or 1 for no count bound (default: 0, env: STREAM_COALESCE_TOKENS)"
+        )
+        self.parser.add_argument(
+            "--stream-buffer-tokens", 
+            type=int, 
+            default=int(os.getenv("STREAM_BUFFER_TOKENS", 64)),
+            help="Decoding steps a stream buffers for a slow client before its generation pauses and gives up its slot, 0 for an unbounded buffer (default: 64, env: STREAM_BUFFER_TOKENS)"
+        )
+        self.parser.add_argument(
+            "--stream-stall-timeout", 
+            type=float, 
+            default=float(os.getenv("STREAM_STALL_TIMEOUT", 30)),
+            help="Seconds a paused stream waits for its client to read before the generation is aborted, 0 to wait as long as the connection lasts (default: 30, env: STREAM_STALL_TIMEOUT)"
+        )
+        self.parser.add_argument(
+            "--embedding-model", 
+            type=str, 
+            default=os.getenv("EMBEDDING_MODEL", ""),
+            help="Hugging Face model used for /v1/embeddings, empty to pool the hidden states of --hf-model (default: empty, env: EMBEDDING_MODEL)"
+        )
+        self.parser.add_argument(
+            "--embedding-pooling", 
+            type=str, 
+            choices=["mean", "last"],
+            default=os.getenv("EMBEDDING_POOLING", "mean"),
+            help="Pooling of the hidden states into an embedding (default: mean, env: EMBEDDING_POOLING)"
+        )
+        self.parser.add_argument(
+            "--embedding-batch-size", 
+            type=int, 
+            default=int(os.getenv("EMBEDDING_BATCH_SIZE", 32)),
+            help="Maximum number of inputs embedded in one forward pass (default: 32, env: EMBEDDING_BATCH_SIZE)"
+        )
+        self.parser.add_argument(
+            "--embedding-batch-window-ms", 
+            type=float, 
+            default=float(os.getenv("EMBEDDING_BATCH_WINDOW_MS", 5)),
+            help="How long to collect concurrent embedding inputs into one batch (default: 5, env: EMBEDDING_BATCH_WINDOW_MS)"
+        )
+        self.parser.add_argument(
+            "--embedding-cache-size", 
+            type=int, 
+            default=int(os.getenv("EMBEDDING_CACHE_SIZE", 10000)),
+            help="Number of embeddings kept in the LRU cache, 0 to disable (default: 10000, env: EMBEDDING_CACHE_SIZE)"
+        )
+        self.parser.add_argument(
+            "--batch-storage-dir", 
+            type=str, 
+            default=os.getenv("BATCH_STORAGE_DIR", "./batch_data"),
+            help="Directory for /v1/files uploads and /v1/batches state and results (default: ./batch_data, env: BATCH_STORAGE_DIR)"
+        )
+        self.parser.add_argument(
+            "--batch-api-batch-size", 
+            type=int, 
+            default=int(os.getenv("BATCH_API_BATCH_SIZE", 32)),
+            help="Number of prompts generated together when running /v1/batches (default: 32, env: BATCH_API_BATCH_SIZE)"
+        )
+        self.parser.add_argument(
+            "--response-cache", 
+            type=bool, 
+            default=os.getenv("RESPONSE_CACHE", "False").lower() == "true",
+            help="Cache responses to greedy (temperature 0) requests (default: False, env: RESPONSE_CACHE)"
+        )
+        self.parser.add_argument(
+            "--response-cache-entries", 
+            type=int, 
+            default=int(os.getenv("RESPONSE_CACHE_ENTRIES", 1024)),
+            help="Number of cached responses kept in memory (default: 1024, env: RESPONSE_CACHE_ENTRIES)"
+        )
+        self.parser.add_argument(
+            "--response-cache-path", 
+            type=str, 
+            default=os.getenv("RESPONSE_CACHE_PATH", ""),
+            help="SQLite file backing the response cache, empty keeps it in memory only (default: '', env: RESPONSE_CACHE_PATH)"
+        )
+        self.parser.add_argument(
+            "--response-cache-ttl", 
+            type=float, 
+            default=float(os.getenv("RESPONSE_CACHE_TTL", 3600)),
+            help="Seconds before a cached response expires, 0 to never expire (default: 3600, env: RESPONSE_CACHE_TTL)"
+        )
+        self.parser.add_argument(
+            "--response-cache-max-mb", 
+            type=int, 
+            default=int(os.getenv("RESPONSE_CACHE_MAX_MB", 1024)),
+            help="Maximum size of the on-disk response cache in MB (default: 1024, env: RESPONSE_CACHE_MAX_MB)"
+        )
+        self.parser.add_argument(
+            "--session-cache", 
+            type=bool, 
+            default=os.getenv("SESSION_CACHE", "False").lower() == "true",
+            help="Keep the KV cache of chat requests that carry a session_id for the next turn of the conversation (default: False, env: SESSION_CACHE)"
+        )
+        self.parser.add_argument(
+            "--session-device-mb", 
+            type=int, 
+            default=int(os.getenv("SESSION_DEVICE_MB", 1024)),
+            help="Device memory for session KV caches in MB (default: 1024, env: SESSION_DEVICE_MB)"
+        )
+        self.parser.add_argument(
+            "--session-host-mb", 
+            type=int, 
+            default=int(os.getenv("SESSION_HOST_MB", 4096)),
+            help="Host memory for session KV caches demoted from the device in MB (default: 4096, env: SESSION_HOST_MB)"
+        )
+        self.parser.add_argument(
+            "--session-disk-dir", 
+            type=str, 
+            default=os.getenv("SESSION_DISK_DIR", ""),
+            help="Directory for session KV caches demoted from host memory, empty for no disk tier (default: '', env: SESSION_DISK_DIR)"
+        )
+        self.parser.add_argument(
+            "--session-disk-mb", 
+            type=int, 
+            default=int(os.getenv("SESSION_DISK_MB", 16384)),
+            help="Disk space for session KV caches in MB (default: 16384, env: SESSION_DISK_MB)"
+        )
+        self.parser.add_argument(
+            "--session-host-after", 
+            type=float, 
+            default=float(os.getenv("SESSION_HOST_AFTER", 30)),
+            help="Seconds a session is idle before its KV cache moves from the device to host memory (default: 30, env: SESSION_HOST_AFTER)"
+        )
+        self.parser.add_argument(
+            "--session-disk-after", 
+            type=float, 
+            default=float(os.getenv("SESSION_DISK_AFTER", 300)),
+            help="Seconds a session is idle before its KV cache moves from host memory to disk (default: 300, env: SESSION_DISK_AFTER)"
+        )
+        self.parser.add_argument(
+            "--session-ttl", 
+            type=float, 
+            default=float(os.getenv("SESSION_TTL", 3600)),
+            help="Seconds a session is idle before its KV cache is dropped, 0 to keep it until the budgets run out (default: 3600, env: SESSION_TTL)"
+        )
+        self.parser.add_argument(
+            "--guided-cache-size", 
+            type=int, 
+            default=int(os.getenv("GUIDED_CACHE_SIZE", 32)),
+            help="Number of compiled guided decoding indices kept in memory (default: 32, env: GUIDED_CACHE_SIZE)"
+        )
+        self.parser.add_argument(
+            "--guided-json-depth", 
+            type=int, 
+            default=int(os.getenv("GUIDED_JSON_DEPTH", 3)),
+            help="Maximum nesting depth of free-form JSON under guided decoding (default: 3, env: GUIDED_JSON_DEPTH)"
+        )
+        self.parser.add_argument(
+            "--stats-interval", 
+            type=float, 
+            default=float(os.getenv("STATS_INTERVAL", 1.0)),
+            help="Seconds between snapshots pushed on /stats/stream, the fastest rate clients can ask for (default: 1.0, env: STATS_INTERVAL)"
+        )
 
 
 config = Config()
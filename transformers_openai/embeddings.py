@@ -0,0 +1,119 @@
+import asyncio
+import hashlib
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional, Tuple
+
+# (embeddings, token counts) for a batch of texts
+EmbedFn = Callable[[List[str]], Tuple[List[List[float]], List[int]]]
+
+
+class EmbeddingCache:
+    """LRU cache of embeddings keyed by a hash of the model, pooling and input text"""
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self.entries: "OrderedDict[str, Tuple[List[float], int]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(model: str, pooling: str, text: str) -> str:
+        return hashlib.sha256(f"{model}\0{pooling}\0{text}".encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Optional[Tuple[List[float], int]]:
+        entry = self.entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return entry
+
+    def put(self, key: str, entry: Tuple[List[float], int]):
+        if self.max_entries <= 0:
+            return
+        self.entries[key] = entry
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+
+class EmbeddingBatcher:
+    """Groups embedding inputs of concurrent requests into shared forward passes.
+
+    Inputs are collected for up to `window` seconds (or until `max_batch_size`
+    inputs are waiting), sorted by length to keep padding low and embedded in
+    a worker thread. Cached inputs are answered without running the model and
+    identical inputs that are already queued share one result.
+    """
+
+    def __init__(
+        self,
+        embed_fn: EmbedFn,
+        max_batch_size: int = 32,
+        window: float = 0.005,
+        cache_size: int = 10000,
+    ):
+        self.embed_fn = embed_fn
+        self.max_batch_size = max(1, max_batch_size)
+        self.window = window
+        self.cache = EmbeddingCache(cache_size)
+        self.pending: List[Tuple[str, str, asyncio.Future]] = []
+        self.inflight: Dict[str, asyncio.Future] = {}
+        self.flush_handle: Optional[asyncio.TimerHandle] = None
+
+    async def embed(
+        self, texts: List[str], model: str, pooling: str
+    ) -> List[Tuple[List[float], int]]:
+        """Return (embedding, token count) for every text"""
+        loop = asyncio.get_running_loop()
+        futures = []
+        for text in texts:
+            key = EmbeddingCache.key(model, pooling, text)
+            cached = self.cache.get(key)
+            if cached is not None:
+                future = loop.create_future()
+                future.set_result(cached)
+            elif key in self.inflight:
+                future = self.inflight[key]
+            else:
+                future = loop.create_future()
+                self.inflight[key] = future
+                self.pending.append((key, text, future))
+            futures.append(future)
+
+        if len(self.pending) >= self.max_batch_size:
+            self._flush()
+        elif self.pending and self.flush_handle is None:
+            self.flush_handle = loop.call_later(self.window, self._flush)
+
+        # Shield the shared futures so a disconnecting client doesn't cancel them for others
+        return await asyncio.gather(*(asyncio.shield(future) for future in futures))
+
+    def _flush(self):
+        if self.flush_handle is not None:
+            self.flush_handle.cancel()
+            self.flush_handle = None
+
+        pending = sorted(self.pending, key=lambda item: len(item[1]))
+        self.pending = []
+        for start in range(0, len(pending), self.max_batch_size):
+            asyncio.ensure_future(self._run(pending[start:start + self.max_batch_size]))
+
+    async def _run(self, batch: List[Tuple[str, str, asyncio.Future]]):
+        try:
+            embeddings, token_counts = await asyncio.to_thread(
+                self.embed_fn, [text for _, text, _ in batch]
+            )
+        except Exception as e:
+            for key, _, future in batch:
+                self.inflight.pop(key, None)
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        for (key, _, future), embedding, token_count in zip(batch, embeddings, token_counts):
+            self.inflight.pop(key, None)
+            self.cache.put(key, (embedding, token_count))
+            if not future.done():
+                future.set_result((embedding, token_count))
@@ -0,0 +1,409 @@
+import asyncio
+import threading
+import time
+import torch
+from transformers import LogitsProcessor, StoppingCriteria
+from transformers.generation.streamers import BaseStreamer
+from typing import Callable, List, Optional, Tuple
+
+from transformers_openai.guided import TokenIndex
+
+
+class StreamStalled(Exception):
+    """The client of a stream stopped reading for longer than the stall timeout"""
+
+
+class TokenStreamer(BaseStreamer):
+    """Hands the token ids of every decoding step from the generate() thread to an asyncio consumer.
+
+    Unlike TextIteratorStreamer this works for batches: each item is a list
+    with one token id per row, paired with that step's (chosen logprobs,
+    top logprobs, top ids) per row when a LogprobsProcessor is attached.
+
+    With `max_buffer` at most that many steps wait for the consumer; once
+    they do, generate() blocks in put() until the consumer catches up, so a
+    slow client pauses its own generation instead of growing the buffer.
+    `on_stall` is called when that happens and `on_resume` before decoding
+    continues, both in the generate() thread. After `stall_timeout` seconds
+    without room put() raises StreamStalled, which ends the generation.
+    """
+
+    def __init__(
+        self,
+        skip_prompt: bool = True,
+        logprobs: Optional["LogprobsProcessor"] = None,
+        max_buffer: int = 0,
+        stall_timeout: float = 0.0,
+        on_stall: Optional[Callable[[], None]] = None,
+        on_resume: Optional[Callable[[], None]] = None,
+    ):
+        self.loop = asyncio.get_running_loop()
+        self.queue: asyncio.Queue = asyncio.Queue()
+        self.skip_prompt = skip_prompt
+        self.next_tokens_are_prompt = True
+        self.logprobs = logprobs
+        self.error: Optional[BaseException] = None
+        # Free places in the buffer, None when it is unbounded
+        self.space = threading.Semaphore(max_buffer) if max_buffer > 0 else None
+        self.stall_timeout = stall_timeout
+        self.on_stall = on_stall
+        self.on_resume = on_resume
+        self.closed = False
+
+    def put(self, value):
+        if self.skip_prompt and self.next_tokens_are_prompt:
+            self.next_tokens_are_prompt = False
+            return
+        value = value.reshape(-1)
+        step = None
+        if self.logprobs is not None:
+            # Only the chosen and top-k values of this step leave the device
+            chosen, top_logprobs, top_ids = self.logprobs.resolve(value)
+            step = (chosen.tolist(), top_logprobs.tolist(), top_ids.tolist())
+        if self.space is not None and not self.space.acquire(blocking=False):
+            self._wait_for_space()
+        if not self.closed:
+            self.loop.call_soon_threadsafe(self.queue.put_nowait, (value.tolist(), step))
+
+    def _wait_for_space(self):
+        if self.on_stall is not None:
+            self.on_stall()
+        if not self.space.acquire(timeout=self.stall_timeout if self.stall_timeout > 0 else None):
+            raise StreamStalled(f"The client did not read the stream for {self.stall_timeout:g} seconds")
+        if self.on_resume is not None and not self.closed:
+            self.on_resume()
+
+    def end(self):
+        self.loop.call_soon_threadsafe(self.queue.put_nowait, None)
+
+    def close(self):
+        """The consumer is gone: put() no longer waits for room, the generation is stopped separately"""
+        self.closed = True
+        if self.space is not None:
+            # Wakes a put() waiting for room, and every later one goes straight through
+            self.space.release(1 << 20)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self) -> Tuple[List[int], Optional[Tuple[list, list, list]]]:
+        value = await self.queue.get()
+        if value is None:
+            if self.error is not None:
+                raise self.error
+            raise StopAsyncIteration
+        if self.space is not None:
+            self.space.release()
+        return value
+
+
+class IncrementalDetokenizer:
+    """Decodes one token at a time without re-decoding the whole sequence.
+
+    Only a short window of recent tokens is decoded on every step, and text is
+    held back while it ends in an incomplete multi-byte character.
+    """
+
+    def __init__(self, tokenizer, skip_special_tokens: bool = True):
+        self.tokenizer = tokenizer
+        self.skip_special_tokens = skip_special_tokens
+        self.tokens: List[int] = []
+        self.prefix_offset = 0
+        self.read_offset = 0
+
+    def _decode(self, tokens: List[int]) -> str:
+        return self.tokenizer.decode(tokens, skip_special_tokens=self.skip_special_tokens)
+
+    def push(self, token_id: int) -> str:
+        """Add a token and return the newly completed text, if any"""
+        self.tokens.append(token_id)
+        prefix_text = self._decode(self.tokens[self.prefix_offset:self.read_offset])
+        new_text = self._decode(self.tokens[self.prefix_offset:])
+        if len(new_text) > len(prefix_text) and not new_text.endswith("\ufffd"):
+            self.prefix_offset = self.read_offset
+            self.read_offset = len(self.tokens)
+            return new_text[len(prefix_text):]
+        return ""
+
+    def flush(self) -> str:
+        """Return any text still held back at the end of the sequence"""
+        prefix_text = self._decode(self.tokens[self.prefix_offset:self.read_offset])
+        new_text = self._decode(self.tokens[self.prefix_offset:])
+        self.prefix_offset = self.read_offset = len(self.tokens)
+        return new_text[len(prefix_text):]
+
+
+def find_stop(text: str, stop_sequences: List[str], new_chars: int) -> int:
+    """Start of the earliest stop sequence that ends in the last `new_chars` characters of `text`, -1 if none.
+
+    Everything before was searched when it was added, so only a tail of the
+    new characters plus the longest stop sequence is scanned.
+    """
+    earliest = -1
+    tail = len(text) - new_chars + 1
+    for stop in stop_sequences:
+        position = text.find(stop, max(0, tail - len(stop)))
+        if position >= 0 and (earliest < 0 or position < earliest):
+            earliest = position
+    return earliest
+
+
+class ThinkTags:
+    """First positions of the reasoning tags in a growing text, found without rescanning it"""
+
+    OPEN = "<think>"
+    CLOSE = "</think>"
+
+    def __init__(self):
+        self.open = -1
+        self.close = -1
+        self.scanned = 0
+
+    def update(self, text: str) -> bool:
+        """Search the text added since the last call, True when the closing tag was found just now"""
+        if self.open < 0:
+            self.open = text.find(self.OPEN, max(0, self.scanned - len(self.OPEN) + 1))
+        closed = False
+        if self.close < 0:
+            self.close = text.find(self.CLOSE, max(0, self.scanned - len(self.CLOSE) + 1))
+            closed = self.close >= 0
+        self.scanned = len(text)
+        return closed
+
+
+class StopRowsCriteria(StoppingCriteria):
+    """Lets the consumer of a running generate() stop single rows or the whole batch"""
+
+    def __init__(self, batch_size: int):
+        self.stopped = [False] * batch_size
+
+    def stop(self, index: Optional[int] = None):
+        if index is None:
+            self.stopped = [True] * len(self.stopped)
+        else:
+            self.stopped[index] = True
+
+    def __call__(self, input_ids, scores, **kwargs) -> torch.BoolTensor:
+        return torch.tensor(self.stopped, dtype=torch.bool, device=input_ids.device)
+
+
+class DeadlineCriteria(StoppingCriteria):
+    """Stops the whole batch once the request's deadline (a time.perf_counter() value) has passed"""
+
+    def __init__(self, deadline: float):
+        self.deadline = deadline
+        self.expired = False
+
+    def __call__(self, input_ids, scores, **kwargs) -> torch.BoolTensor:
+        self.expired = self.expired or time.perf_counter() >= self.deadline
+        return torch.full((input_ids.shape[0],), self.expired, dtype=torch.bool, device=input_ids.device)
+
+
+class StepTimer(LogitsProcessor):
+    """Counts the decoding steps of a running generate() and notes when the first one started.
+
+    The first call comes right after the prefill forward pass, so its time
+    is when the first token is picked. Scores are passed through untouched.
+    """
+
+    def __init__(self):
+        self.first_step_time: Optional[float] = None
+        self.steps = 0
+
+    def __call__(self, input_ids, scores):
+        if self.first_step_time is None:
+            self.first_step_time = time.perf_counter()
+        self.steps += 1
+        return scores
+
+
+class LogprobsProcessor(LogitsProcessor):
+    """Records the log probability of every sampled token and its `top_k` most likely alternatives.
+
+    It runs before the sampling warpers, so the values are those of the
+    model's own distribution. Each step only computes the log-sum-exp
+    normalizer and a top-k on the device; the chosen token is gathered once it
+    is known, either by `resolve` from the streamer or at the start of the
+    next step. Nothing vocab-sized outlives a step or is copied to the host.
+    """
+
+    def __init__(self, top_k: int = 0):
+        self.top_k = top_k
+        self.pending: Optional[Tuple[torch.Tensor, torch.Tensor]] = None
+        self.chosen: List[torch.Tensor] = []
+        self.top_logprobs: List[torch.Tensor] = []
+        self.top_ids: List[torch.Tensor] = []
+
+    def __call__(self, input_ids, scores):
+        if self.pending is not None:
+            self.resolve(input_ids[:, -1])
+        logits = scores.float()
+        self.pending = (logits, torch.logsumexp(logits, dim=-1, keepdim=True))
+        return scores
+
+    def resolve(self, token_ids: torch.Tensor) -> Tuple[torch.Tensor, torch.Tensor, torch.Tensor]:
+        """Record the pending step for the tokens sampled from it.
+
+        Returns the chosen logprobs (rows,) and the top logprobs and ids
+        (rows, top_k), still on the device.
+        """
+        scores, normalizer = self.pending
+        self.pending = None
+        token_ids = token_ids.to(scores.device).view(-1, 1)
+        chosen = (scores.gather(-1, token_ids) - normalizer).squeeze(-1)
+        if self.top_k > 0:
+            top = scores.topk(self.top_k, dim=-1)
+            top_logprobs, top_ids = top.values - normalizer, top.indices
+        else:
+            top_logprobs = scores.new_empty((scores.shape[0], 0))
+            top_ids = token_ids.new_empty((scores.shape[0], 0))
+        self.chosen.append(chosen)
+        self.top_logprobs.append(top_logprobs)
+        self.top_ids.append(top_ids)
+        return chosen, top_logprobs, top_ids
+
+    def finalize(self, generated_ids: torch.Tensor) -> Tuple[torch.Tensor, torch.Tensor, torch.Tensor]:
+        """Return the chosen logprobs (rows, steps) and top logprobs and ids (rows, steps, top_k)"""
+        if self.pending is not None and generated_ids.shape[1] > len(self.chosen):
+            self.resolve(generated_ids[:, -1])
+        return (
+            torch.stack(self.chosen, dim=1),
+            torch.stack(self.top_logprobs, dim=1),
+            torch.stack(self.top_ids, dim=1),
+        )
+
+
+def completion_mask(generated_ids: torch.Tensor, eos_token_id: Optional[int]) -> torch.Tensor:
+    """Boolean mask of the generated tokens up to and including the first EOS of each row"""
+    if eos_token_id is None:
+        return torch.ones_like(generated_ids, dtype=torch.bool)
+    is_eos = (generated_ids == eos_token_id).int()
+    return (is_eos.cumsum(dim=1) - is_eos) == 0
+
+
+class BatchedSampler(LogitsProcessor):
+    """Samples every row of a batch with its own temperature, top-p, top-k, penalties and seed.
+
+    All parameters are per-row tensors applied in one vectorized pass. The
+    sampled token is returned as the only finite score, so generate() has to
+    run in greedy mode and must not add its own warpers. Top-p and top-k work
+    on the `candidates` most likely tokens of a row (a partial sort); only
+    when those do not hold enough probability mass is the vocabulary fully
+    sorted. Sampling uses the exponential race (argmax of p / E with
+    E ~ Exp(1)), with the noise of seeded rows drawn from their own generator
+    over the whole vocabulary, so a seeded row does not depend on the rest of
+    the batch.
+    """
+
+    def __init__(
+        self,
+        temperature: List[float],
+        top_p: List[float],
+        top_k: List[int],
+        frequency_penalty: List[float],
+        presence_penalty: List[float],
+        seed: List[Optional[int]],
+        candidates: int = 256,
+    ):
+        self.temperature = torch.tensor(temperature, dtype=torch.float)
+        self.top_p = torch.tensor(top_p, dtype=torch.float)
+        self.top_k = torch.tensor([max(k or 0, 0) for k in top_k], dtype=torch.long)
+        self.frequency_penalty = torch.tensor(frequency_penalty, dtype=torch.float)
+        self.presence_penalty = torch.tensor(presence_penalty, dtype=torch.float)
+        self.seed = seed
+        self.candidates = candidates
+        self.penalize = bool(self.frequency_penalty.any() or self.presence_penalty.any())
+        self.restricted = (self.top_p < 1) | (self.top_k > 0)
+        self.generators: Optional[List[Optional[torch.Generator]]] = None
+        self.counts: Optional[torch.Tensor] = None
+
+    def _setup(self, scores: torch.Tensor):
+        device = scores.device
+        for name in ("temperature", "top_p", "top_k", "frequency_penalty", "presence_penalty", "restricted"):
+            setattr(self, name, getattr(self, name).to(device))
+        self.generators = [
+            torch.Generator(device=device).manual_seed(seed) if seed is not None else None
+            for seed in self.seed
+        ]
+        if self.penalize:
+            self.counts = torch.zeros_like(scores, dtype=torch.float)
+
+    def __call__(self, input_ids, scores):
+        first_step = self.generators is None
+        if first_step:
+            self._setup(scores)
+        logits = scores.float()
+
+        if self.penalize:
+            # Penalties only count generated tokens, not the prompt
+            if not first_step:
+                self.counts.scatter_add_(1, input_ids[:, -1:], torch.ones_like(logits[:, :1]))
+            logits = (
+                logits
+                - self.frequency_penalty[:, None] * self.counts
+                - self.presence_penalty[:, None] * (self.counts > 0).float()
+            )
+
+        greedy = self.temperature <= 0
+        probs = torch.softmax(logits / self.temperature.clamp(min=1e-5)[:, None], dim=-1)
+
+        rows = self.restricted.nonzero().squeeze(-1)
+        if rows.numel():
+            probs[rows] = self._truncate(probs[rows], self.top_p[rows], self.top_k[rows])
+
+        noise = torch.empty_like(probs).exponential_()
+        for row, generator in enumerate(self.generators):
+            if generator is not None:
+                noise[row] = torch.empty_like(probs[row]).exponential_(generator=generator)
+        tokens = torch.where(greedy, logits.argmax(dim=-1), (probs / noise).argmax(dim=-1))
+
+        return torch.full_like(scores, float("-inf")).scatter_(1, tokens[:, None], 0.0)
+
+    def _truncate(self, probs: torch.Tensor, top_p: torch.Tensor, top_k: torch.Tensor) -> torch.Tensor:
+        """Zero the probabilities outside each row's top-p nucleus and top-k"""
+        vocab_size = probs.shape[-1]
+        width = min(vocab_size, max(self.candidates, int(top_k.max())))
+        values, ids = probs.topk(width, dim=-1)
+        cumulative = values.cumsum(dim=-1)
+        # A row is resolved by the candidates if its top-k fits or its nucleus closes within them
+        resolved = ((top_k > 0) & (top_k <= width)) | (cumulative[:, -1] >= top_p)
+        if width < vocab_size and not bool(resolved.all()):
+            values, ids = probs.sort(dim=-1, descending=True)
+            cumulative = values.cumsum(dim=-1)
+            width = vocab_size
+
+        positions = torch.arange(width, device=probs.device)
+        keep = (cumulative - values) < top_p[:, None]
+        keep &= (top_k[:, None] <= 0) | (positions < top_k[:, None])
+        keep[:, 0] = True
+        mask = torch.zeros_like(probs, dtype=torch.bool).scatter_(1, ids, keep)
+        return probs * mask
+
+
+class GuidedDecodingProcessor(LogitsProcessor):
+    """Masks every constrained row of a batch to the tokens its pattern allows next.
+
+    Rows without a guide, and rows that have left their pattern by emitting
+    EOS, are not touched.
+    """
+
+    def __init__(self, guides: List[Optional[TokenIndex]]):
+        self.guides = guides
+        self.states: List[Optional[int]] = [0 if guide is not None else None for guide in guides]
+        self.started = False
+
+    def __call__(self, input_ids, scores):
+        if self.started:
+            last_tokens = input_ids[:, -1].tolist()
+            for row, guide in enumerate(self.guides):
+                if self.states[row] is not None:
+                    self.states[row] = guide.next_state(self.states[row], last_tokens[row])
+        self.started = True
+
+        rows = [row for row, state in enumerate(self.states) if state is not None]
+        if not rows:
+            return scores
+        disallowed = torch.zeros_like(scores, dtype=torch.bool)
+        for row in rows:
+            disallowed[row] = self.guides[row].mask(self.states[row], scores.shape[-1], scores.device)
+        return scores.masked_fill(disallowed, float("-inf"))
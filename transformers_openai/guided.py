@@ -0,0 +1,660 @@
+import bisect
+import json
+import re
+import threading
+from collections import OrderedDict
+from typing import TYPE_CHECKING, Any, Dict, FrozenSet, List, Optional, Tuple
+
+if TYPE_CHECKING:
+    import torch
+
+MAX_CODEPOINT = 0x10FFFF
+
+# Intervals of code points, sorted and non-overlapping
+CharSet = Tuple[Tuple[int, int], ...]
+
+
+def _normalize(ranges) -> CharSet:
+    merged: List[List[int]] = []
+    for lo, hi in sorted(ranges):
+        if merged and lo <= merged[-1][1] + 1:
+            merged[-1][1] = max(merged[-1][1], hi)
+        else:
+            merged.append([lo, hi])
+    return tuple((lo, hi) for lo, hi in merged)
+
+
+def _complement(charset: CharSet) -> CharSet:
+    result, start = [], 0
+    for lo, hi in charset:
+        if lo > start:
+            result.append((start, lo - 1))
+        start = hi + 1
+    if start <= MAX_CODEPOINT:
+        result.append((start, MAX_CODEPOINT))
+    return tuple(result)
+
+
+def _contains(charset: CharSet, code: int) -> bool:
+    for lo, hi in charset:
+        if code < lo:
+            return False
+        if code <= hi:
+            return True
+    return False
+
+
+_DIGIT = ((ord("0"), ord("9")),)
+_WORD = _normalize([(ord("0"), ord("9")), (ord("A"), ord("Z")), (ord("_"), ord("_")), (ord("a"), ord("z"))])
+_SPACE = _normalize([(ord(c), ord(c)) for c in " \t\n\r\f\v"])
+_CLASS_ESCAPES = {
+    "d": _DIGIT,
+    "D": _complement(_DIGIT),
+    "w": _WORD,
+    "W": _complement(_WORD),
+    "s": _SPACE,
+    "S": _complement(_SPACE),
+}
+_CONTROL_ESCAPES = {"n": "\n", "t": "\t", "r": "\r", "f": "\f", "v": "\v", "0": "\0"}
+
+
+class RegexParser:
+    """Parses the subset of regular expressions needed for guided decoding into an AST.
+
+    Supports literals, escapes, character classes, `.`, groups, alternation
+    and the `*`, `+`, `?` and `{m,n}` quantifiers. Patterns always match the
+    whole output; anchors and lazy modifiers are accepted and ignored.
+    Nodes are tuples: ("chars", charset), ("cat", nodes), ("alt", nodes) and
+    ("repeat", node, min, max or None).
+    """
+
+    def __init__(self, pattern: str):
+        self.pattern = pattern
+        self.pos = 0
+
+    def parse(self):
+        node = self._alternation()
+        if self.pos != len(self.pattern):
+            raise ValueError(f"Unexpected {self.pattern[self.pos]!r} at position {self.pos} in regex")
+        return node
+
+    def _peek(self) -> Optional[str]:
+        return self.pattern[self.pos] if self.pos < len(self.pattern) else None
+
+    def _next(self) -> str:
+        if self.pos >= len(self.pattern):
+            raise ValueError("Unexpected end of regex")
+        char = self.pattern[self.pos]
+        self.pos += 1
+        return char
+
+    def _alternation(self):
+        branches = [self._concatenation()]
+        while self._peek() == "|":
+            self.pos += 1
+            branches.append(self._concatenation())
+        return branches[0] if len(branches) == 1 else ("alt", branches)
+
+    def _concatenation(self):
+        items = []
+        while self._peek() is not None and self._peek() not in "|)":
+            items.append(self._quantified())
+        return ("cat", items)
+
+    def _quantified(self):
+        node = self._atom()
+        while True:
+            char = self._peek()
+            if char == "*":
+                self.pos += 1
+                node = ("repeat", node, 0, None)
+            elif char == "+":
+                self.pos += 1
+                node = ("repeat", node, 1, None)
+            elif char == "?":
+                self.pos += 1
+                node = ("repeat", node, 0, 1)
+            elif char == "{" and re.match(r"\{\d*(,\d*)?\}", self.pattern[self.pos:]):
+                match = re.match(r"\{(\d*)(,(\d*))?\}", self.pattern[self.pos:])
+                self.pos += match.end()
+                low = int(match.group(1) or 0)
+                if match.group(2) is None:
+                    high = low
+                else:
+                    high = int(match.group(3)) if match.group(3) else None
+                if high is not None and high < low:
+                    raise ValueError("Invalid repetition range in regex")
+                node = ("repeat", node, low, high)
+            else:
+                return node
+            if self._peek() == "?":
+                # Lazy quantifiers match the same language
+                self.pos += 1
+
+    def _atom(self):
+        char = self._next()
+        if char == "(":
+            if self.pattern.startswith("?:", self.pos):
+                self.pos += 2
+            elif self._peek() == "?":
+                raise ValueError("Only non-capturing groups (?:...) are supported in regex")
+            node = self._alternation()
+            if self._next() != ")":
+                raise ValueError("Unbalanced parenthesis in regex")
+            return node
+        if char == "[":
+            return ("chars", self._class())
+        if char == ".":
+            return ("chars", _complement(((ord("\n"), ord("\n")),)))
+        if char in "^$":
+            return ("cat", [])
+        if char == "\\":
+            return ("chars", self._escape())
+        if char in "*+?)":
+            raise ValueError(f"Unexpected {char!r} in regex")
+        return ("chars", ((ord(char), ord(char)),))
+
+    def _escape(self) -> CharSet:
+        char = self._next()
+        if char in _CLASS_ESCAPES:
+            return _CLASS_ESCAPES[char]
+        if char in _CONTROL_ESCAPES:
+            code = ord(_CONTROL_ESCAPES[char])
+        elif char in "ux":
+            width = 4 if char == "u" else 2
+            digits = self.pattern[self.pos:self.pos + width]
+            if not re.fullmatch(r"[0-9a-fA-F]{%d}" % width, digits):
+                raise ValueError(f"Invalid \\{char} escape in regex")
+            self.pos += width
+            code = int(digits, 16)
+        elif char.isalnum():
+            raise ValueError(f"Unsupported escape \\{char} in regex")
+        else:
+            code = ord(char)
+        return ((code, code),)
+
+    def _class(self) -> CharSet:
+        negated = self._peek() == "^"
+        if negated:
+            self.pos += 1
+        ranges = []
+        first = True
+        while True:
+            char = self._next()
+            if char == "]" and not first:
+                break
+            first = False
+            if char == "\\":
+                charset = self._escape()
+                if len(charset) != 1 or charset[0][0] != charset[0][1]:
+                    ranges.extend(charset)
+                    continue
+                low = charset[0][0]
+            else:
+                low = ord(char)
+            if self._peek() == "-" and self.pattern[self.pos + 1:self.pos + 2] not in ("]", ""):
+                self.pos += 1
+                end = self._next()
+                high = self._escape()[0][0] if end == "\\" else ord(end)
+                if high < low:
+                    raise ValueError("Invalid character range in regex")
+                ranges.append((low, high))
+            else:
+                ranges.append((low, low))
+        charset = _normalize(ranges)
+        return _complement(charset) if negated else charset
+
+
+class CharacterDFA:
+    """A lazily determinized Thompson NFA over characters.
+
+    DFA states are numbered as they are discovered; state 0 is the start
+    state and a step into no NFA states returns None. Characters that no
+    character set of the pattern tells apart share a class, and steps are
+    taken per class.
+    """
+
+    def __init__(self, pattern: str):
+        self.transitions: List[List[Tuple[CharSet, int]]] = []
+        self.epsilon: List[List[int]] = []
+        start, self.end = self._build(RegexParser(pattern).parse())
+        self.boundaries = sorted({
+            bound
+            for transitions in self.transitions
+            for charset, _ in transitions
+            for lo, hi in charset
+            for bound in (lo, hi + 1)
+        })
+
+        self.states: List[FrozenSet[int]] = []
+        self.state_ids: Dict[FrozenSet[int], int] = {}
+        self.steps: Dict[Tuple[int, str], Optional[int]] = {}
+        self._state(self._closure({start}))
+
+    def _new_state(self) -> int:
+        self.transitions.append([])
+        self.epsilon.append([])
+        return len(self.transitions) - 1
+
+    def _build(self, node) -> Tuple[int, int]:
+        kind = node[0]
+        if kind == "chars":
+            start, end = self._new_state(), self._new_state()
+            self.transitions[start].append((node[1], end))
+            return start, end
+        if kind == "cat":
+            start = end = self._new_state()
+            for item in node[1]:
+                item_start, item_end = self._build(item)
+                self.epsilon[end].append(item_start)
+                end = item_end
+            return start, end
+        if kind == "alt":
+            start, end = self._new_state(), self._new_state()
+            for branch in node[1]:
+                branch_start, branch_end = self._build(branch)
+                self.epsilon[start].append(branch_start)
+                self.epsilon[branch_end].append(end)
+            return start, end
+        _, item, low, high = node
+        start = end = self._new_state()
+        for _ in range(low):
+            item_start, item_end = self._build(item)
+            self.epsilon[end].append(item_start)
+            end = item_end
+        if high is None:
+            item_start, item_end = self._build(item)
+            loop_end = self._new_state()
+            self.epsilon[end].extend([item_start, loop_end])
+            self.epsilon[item_end].extend([item_start, loop_end])
+            end = loop_end
+        else:
+            tail = self._new_state()
+            for _ in range(high - low):
+                item_start, item_end = self._build(item)
+                self.epsilon[end].extend([item_start, tail])
+                end = item_end
+            self.epsilon[end].append(tail)
+            end = tail
+        return start, end
+
+    def _closure(self, states) -> FrozenSet[int]:
+        stack, seen = list(states), set(states)
+        while stack:
+            for target in self.epsilon[stack.pop()]:
+                if target not in seen:
+                    seen.add(target)
+                    stack.append(target)
+        return frozenset(seen)
+
+    def _state(self, nfa_states: FrozenSet[int]) -> int:
+        state = self.state_ids.get(nfa_states)
+        if state is None:
+            state = self.state_ids[nfa_states] = len(self.states)
+            self.states.append(nfa_states)
+        return state
+
+    def char_class(self, char: str) -> int:
+        return bisect.bisect_right(self.boundaries, ord(char))
+
+    def step(self, state: int, char_class: int) -> Optional[int]:
+        key = (state, char_class)
+        if key not in self.steps:
+            code = self.boundaries[char_class - 1] if char_class > 0 else 0
+            targets = {
+                target
+                for nfa_state in self.states[state]
+                for charset, target in self.transitions[nfa_state]
+                if _contains(charset, code)
+            }
+            self.steps[key] = self._state(self._closure(targets)) if targets else None
+        return self.steps[key]
+
+    def is_accepting(self, state: int) -> bool:
+        return self.end in self.states[state]
+
+    def matches(self, text: str) -> bool:
+        state = 0
+        for char in text:
+            state = self.step(state, self.char_class(char))
+            if state is None:
+                return False
+        return self.is_accepting(state)
+
+
+class TokenVocabulary:
+    """The text every token appends to the output"""
+
+    def __init__(self, tokenizer):
+        self.eos_token_id = tokenizer.eos_token_id
+        self.size = len(tokenizer)
+        special = set(tokenizer.all_special_ids)
+        # Decode after a prefix so tokenizers that strip a leading space keep it
+        prefix = tokenizer.encode("a", add_special_tokens=False)
+        prefix_text = tokenizer.decode(prefix)
+        self.tokens: List[Tuple[int, str]] = []
+        for token_id in range(self.size):
+            if token_id in special:
+                continue
+            text = tokenizer.decode(prefix + [token_id])[len(prefix_text):]
+            # Tokens holding part of a multi-byte character can not be matched per character
+            if not text or "�" in text:
+                continue
+            self.tokens.append((token_id, text))
+        self.chars = sorted({char for _, text in self.tokens for char in text})
+
+    def trie(self, dfa: CharacterDFA) -> "TrieNode":
+        """Tokens arranged by the character classes of `dfa`, tokens that look alike share a path"""
+        classes = {char: dfa.char_class(char) for char in self.chars}
+        root = TrieNode()
+        for token_id, text in self.tokens:
+            path = [classes[char] for char in text]
+            # Classes from each position to the end of the token
+            suffixes = [0] * (len(path) + 1)
+            for position in range(len(path) - 1, -1, -1):
+                suffixes[position] = suffixes[position + 1] | (1 << path[position])
+            node = root
+            for position, char_class in enumerate(path):
+                child = node.children.get(char_class)
+                if child is None:
+                    child = node.children[char_class] = TrieNode()
+                node = child
+                node.subtree_classes |= suffixes[position]
+                node.subtree_ids.append(token_id)
+            node.ids.append(token_id)
+        return root
+
+
+class TrieNode:
+    """A trie node with the tokens ending here and the classes and tokens of its whole subtree.
+
+    `subtree_classes` includes the class of the edge into the node, so a
+    subtree can be skipped as a block when a state loops on all of them.
+    """
+
+    __slots__ = ("children", "ids", "subtree_classes", "subtree_ids")
+
+    def __init__(self):
+        self.children: Dict[int, "TrieNode"] = {}
+        self.ids: List[int] = []
+        self.subtree_classes = 0
+        self.subtree_ids: List[int] = []
+
+
+class TokenIndex:
+    """Maps every reachable DFA state to the tokens allowed there and the state each one leads to.
+
+    Built once per pattern by walking the vocabulary trie from every state,
+    so decoding only needs a dictionary lookup and a precomputed mask per
+    step.
+    """
+
+    def __init__(self, pattern: str, vocabulary: TokenVocabulary):
+        self.eos_token_id = vocabulary.eos_token_id
+        dfa = self.dfa = CharacterDFA(pattern)
+        trie = vocabulary.trie(dfa)
+        self.transitions: Dict[int, Dict[int, int]] = {}
+        self.masks: Dict[Tuple[int, "torch.device"], "torch.Tensor"] = {}
+
+        num_classes = len(dfa.boundaries) + 1
+        loops: Dict[int, int] = {}
+
+        def loop_classes(state: int) -> int:
+            """Bit mask of the classes a state steps back into itself on"""
+            if state not in loops:
+                loops[state] = sum(
+                    1 << char_class
+                    for char_class in range(num_classes)
+                    if dfa.step(state, char_class) == state
+                )
+            return loops[state]
+
+        pending = [0]
+        while pending:
+            state = pending.pop()
+            if state in self.transitions:
+                continue
+            allowed = self.transitions[state] = {}
+            stack = [(trie, state)]
+            while stack:
+                node, current = stack.pop()
+                loop = loop_classes(current)
+                for char_class, child in node.children.items():
+                    if child.subtree_classes & ~loop == 0:
+                        # Every token below stays in the current state, e.g. plain text inside a string
+                        allowed.update(dict.fromkeys(child.subtree_ids, current))
+                        continue
+                    target = dfa.step(current, char_class)
+                    if target is None:
+                        continue
+                    for token_id in child.ids:
+                        allowed[token_id] = target
+                    stack.append((child, target))
+            pending.extend(target for target in set(allowed.values()) if target not in self.transitions)
+        self.accepting = {state: dfa.is_accepting(state) for state in self.transitions}
+
+    @property
+    def num_states(self) -> int:
+        return len(self.transitions)
+
+    def next_state(self, state: int, token_id: int) -> Optional[int]:
+        return self.transitions[state].get(token_id)
+
+    def mask(self, state: int, vocab_size: int, device: "torch.device") -> "torch.Tensor":
+        """Boolean mask of the tokens that are not allowed in `state`"""
+        key = (state, device)
+        mask = self.masks.get(key)
+        if mask is None:
+            import torch
+
+            allowed = list(self.transitions[state])
+            if self.eos_token_id is not None and (self.accepting[state] or not allowed):
+                allowed.append(self.eos_token_id)
+            mask = torch.ones(vocab_size, dtype=torch.bool, device=device)
+            mask[torch.tensor(allowed, dtype=torch.long, device=device)] = False
+            self.masks[key] = mask
+        return mask
+
+
+class GuideCache:
+    """Compiled token indices by pattern, least recently used first out"""
+
+    def __init__(self, tokenizer, max_entries: int = 32):
+        self.tokenizer = tokenizer
+        self.max_entries = max_entries
+        self.vocabulary: Optional[TokenVocabulary] = None
+        self.indices: "OrderedDict[str, TokenIndex]" = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, pattern: str) -> TokenIndex:
+        with self.lock:
+            index = self.indices.get(pattern)
+            if index is not None:
+                self.indices.move_to_end(pattern)
+                return index
+            if self.vocabulary is None:
+                self.vocabulary = TokenVocabulary(self.tokenizer)
+            index = TokenIndex(pattern, self.vocabulary)
+            if self.max_entries > 0:
+                self.indices[pattern] = index
+                while len(self.indices) > self.max_entries:
+                    self.indices.popitem(last=False)
+            return index
+
+
+_META_CHARACTERS = set("\\.^$|?*+()[]{}")
+
+# Building blocks of JSON values; whitespace is limited so the model can not pad forever
+WHITESPACE = r"[ ]?"
+STRING = r'"(?:[^"\\\x00-\x1f]|\\["\\/bfnrt]|\\u[0-9a-fA-F]{4})*"'
+INTEGER = r"-?(?:0|[1-9][0-9]*)"
+NUMBER = INTEGER + r"(?:\.[0-9]+)?(?:[eE][+-]?[0-9]+)?"
+BOOLEAN = r"(?:true|false)"
+NULL = r"null"
+
+
+def escape(text: str) -> str:
+    """Escape a literal for the regex subset understood by RegexParser"""
+    return "".join("\\" + char if char in _META_CHARACTERS else char for char in text)
+
+
+def _literal(value: Any) -> str:
+    return escape(json.dumps(value, ensure_ascii=False))
+
+
+def _object(members: str) -> str:
+    return r"\{" + WHITESPACE + "(?:" + members + ")?" + WHITESPACE + r"\}"
+
+
+def _array(item: str, min_items: int = 0, max_items: Optional[int] = None) -> str:
+    separator = WHITESPACE + "," + WHITESPACE
+    if max_items == 0:
+        return r"\[" + WHITESPACE + r"\]"
+    rest = "{%d,%s}" % (max(min_items - 1, 0), "" if max_items is None else max_items - 1)
+    body = "(?:" + item + "(?:" + separator + item + ")" + rest + ")"
+    if min_items == 0:
+        body += "?"
+    return r"\[" + WHITESPACE + body + WHITESPACE + r"\]"
+
+
+def json_value_regex(depth: int = 3) -> str:
+    """Any JSON value with objects and arrays nested at most `depth` levels deep"""
+    value = "(?:" + "|".join([STRING, NUMBER, BOOLEAN, NULL]) + ")"
+    for _ in range(depth):
+        member = STRING + WHITESPACE + ":" + WHITESPACE + value
+        members = member + "(?:" + WHITESPACE + "," + WHITESPACE + member + ")*"
+        value = "(?:" + "|".join([STRING, NUMBER, BOOLEAN, NULL, _object(members), _array(value)]) + ")"
+    return value
+
+
+def json_object_regex(depth: int = 3) -> str:
+    """Any JSON object, nested at most `depth` levels deep"""
+    value = json_value_regex(depth - 1)
+    member = STRING + WHITESPACE + ":" + WHITESPACE + value
+    return _object(member + "(?:" + WHITESPACE + "," + WHITESPACE + member + ")*")
+
+
+def json_schema_regex(schema: Dict[str, Any], depth: int = 3) -> str:
+    """Regex matching JSON documents valid against a JSON schema.
+
+    Covers types, enum/const, anyOf/oneOf, local $refs, object properties
+    (emitted in declaration order, optional ones may be left out), arrays
+    with minItems/maxItems and strings with min/maxLength or a pattern.
+    Schemaless values fall back to `json_value_regex(depth)`.
+    """
+    definitions = {**schema.get("definitions", {}), **schema.get("$defs", {})}
+
+    def convert(node: Any, seen: Tuple[str, ...] = ()) -> str:
+        if node is True or node == {}:
+            return json_value_regex(depth)
+        if not isinstance(node, dict):
+            raise ValueError("Invalid JSON schema")
+        if "$ref" in node:
+            ref = node["$ref"]
+            name = ref.split("/")[-1]
+            if not ref.startswith("#/") or name not in definitions:
+                raise ValueError(f"Unsupported $ref {ref!r} in JSON schema")
+            if ref in seen:
+                raise ValueError("Recursive JSON schemas are not supported")
+            return convert(definitions[name], seen + (ref,))
+        if "const" in node:
+            return _literal(node["const"])
+        if "enum" in node:
+            return "(?:" + "|".join(_literal(value) for value in node["enum"]) + ")"
+        for key in ("anyOf", "oneOf"):
+            if key in node:
+                return "(?:" + "|".join(convert(option, seen) for option in node[key]) + ")"
+        if "allOf" in node and len(node["allOf"]) == 1:
+            return convert(node["allOf"][0], seen)
+
+        node_type = node.get("type")
+        if node_type is None:
+            if "properties" in node:
+                node_type = "object"
+            elif "items" in node:
+                node_type = "array"
+            else:
+                return json_value_regex(depth)
+        if isinstance(node_type, list):
+            return "(?:" + "|".join(convert({**node, "type": t}, seen) for t in node_type) + ")"
+
+        if node_type == "string":
+            if "pattern" in node:
+                # Grouped so an alternation stays inside the quotes, RegexParser ignores the anchors
+                return '"(?:' + node["pattern"] + ')"'
+            if "minLength" in node or "maxLength" in node:
+                character = STRING[1:-2]
+                return '"' + character + "{%d,%s}" % (
+                    node.get("minLength", 0), node.get("maxLength", "")
+                ) + '"'
+            return STRING
+        if node_type == "integer":
+            return INTEGER
+        if node_type == "number":
+            return NUMBER
+        if node_type == "boolean":
+            return BOOLEAN
+        if node_type == "null":
+            return NULL
+        if node_type == "array":
+            return _array(
+                convert(node.get("items", {}), seen),
+                node.get("minItems", 0),
+                node.get("maxItems"),
+            )
+        if node_type == "object":
+            properties = node.get("properties", {})
+            if not properties:
+                return json_object_regex(depth)
+            required = set(node.get("required", []))
+            members = [
+                (name in required, _literal(name) + WHITESPACE + ":" + WHITESPACE + convert(value, seen))
+                for name, value in properties.items()
+            ]
+            separator = WHITESPACE + "," + WHITESPACE
+            # Any member can come first as long as everything before it is optional
+            options = []
+            for first, (_, member) in enumerate(members):
+                tail = "".join(
+                    separator + other if is_required else "(?:" + separator + other + ")?"
+                    for is_required, other in members[first + 1:]
+                )
+                options.append(member + tail)
+                if members[first][0]:
+                    break
+            body = "(?:" + "|".join(options) + ")"
+            if not required:
+                body += "?"
+            return r"\{" + WHITESPACE + body + WHITESPACE + r"\}"
+        raise ValueError(f"Unsupported type {node_type!r} in JSON schema")
+
+    return convert(schema)
+
+
+def guide_pattern(
+    response_format: Optional[Dict[str, Any]], guided_regex: Optional[str], depth: int = 3
+) -> Optional[str]:
+    """The pattern a request's output is constrained to, None when it is unconstrained.
+
+    Raises ValueError for unsupported formats, schemas or regexes.
+    """
+    pattern = None
+    format_type = (response_format or {}).get("type", "text")
+    if format_type == "json_object":
+        pattern = json_object_regex(depth)
+    elif format_type == "json_schema":
+        json_schema = (response_format or {}).get("json_schema") or {}
+        schema = json_schema.get("schema")
+        if not isinstance(schema, dict):
+            raise ValueError("response_format.json_schema.schema must be an object")
+        pattern = json_schema_regex(schema, depth)
+    elif format_type != "text":
+        raise ValueError(f"Unsupported response_format type {format_type!r}")
+
+    if guided_regex is not None:
+        if pattern is not None:
+            raise ValueError("response_format and guided_regex can not be combined")
+        pattern = guided_regex
+    if pattern is not None:
+        RegexParser(pattern).parse()
+    return pattern
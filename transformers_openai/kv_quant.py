@@ -0,0 +1,179 @@
+from typing import List, Optional, Tuple
+
+import torch
+from transformers import Cache, DynamicLayer
+
+# Largest magnitude each storage format represents, scales map a group's absmax onto it
+QUANT_DTYPES = {"int8": (torch.int8, 127.0), "fp8": (torch.float8_e4m3fn, 448.0)}
+
+
+class KVQuantizer:
+    """Symmetric absmax quantization of key or value states of shape [batch, heads, tokens, head_dim].
+
+    `granularity` "token" keeps one scale per head and token, "channel" one
+    per head and channel over each block of `block` tokens, which isolates
+    the outlier channels keys tend to have. fp8 is emulated: the states are
+    stored as float8_e4m3fn and scaled back up in the compute dtype.
+    """
+
+    def __init__(self, dtype: str, granularity: str, block: int):
+        if dtype not in QUANT_DTYPES:
+            raise ValueError(f"Unknown KV cache quantization {dtype}, expected one of {', '.join(QUANT_DTYPES)}")
+        if granularity not in ("token", "channel"):
+            raise ValueError(f"Unknown KV cache scale granularity {granularity}, expected token or channel")
+        self.storage_dtype, self.max_value = QUANT_DTYPES[dtype]
+        self.granularity = granularity
+        self.block = block
+
+    def quantize(self, states: torch.Tensor) -> Tuple[torch.Tensor, torch.Tensor]:
+        """Quantized states and their scales, channel scales need a whole number of blocks"""
+        batch, heads, tokens, head_dim = states.shape
+        if self.granularity == "channel":
+            grouped = states.view(batch, heads, tokens // self.block, self.block, head_dim)
+            scales = grouped.abs().amax(dim=-2, keepdim=True).float()
+        else:
+            grouped = states
+            scales = states.abs().amax(dim=-1, keepdim=True).float()
+        scales = scales.clamp(min=1e-6) / self.max_value
+        scaled = grouped.float() / scales
+        if self.storage_dtype == torch.int8:
+            scaled = scaled.round_().clamp_(-self.max_value, self.max_value)
+        quantized = scaled.to(self.storage_dtype).view(batch, heads, tokens, head_dim)
+        if self.granularity == "channel":
+            scales = scales.squeeze(-2)
+        # Scales are kept in the compute dtype, they are a small share of the cache
+        return quantized, scales.to(states.dtype)
+
+    def dequantize(self, quantized: torch.Tensor, scales: torch.Tensor, dtype: torch.dtype) -> torch.Tensor:
+        batch, heads, tokens, head_dim = quantized.shape
+        if self.granularity == "channel":
+            blocks = quantized.view(batch, heads, tokens // self.block, self.block, head_dim).to(dtype)
+            return (blocks * scales.unsqueeze(-2)).view(batch, heads, tokens, head_dim)
+        return quantized.to(dtype) * scales
+
+    def bytes_per_element(self, compute_bytes: int, head_dim: int) -> float:
+        """Storage of one cached element including its share of the scales"""
+        scale_share = 1 / head_dim if self.granularity == "token" else 1 / self.block
+        return torch.empty((), dtype=self.storage_dtype).element_size() + compute_bytes * scale_share
+
+
+class QuantizedKVLayer(DynamicLayer):
+    """Cache layer that stores keys and values quantized and dequantizes them for attention.
+
+    The newest tokens stay in full precision in a residual window; whenever
+    it holds `block` tokens they are quantized and appended to the quantized
+    states, so every token is quantized exactly once. Attention gets the
+    dequantized history followed by the residual window, only one layer's
+    states exist in full precision at a time. A quantizer of None keeps that
+    side in full precision.
+    """
+
+    def __init__(self, key: Optional[KVQuantizer], value: Optional[KVQuantizer], block: int):
+        super().__init__()
+        self.key_quantizer = key
+        self.value_quantizer = value
+        self.block = block
+        self._reset_quantized()
+
+    def _reset_quantized(self):
+        self.quantized: List[Optional[torch.Tensor]] = [None, None]
+        self.scales: List[Optional[torch.Tensor]] = [None, None]
+
+    def _history(self, side: int, quantizer: Optional[KVQuantizer]) -> Optional[torch.Tensor]:
+        stored = self.quantized[side]
+        if stored is None or quantizer is None:
+            return stored
+        return quantizer.dequantize(stored, self.scales[side], self.dtype)
+
+    def _append(self, side: int, quantizer: Optional[KVQuantizer], states: torch.Tensor):
+        scales = None
+        if quantizer is not None:
+            states, scales = quantizer.quantize(states)
+        if self.quantized[side] is None:
+            self.quantized[side], self.scales[side] = states, scales
+            return
+        # Channel scales run over blocks of tokens, both are concatenated along the token axis
+        self.quantized[side] = torch.cat([self.quantized[side], states], dim=-2)
+        if scales is not None:
+            self.scales[side] = torch.cat([self.scales[side], scales], dim=-2)
+
+    def update(
+        self, key_states: torch.Tensor, value_states: torch.Tensor, *args, **kwargs
+    ) -> Tuple[torch.Tensor, torch.Tensor]:
+        if not self.is_initialized:
+            self.lazy_initialization(key_states, value_states)
+        self.keys = torch.cat([self.keys, key_states], dim=-2)
+        self.values = torch.cat([self.values, value_states], dim=-2)
+
+        key_history = self._history(0, self.key_quantizer)
+        value_history = self._history(1, self.value_quantizer)
+        keys = self.keys if key_history is None else torch.cat([key_history, self.keys], dim=-2)
+        values = self.values if value_history is None else torch.cat([value_history, self.values], dim=-2)
+
+        full_blocks = self.keys.shape[-2] // self.block * self.block
+        if full_blocks:
+            self._append(0, self.key_quantizer, self.keys[..., :full_blocks, :].contiguous())
+            self._append(1, self.value_quantizer, self.values[..., :full_blocks, :].contiguous())
+            self.keys = self.keys[..., full_blocks:, :]
+            self.values = self.values[..., full_blocks:, :]
+        return keys, values
+
+    def get_seq_length(self) -> int:
+        if not self.is_initialized:
+            return 0
+        stored = self.quantized[0].shape[-2] if self.quantized[0] is not None else 0
+        return stored + self.keys.shape[-2]
+
+    def reset(self) -> None:
+        super().reset()
+        self._reset_quantized()
+
+    def crop(self, tokens_to_remove: int) -> None:
+        raise NotImplementedError("A quantized KV cache cannot be cropped")
+
+    def _map(self, fn):
+        self.quantized = [fn(t) if t is not None else None for t in self.quantized]
+        self.scales = [fn(t) if t is not None else None for t in self.scales]
+        if self.is_initialized:
+            self.keys, self.values = fn(self.keys), fn(self.values)
+
+    def batch_repeat_interleave(self, repeats: int) -> None:
+        self._map(lambda t: t.repeat_interleave(repeats, dim=0))
+
+    def batch_select_indices(self, indices: torch.Tensor) -> None:
+        self._map(lambda t: t[indices, ...])
+
+    def reorder_cache(self, beam_idx: torch.LongTensor) -> None:
+        self._map(lambda t: t.index_select(0, beam_idx.to(t.device)))
+
+    def nbytes(self) -> int:
+        """Memory held by the layer, quantized states, scales and residual window"""
+        tensors = [*self.quantized, *self.scales]
+        if self.is_initialized:
+            tensors += [self.keys, self.values]
+        return sum(t.numel() * t.element_size() for t in tensors if t is not None)
+
+
+class QuantizedKVCache(Cache):
+    """A dynamic cache of QuantizedKVLayer, one per decoder layer"""
+
+    def __init__(
+        self,
+        num_layers: int,
+        key: Optional[KVQuantizer],
+        value: Optional[KVQuantizer],
+        block: int,
+    ):
+        super().__init__(layers=[QuantizedKVLayer(key, value, block) for _ in range(num_layers)])
+
+    def nbytes(self) -> int:
+        return sum(layer.nbytes() for layer in self.layers)
+
+
+def make_quantizers(
+    key_dtype: str, value_dtype: str, key_granularity: str, value_granularity: str, block: int
+) -> Tuple[Optional[KVQuantizer], Optional[KVQuantizer]]:
+    """Quantizers for keys and values from the configuration, None for a side left in full precision"""
+    key = KVQuantizer(key_dtype, key_granularity, block) if key_dtype != "none" else None
+    value = KVQuantizer(value_dtype, value_granularity, block) if value_dtype != "none" else None
+    return key, value
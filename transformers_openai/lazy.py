@@ -0,0 +1,18 @@
+import importlib
+import types
+
+
+class LazyModule(types.ModuleType):
+    """Stands in for a module that is only imported when one of its attributes is first used.
+
+    torch and transformers take seconds to import, so the engine refers to
+    them through these and the cost is paid when the model is loaded rather
+    than by everything that imports the package. After the first access the
+    real module's attributes are copied in and no longer go through
+    __getattr__.
+    """
+
+    def __getattr__(self, name: str):
+        module = importlib.import_module(self.__name__)
+        self.__dict__.update(module.__dict__)
+        return getattr(module, name)
@@ -0,0 +1,277 @@
+import bisect
+import threading
+from collections import deque
+from typing import Callable, Dict, List, Optional, Sequence
+
+# Observations are folded into the totals at scrape time, or by a recording
+# thread once this many are pending and nobody else is folding
+FOLD_THRESHOLD = 4096
+
+LATENCY_BUCKETS = (
+    0.001, 0.005, 0.01, 0.02, 0.04, 0.06, 0.08, 0.1, 0.25, 0.5, 0.75,
+    1.0, 2.5, 5.0, 7.5, 10.0, 20.0, 40.0, 80.0,
+)
+TOKEN_LATENCY_BUCKETS = (
+    0.001, 0.005, 0.01, 0.025, 0.05, 0.075, 0.1, 0.15, 0.2, 0.3, 0.4,
+    0.5, 0.75, 1.0, 2.5, 5.0, 10.0,
+)
+REQUEST_LATENCY_BUCKETS = (
+    0.1, 0.3, 0.5, 0.8, 1.0, 1.5, 2.0, 2.5, 5.0, 10.0, 15.0, 20.0, 30.0,
+    40.0, 50.0, 60.0, 120.0, 240.0, 480.0, 960.0,
+)
+LENGTH_BUCKETS = (
+    1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000, 20000,
+    50000, 100000,
+)
+
+
+def _format(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Pending:
+    """Append-only recording with the aggregation done later by a single folder.
+
+    `deque.append` is atomic, so recording never takes a lock and never
+    blocks on a scrape. Folding drains the deque under a lock that recording
+    threads only ever try without waiting.
+    """
+
+    def __init__(self):
+        self.pending = deque()
+        self.fold_lock = threading.Lock()
+
+    def _record(self, value: float):
+        self.pending.append(value)
+        if len(self.pending) > FOLD_THRESHOLD and self.fold_lock.acquire(blocking=False):
+            try:
+                self._drain()
+            finally:
+                self.fold_lock.release()
+
+    def _drain(self):
+        while True:
+            try:
+                value = self.pending.popleft()
+            except IndexError:
+                return
+            self._fold(value)
+
+    def _fold(self, value: float):
+        raise NotImplementedError
+
+    def collect(self):
+        with self.fold_lock:
+            self._drain()
+            return self._snapshot()
+
+    def _snapshot(self):
+        raise NotImplementedError
+
+
+class Histogram(_Pending):
+    def __init__(self, name: str, documentation: str, buckets: Sequence[float]):
+        super().__init__()
+        self.name = name
+        self.documentation = documentation
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        self._record(value)
+
+    def _fold(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+
+    def _snapshot(self):
+        return list(self.counts), self.sum
+
+    def render(self) -> List[str]:
+        counts, total = self.collect()
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float("inf"),), counts):
+            cumulative += count
+            lines.append(f'{self.name}_bucket{{le="{_format(bound)}"}} {cumulative}')
+        lines.append(f"{self.name}_sum {_format(total)}")
+        lines.append(f"{self.name}_count {cumulative}")
+        return lines
+
+
+class Counter(_Pending):
+    def __init__(self, name: str, documentation: str):
+        super().__init__()
+        self.name = name
+        self.documentation = documentation
+        self.value = 0
+
+    def inc(self, amount: float = 1):
+        self._record(amount)
+
+    def _fold(self, value: float):
+        self.value += value
+
+    def _snapshot(self):
+        return self.value
+
+    def render(self) -> List[str]:
+        return [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} counter",
+            f"{self.name} {_format(self.collect())}",
+        ]
+
+
+class Gauge:
+    """A value read from its owner at scrape time, so keeping it current costs nothing"""
+
+    def __init__(self, name: str, documentation: str, function: Callable[[], Optional[float]]):
+        self.name = name
+        self.documentation = documentation
+        self.function = function
+
+    def render(self) -> List[str]:
+        value = self.function()
+        if value is None:
+            return []
+        return [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} gauge",
+            f"{self.name} {_format(value)}",
+        ]
+
+
+class Metrics:
+    """Engine metrics in the Prometheus text exposition format"""
+
+    def __init__(self, prefix: str = "transformers_openai"):
+        self.prefix = prefix
+        self.metrics: Dict[str, object] = {}
+
+        self.queue_time = self.histogram(
+            "request_queue_time_seconds", "Time requests waited for a generation slot", LATENCY_BUCKETS
+        )
+        self.time_to_first_token = self.histogram(
+            "time_to_first_token_seconds", "Time from arrival to the first generated token", LATENCY_BUCKETS
+        )
+        self.time_per_output_token = self.histogram(
+            "time_per_output_token_seconds", "Decode time per generated token after the first", TOKEN_LATENCY_BUCKETS
+        )
+        self.e2e_latency = self.histogram(
+            "e2e_request_latency_seconds", "Time from arrival to the last generated token", REQUEST_LATENCY_BUCKETS
+        )
+        self.prompt_length = self.histogram(
+            "request_prompt_tokens", "Prompt length of each prompt in tokens", LENGTH_BUCKETS
+        )
+        self.generation_length = self.histogram(
+            "request_generation_tokens", "Generated length of each sequence in tokens", LENGTH_BUCKETS
+        )
+        # Per-phase breakdown of request latency, the queue phase is request_queue_time_seconds
+        self.phase_time = {
+            "templating": self.histogram(
+                "request_templating_time_seconds", "Time spent applying the chat template", LATENCY_BUCKETS
+            ),
+            "tokenization": self.histogram(
+                "request_tokenization_time_seconds", "Time spent tokenizing prompts", LATENCY_BUCKETS
+            ),
+            "prefill": self.histogram(
+                "request_prefill_time_seconds", "Time from the start of generation to the first decoding step", LATENCY_BUCKETS
+            ),
+            "decode": self.histogram(
+                "request_decode_time_seconds", "Time from the first to the last decoding step", REQUEST_LATENCY_BUCKETS
+            ),
+            "serialization": self.histogram(
+                "request_serialization_time_seconds", "Time spent building and encoding responses", LATENCY_BUCKETS
+            ),
+        }
+        self.requests = self.counter("requests_total", "Generation requests finished")
+        self.prompt_tokens = self.counter("prompt_tokens_total", "Prompt tokens processed")
+        self.generation_tokens = self.counter("generation_tokens_total", "Tokens generated")
+        self.session_cached_tokens = self.counter(
+            "session_cached_tokens_total", "Prompt tokens restored from session KV caches instead of prefilled"
+        )
+        self.context_dropped_messages = self.counter(
+            "context_dropped_messages_total", "Oldest chat messages dropped to fit prompts into the context window"
+        )
+        self.deadline_expired_waiting = self.counter(
+            "deadline_expired_waiting_total", "Requests dropped from the queue without running because their deadline passed"
+        )
+        self.deadline_aborted = self.counter(
+            "deadline_aborted_total", "Generations stopped because the request's deadline passed"
+        )
+        self.stream_stalls = self.counter(
+            "stream_stalls_total", "Streams paused because their client stopped reading and the buffer filled up"
+        )
+        self.stream_stall_aborts = self.counter(
+            "stream_stall_aborts_total", "Streams aborted because their client stalled longer than the stall timeout"
+        )
+
+    def _name(self, name: str) -> str:
+        return f"{self.prefix}_{name}" if self.prefix else name
+
+    def histogram(self, name: str, documentation: str, buckets: Sequence[float]) -> Histogram:
+        metric = self.metrics[name] = Histogram(self._name(name), documentation, buckets)
+        return metric
+
+    def counter(self, name: str, documentation: str) -> Counter:
+        metric = self.metrics[name] = Counter(self._name(name), documentation)
+        return metric
+
+    def gauge(self, name: str, documentation: str, function: Callable[[], Optional[float]]) -> Gauge:
+        metric = self.metrics[name] = Gauge(self._name(name), documentation, function)
+        return metric
+
+    def values(self) -> Dict[str, float]:
+        """Current counter and gauge values by unprefixed name"""
+        values = {}
+        for name, metric in list(self.metrics.items()):
+            if isinstance(metric, Counter):
+                values[name] = metric.collect()
+            elif isinstance(metric, Gauge):
+                value = metric.function()
+                if value is not None:
+                    values[name] = value
+        return values
+
+    def record_generation(
+        self,
+        arrival_time: float,
+        first_token_time: Optional[float],
+        end_time: float,
+        steps: int,
+        prompt_lengths: List[int],
+        generation_lengths: List[int],
+    ):
+        """Record one finished generate call; `steps` is the number of decoding steps it ran"""
+        if first_token_time is not None:
+            self.time_to_first_token.observe(first_token_time - arrival_time)
+            if steps > 1:
+                self.time_per_output_token.observe((end_time - first_token_time) / (steps - 1))
+        self.e2e_latency.observe(end_time - arrival_time)
+        for length in prompt_lengths:
+            self.prompt_length.observe(length)
+        for length in generation_lengths:
+            self.generation_length.observe(length)
+        self.requests.inc()
+        self.prompt_tokens.inc(sum(prompt_lengths))
+        self.generation_tokens.inc(sum(generation_lengths))
+
+    def record_phases(self, phases: Dict[str, float]):
+        """Record the phase durations of one finished request, see transformers_openai.timing"""
+        for phase, seconds in phases.items():
+            histogram = self.phase_time.get(phase)
+            if histogram is not None:
+                histogram.observe(seconds)
+
+    def render(self) -> str:
+        lines = []
+        for metric in list(self.metrics.values()):
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+metrics = Metrics()
@@ -1,34 +1,209 @@
-import torch
+import functools
+import gc
+import inspect
 import logging
-import re
-from transformers import (
-    AutoModelForCausalLM,
-    AutoTokenizer,
-    StaticCache,
-    TextIteratorStreamer,
-)
-from typing import Optional, List, Dict, Any, AsyncGenerator, Tuple
+import os
+import weakref
+from typing import Optional, List, Dict, Any, AsyncGenerator, Set, Tuple, Union
 import asyncio
 import time
-from threading import Thread
+from collections import OrderedDict
+from threading import Lock, Thread
 from transformers_openai.config import config
+from transformers_openai.guided import GuideCache
+from transformers_openai.lazy import LazyModule
+from transformers_openai.metrics import metrics
+from transformers_openai.timing import DeadlineExceeded, RequestTiming
+
+# Imported when the engine first uses them, so importing the server does not pay for torch
+torch = LazyModule("torch")
+transformers = LazyModule("transformers")
+generation = LazyModule("transformers_openai.generation")
+profiling = LazyModule("transformers_openai.profiling")
+tensor_parallel = LazyModule("transformers_openai.tensor_parallel")
+kv_quant = LazyModule("transformers_openai.kv_quant")
+sessions = LazyModule("transformers_openai.sessions")
+sink_cache = LazyModule("transformers_openai.sink_cache")
 
 
 logger = logging.getLogger(__name__)
 
 
+@functools.lru_cache(maxsize=1)
+def _byte_decoder() -> Dict[str, int]:
+    """Inverse of the GPT-2 bytes_to_unicode table byte-level BPE vocabularies are written in"""
+    printable = list(range(ord("!"), ord("~") + 1)) + list(range(ord("¡"), ord("¬") + 1)) + list(range(ord("®"), ord("ÿ") + 1))
+    chars = printable[:]
+    shift = 0
+    for byte in range(256):
+        if byte not in printable:
+            printable.append(byte)
+            chars.append(256 + shift)
+            shift += 1
+    return {chr(char): byte for byte, char in zip(printable, chars)}
+
+# Prompts whose token ids are kept, so counting a chat prompt's tokens and generating from it tokenize it once
+TOKEN_CACHE_SIZE = 64
+
+# Stages of model loading in order, the load progress is the share of them passed
+LOAD_STAGES = ("pending", "tokenizer", "model", "optimizations", "embedding_model", "warmup", "ready")
+
+
+def _in_flight(method):
+    """Count the calls of a ModelManager method as in flight from the call until they finish.
+
+    ServedModel.retire() waits for this count, so a request that reached the
+    previous manager is drained even while it is still tokenizing or waiting
+    for its thread. A stream method is counted until its stream ends.
+    """
+    if inspect.isasyncgenfunction(method):
+        @functools.wraps(method)
+        def stream(self, *args, **kwargs):
+            release = self.track_request()
+
+            async def counted():
+                inner = method(self, *args, **kwargs)
+                try:
+                    async for item in inner:
+                        yield item
+                finally:
+                    try:
+                        await inner.aclose()
+                    finally:
+                        release()
+
+            generator = counted()
+            # A stream dropped before it was iterated never runs its finally
+            weakref.finalize(generator, release)
+            return generator
+
+        return stream
+
+    @functools.wraps(method)
+    def call(self, *args, **kwargs):
+        release = self.track_request()
+        try:
+            return method(self, *args, **kwargs)
+        finally:
+            release()
+
+    return call
+
+
 class ModelManager:
-    def __init__(self):
+    def __init__(self, model_name: Optional[str] = None, revision: Optional[str] = None):
         self.model = None
         self.tokenizer = None
         self.processor = None
         self.device = None
+        # Whether the model is sharded over worker processes, see transformers_openai.tensor_parallel
+        self.tensor_parallel = config.args.tensor_parallel_size > 1
         self.static_cache = None
-        self.model_name = config.args.hf_model
+        # (key, value) quantizers of the KV cache, None when it is kept in the model dtype
+        self.kv_quantizers: Optional[Tuple[Optional["kv_quant.KVQuantizer"], Optional["kv_quant.KVQuantizer"]]] = None
+        # (sink tokens, window) of the attention sink cache, None when the whole context is kept
+        self.attention_window: Optional[Tuple[int, int]] = None
+        self.rotary_inv_freq = None
+        # KV caches kept between the turns of chat sessions, None when disabled
+        self.sessions: Optional["sessions.SessionStore"] = None
+        self.embedding_model = None
+        self.embedding_tokenizer = None
+        self.model_name = model_name or config.args.hf_model
+        self.revision = revision
+        # Identifies the loaded weights in cache keys, see _weights_version()
+        self.model_version = ""
+        self.embedding_model_name = config.args.embedding_model or self.model_name
+        self.token_texts: Dict[int, str] = {}
+        self.token_bytes: Dict[int, List[int]] = {}
+        # Whether raw tokens are byte-level BPE strings, decided once the tokenizer is loaded
+        self.byte_level: Optional[bool] = None
+        # Tokens a chat prompt and its max_tokens may take, None when it is not bounded
+        self.context_length: Optional[int] = None
+        self.token_ids: "OrderedDict[str, List[int]]" = OrderedDict()
+        self.token_ids_lock = Lock()
+        self.guides: Optional[GuideCache] = None
+        # Generations in flight as (rows, padded prompt length, step timer), for the KV cache gauges
+        self.running: Dict[int, Tuple[int, int, "generation.StepTimer"]] = {}
+        # Requests that called into this manager and have not finished, see _in_flight()
+        self.in_flight = 0
+        self.in_flight_lock = Lock()
+        # Streams paused on a client that stopped reading, by id of their streamer
+        self.stalled_streams: Set[int] = set()
+        self.kv_bytes_per_token = 0
+        self.device_memory: Optional[int] = None
+        self.profiler: Optional["profiling.RequestProfiler"] = None
+        # Load progress, see load_status()
+        self.load_stage = "pending"
+        self.load_error: Optional[str] = None
+        self.load_started: Optional[float] = None
+        self.load_seconds: Optional[float] = None
+        self.loaded = asyncio.Event()
+
+    @property
+    def ready(self) -> bool:
+        """Whether the weights are loaded and warmed up"""
+        return self.load_stage == "ready"
+
+    def load_status(self) -> Dict[str, Any]:
+        """Where model loading stands, for the health endpoints"""
+        if self.ready:
+            status = "ready"
+        elif self.load_error is not None:
+            status = "failed"
+        else:
+            status = "loading"
+        elapsed = self.load_seconds
+        if elapsed is None and self.load_started is not None:
+            elapsed = time.perf_counter() - self.load_started
+        return {
+            "status": status,
+            "stage": self.load_stage,
+            "progress": LOAD_STAGES.index(self.load_stage) / (len(LOAD_STAGES) - 1),
+            "elapsed_seconds": elapsed,
+            "error": self.load_error,
+        }
+
+    async def wait_ready(self, timeout: float) -> bool:
+        """Wait up to `timeout` seconds for the model, False if it is not ready by then or failed to load"""
+        if not self.ready and self.load_error is None:
+            try:
+                await asyncio.wait_for(self.loaded.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+        return self.ready
+
+    def _stage(self, stage: str):
+        self.load_stage = stage
+        logger.info(f"Model loading stage: {stage}")
 
     async def initialize(self):
-        """Initialize the model and tokenizer"""
+        """Load the tokenizer and model and warm them up.
+
+        The loading runs in a worker thread, so the event loop keeps serving
+        health checks meanwhile. Failures are recorded in load_status() and
+        raised.
+        """
+        self.load_started = time.perf_counter()
+        self.load_error = None
+        try:
+            await asyncio.to_thread(self._load)
+        except Exception as e:
+            self.load_seconds = time.perf_counter() - self.load_started
+            self.load_error = f"{type(e).__name__}: {e}"
+            logger.exception("Model initialization failed")
+            raise
+        finally:
+            self.loaded.set()
+
+    def _load(self):
         logger.info(f"Initializing model: {self.model_name}")
+        if self.profiler is None:
+            self.profiler = profiling.RequestProfiler(
+                every=config.args.torch_profiling_every if config.args.torch_profiling else 0,
+                output_dir=config.args.torch_profiling_dir,
+                warmup=config.args.torch_profiling_warmup,
+                active=config.args.torch_profiling_active,
+            )
 
         # Set device
         if config.args.accelerator_type == "cuda" and torch.cuda.is_available():
@@ -37,45 +212,93 @@ class ModelManager:
             self.device = torch.device("cpu")
 
         logger.info(f"Using device: {self.device}")
+        if self.tensor_parallel and torch.cuda.is_available():
+            raise ValueError(
+                "--tensor-parallel-size shards the model over CPU processes, hide the GPUs with CUDA_VISIBLE_DEVICES="
+            )
 
         # Load tokenizer
+        self._stage("tokenizer")
         logger.info("Loading tokenizer...")
-        self.tokenizer = AutoTokenizer.from_pretrained(
-            self.model_name, use_fast=config.args.tokenizer_use_fast
+        self.tokenizer = transformers.AutoTokenizer.from_pretrained(
+            self.model_name, revision=self.revision, use_fast=config.args.tokenizer_use_fast
         )
 
         if self.tokenizer.pad_token is None:
             self.tokenizer.pad_token = self.tokenizer.eos_token
 
+        # Decoder-only batches have to be padded on the left
+        self.tokenizer.padding_side = "left"
+        self.guides = GuideCache(self.tokenizer, config.args.guided_cache_size)
+
         # Load model
+        self._stage("model")
         logger.info("Loading model...")
         torch_dtype = getattr(torch, config.args.torch_dtype)
 
         model_kwargs = {
+            "revision": self.revision,
             "torch_dtype": torch_dtype,
             "device_map": "auto" if self.device.type == "cuda" else None,
         }
 
-        if config.args.model_type == "AutoModelForCausalLM":
-            self.model = AutoModelForCausalLM.from_pretrained(
-                self.model_name, **model_kwargs
+        if config.args.model_type != "AutoModelForCausalLM":
+            raise ValueError(f"Unsupported model type: {config.args.model_type}")
+        if self.tensor_parallel:
+            self.model = tensor_parallel.load_sharded(
+                self.model_name, self.revision, torch_dtype, config.args.tensor_parallel_size
             )
         else:
-            raise ValueError(f"Unsupported model type: {config.args.model_type}")
+            self.model = transformers.AutoModelForCausalLM.from_pretrained(
+                self.model_name, **model_kwargs
+            )
 
         # Move model to device if not using device_map
-        if model_kwargs["device_map"] is None:
+        if model_kwargs["device_map"] is None and not self.tensor_parallel:
             self.model = self.model.to(self.device)
+        self.model_version = self._weights_version()
+
+        if config.args.kv_cache_key_quant != "none" or config.args.kv_cache_value_quant != "none":
+            self.kv_quantizers = self._kv_quantizers()
+        self.attention_window = self._attention_window()
+        self.context_length = self._context_length()
+
+        # KV cache footprint of one token, keys and values over all layers
+        text_config = self.model.config.get_text_config()
+        num_heads = getattr(text_config, "num_attention_heads", 0) or 0
+        num_kv_heads = getattr(text_config, "num_key_value_heads", None) or num_heads
+        head_dim = getattr(text_config, "head_dim", None) or (
+            text_config.hidden_size // num_heads if num_heads else 0
+        )
+        element_size = torch.empty((), dtype=torch_dtype).element_size()
+        key_bytes = value_bytes = element_size
+        if self.kv_quantizers is not None:
+            key_bytes, value_bytes = (
+                quantizer.bytes_per_element(element_size, head_dim) if quantizer is not None else element_size
+                for quantizer in self.kv_quantizers
+            )
+        self.kv_bytes_per_token = (
+            getattr(text_config, "num_hidden_layers", 0) * num_kv_heads * head_dim * (key_bytes + value_bytes)
+        )
+        if self.device.type == "cuda":
+            self.device_memory = torch.cuda.get_device_properties(self.device).total_memory
 
         # Apply optimizations
-        if config.args.torch_compile:
+        self._stage("optimizations")
+        if self.tensor_parallel and (config.args.torch_compile or config.args.static_cache):
+            logger.warning("torch.compile and the static cache are not used with tensor parallelism")
+        elif config.args.torch_compile:
             logger.info("Applying torch.compile...")
             self.model = torch.compile(self.model, mode=config.args.torch_compile_mode)
 
-        # Initialize static cache if enabled
-        if config.args.static_cache:
+        # Initialize static cache if enabled, a quantized or attention sink KV cache grows dynamically instead
+        if config.args.static_cache and self.kv_quantizers is not None:
+            logger.warning("The static cache is not used with a quantized KV cache")
+        elif config.args.static_cache and self.attention_window is not None:
+            logger.warning("The static cache is not used with an attention window")
+        elif config.args.static_cache and not self.tensor_parallel:
             logger.info("Initializing static cache...")
-            self.static_cache = StaticCache(
+            self.static_cache = transformers.StaticCache(
                 config=self.model.config,
                 max_batch_size=config.args.continuous_batching_batch_size,
                 max_cache_len=config.args.static_cache_decoder_max_length,
@@ -83,9 +306,257 @@ class ModelManager:
                 dtype=torch_dtype,
             )
 
-        logger.info("Model initialization completed")
+        # Load a dedicated embedding model if configured, otherwise the chat model is pooled.
+        # A reload keeps the one that is already loaded.
+        if config.args.embedding_model and self.embedding_model is None:
+            self._stage("embedding_model")
+            logger.info(f"Loading embedding model: {config.args.embedding_model}")
+            self.embedding_tokenizer = transformers.AutoTokenizer.from_pretrained(
+                config.args.embedding_model, use_fast=config.args.tokenizer_use_fast
+            )
+            self.embedding_model = transformers.AutoModel.from_pretrained(
+                config.args.embedding_model, torch_dtype=torch_dtype
+            ).to(self.device)
+            self.embedding_model.eval()
+
+        if config.args.session_cache:
+            self.sessions = self._session_store()
+
+        if config.args.warmup_tokens > 0:
+            self._stage("warmup")
+            self._warmup(config.args.warmup_tokens)
+
+        self.load_seconds = time.perf_counter() - self.load_started
+        self._stage("ready")
+        logger.info(f"Model initialization completed in {self.load_seconds:.1f}s")
+
+    def _kv_quantizers(self):
+        """Quantizers for the configured KV cache, or None where the model cannot use it"""
+        if self.tensor_parallel:
+            logger.warning("The quantized KV cache is not used with tensor parallelism")
+            return None
+        layer_types = getattr(self.model.config.get_text_config(decoder=True), "layer_types", None) or []
+        if any(layer_type != "full_attention" for layer_type in layer_types):
+            logger.warning("The quantized KV cache needs a model with full attention in every layer, not used")
+            return None
+        logger.info(
+            f"Quantizing the KV cache: keys {config.args.kv_cache_key_quant} per {config.args.kv_cache_key_scale}, "
+            f"values {config.args.kv_cache_value_quant} per {config.args.kv_cache_value_scale}"
+        )
+        return kv_quant.make_quantizers(
+            config.args.kv_cache_key_quant,
+            config.args.kv_cache_value_quant,
+            config.args.kv_cache_key_scale,
+            config.args.kv_cache_value_scale,
+            config.args.kv_cache_residual_length,
+        )
+
+    def _attention_window(self) -> Optional[Tuple[int, int]]:
+        """(sink tokens, window) configured for this model, or None where the model cannot use it"""
+        sink_tokens, window = config.args.attention_sink_tokens, config.args.attention_window
+        for entry in filter(None, (e.strip() for e in config.args.attention_window_models.split(","))):
+            name, separator, setting = entry.rpartition("=")
+            if not separator:
+                raise ValueError(f"Invalid --attention-window-models entry {entry}, expected model=window[:sink_tokens]")
+            if name == self.model_name:
+                window_text, _, sinks_text = setting.partition(":")
+                window = int(window_text)
+                sink_tokens = int(sinks_text) if sinks_text else sink_tokens
+        if window <= 0:
+            return None
+        if self.tensor_parallel:
+            logger.warning("The attention window is not used with tensor parallelism")
+            return None
+        if self.kv_quantizers is not None:
+            logger.warning("The attention window is not used with a quantized KV cache")
+            return None
+        layer_types = getattr(self.model.config.get_text_config(decoder=True), "layer_types", None) or []
+        if any(layer_type != "full_attention" for layer_type in layer_types):
+            logger.warning("The attention window needs a model with full attention in every layer, not used")
+            return None
+        self.rotary_inv_freq = sink_cache.rotary_inv_freq(self.model)
+        if self.rotary_inv_freq is None:
+            # Sinks are moved by re-rotating them, which needs one fixed rotary embedding
+            logger.warning("The attention window needs a model with a fixed rotary position embedding, not used")
+            return None
+        logger.info(f"Attention window: {sink_tokens} sink tokens and the last {window} tokens are kept")
+        return sink_tokens, window
+
+    def _context_length(self) -> Optional[int]:
+        """The configured context window, or the model's, None when an attention window lifts the limit"""
+        if config.args.max_context_tokens > 0:
+            return config.args.max_context_tokens
+        if self.attention_window is not None:
+            return None
+        limits = [getattr(self.model.config.get_text_config(decoder=True), "max_position_embeddings", None)]
+        # Tokenizers without a limit report a huge placeholder
+        if self.tokenizer.model_max_length < 10 ** 9:
+            limits.append(self.tokenizer.model_max_length)
+        limits = [limit for limit in limits if limit]
+        return min(limits) if limits else None
+
+    def _session_store(self) -> Optional["sessions.SessionStore"]:
+        """Store for the KV caches of chat sessions, or None where generate() cannot continue from them"""
+        if self.tensor_parallel:
+            logger.warning("Session KV caches are not kept with tensor parallelism")
+            return None
+        if self.kv_quantizers is not None:
+            logger.warning("Session KV caches are not kept with a quantized KV cache")
+            return None
+        if self.attention_window is not None:
+            logger.warning("Session KV caches are not kept with an attention window")
+            return None
+        megabyte = 1024 * 1024
+        return sessions.SessionStore(
+            self.device,
+            device_bytes=config.args.session_device_mb * megabyte,
+            host_bytes=config.args.session_host_mb * megabyte,
+            disk_dir=config.args.session_disk_dir,
+            disk_bytes=config.args.session_disk_mb * megabyte,
+            host_after=config.args.session_host_after,
+            disk_after=config.args.session_disk_after,
+            ttl=config.args.session_ttl,
+        )
+
+    def _restore_session(self, session_id: Optional[str], input_ids) -> Tuple[Optional["transformers.Cache"], int]:
+        """The session's KV cache cut to the prefix it shares with a single prompt, and that prefix's length.
+
+        Returns an empty cache when there is nothing to reuse, so the turn
+        still leaves its KV behind, and (None, 0) without a session.
+        """
+        if self.sessions is None or session_id is None or input_ids.shape[0] != 1:
+            return None, 0
+        cache = transformers.DynamicCache()
+        restored = self.sessions.take(session_id)
+        if restored is None:
+            return cache, 0
+        token_ids, layers = restored
+        prompt_ids = input_ids[0].tolist()
+        # The last prompt token always goes through the model, its logits start the reply
+        limit = min(len(token_ids), len(prompt_ids) - 1)
+        shared = 0
+        while shared < limit and token_ids[shared] == prompt_ids[shared]:
+            shared += 1
+        if shared == 0:
+            return cache, 0
+        for layer_idx, (keys, values) in enumerate(layers):
+            cache.update(keys, values, layer_idx)
+        if shared < cache.get_seq_length():
+            # Past the shared prefix the prompt differs, e.g. a reply the template re-renders
+            cache.crop(shared - cache.get_seq_length())
+        return cache, shared
+
+    def _save_session(self, session_id: Optional[str], cache, sequences, row: int):
+        """Keep the KV of one generated sequence for the session's next turn"""
+        if cache is None or session_id is None or cache.get_seq_length() == 0:
+            return
+        if sequences.shape[0] > 1:
+            cache.batch_select_indices(torch.tensor([row], device=sequences.device))
+        # The last sampled token was never fed to the model, the next turn runs it with its new messages
+        length = cache.get_seq_length()
+        self.sessions.put(
+            session_id, sequences[row, :length].tolist(), [(layer.keys, layer.values) for layer in cache.layers]
+        )
+
+    def _new_cache(self) -> "transformers.Cache":
+        """An empty KV cache for one generate() call"""
+        if self.attention_window is not None:
+            return sink_cache.SinkCache(
+                self.model.config.get_text_config(decoder=True).num_hidden_layers,
+                *self.attention_window,
+                inv_freq=self.rotary_inv_freq,
+            )
+        if self.kv_quantizers is None:
+            return transformers.DynamicCache()
+        return kv_quant.QuantizedKVCache(
+            self.model.config.get_text_config(decoder=True).num_hidden_layers,
+            *self.kv_quantizers,
+            block=config.args.kv_cache_residual_length,
+        )
+
+    def _weights_version(self) -> str:
+        """The hub commit of the weights, or the newest file time of a local checkout"""
+        commit = getattr(self.model.config, "_commit_hash", None)
+        if commit:
+            return commit
+        if os.path.isdir(self.model_name):
+            return str(max(
+                (entry.stat().st_mtime_ns for entry in os.scandir(self.model_name) if entry.is_file()),
+                default=0,
+            ))
+        return self.revision or ""
+
+    def _warmup(self, max_tokens: int):
+        """A short greedy generation, so lazy initialization and compilation happen before traffic does"""
+        inputs = self._tokenize(["Hello"])
+        with torch.no_grad():
+            self.model.generate(
+                **self._prefill_inputs(inputs, 1),
+                max_new_tokens=max_tokens,
+                do_sample=False,
+                pad_token_id=self.tokenizer.pad_token_id,
+                eos_token_id=self.tokenizer.eos_token_id,
+            )
+
+    def format_chat_prompt(self, messages: List[Dict[str, str]], max_tokens: int = 0) -> str:
+        """Format chat messages into a prompt that leaves `max_tokens` of the context window for the reply.
 
-    def format_chat_prompt(self, messages: List[Dict[str, str]]) -> str:
+        A conversation that does not fit loses its oldest turns; the system
+        messages it starts with and its latest user turn are always kept, and
+        the history left over starts at a user message. Raises ValueError when
+        even those do not fit.
+        """
+        prompt = self._render_chat(messages)
+        if self.context_length is None:
+            return prompt
+        budget = self.context_length - max_tokens
+        prompt_tokens = self.count_tokens(prompt)
+        if prompt_tokens <= budget:
+            return prompt
+
+        head = 0
+        while head < len(messages) and messages[head]["role"] == "system":
+            head += 1
+        # Keeping messages[cut:] of the history, the last cut keeps only the latest user turn
+        cuts = [index for index in range(head + 1, len(messages)) if messages[index]["role"] == "user"]
+        low, high, best = 0, len(cuts) - 1, None
+        while low <= high:
+            middle = (low + high) // 2
+            candidate = self._render_chat(messages[:head] + messages[cuts[middle]:])
+            tokens = self.count_tokens(candidate)
+            if tokens <= budget:
+                best, high = (cuts[middle], candidate), middle - 1
+            else:
+                low, prompt_tokens = middle + 1, tokens
+        if best is None:
+            raise ValueError(
+                f"This model's maximum context length is {self.context_length} tokens. However, you requested "
+                f"{prompt_tokens + max_tokens} tokens ({prompt_tokens} in the messages, {max_tokens} in the "
+                f"completion). Please reduce the length of the messages or completion."
+            )
+        cut, prompt = best
+        logger.info(f"Dropped the {cut - head} oldest chat messages to fit the context window")
+        metrics.context_dropped_messages.inc(cut - head)
+        return prompt
+
+    def count_tokens(self, text: str) -> int:
+        return len(self._token_ids(text))
+
+    def _token_ids(self, text: str) -> List[int]:
+        """Token ids of a prompt, from the cache of recently counted prompts"""
+        with self.token_ids_lock:
+            ids = self.token_ids.get(text)
+            if ids is not None:
+                self.token_ids.move_to_end(text)
+                return ids
+        ids = self.tokenizer(text).input_ids
+        with self.token_ids_lock:
+            self.token_ids[text] = ids
+            if len(self.token_ids) > TOKEN_CACHE_SIZE:
+                self.token_ids.popitem(last=False)
+        return ids
+
+    def _render_chat(self, messages: List[Dict[str, str]]) -> str:
         """Format chat messages into a prompt"""
         if hasattr(self.tokenizer, "apply_chat_template"):
             try:
@@ -110,224 +581,781 @@ class ModelManager:
         prompt += "Assistant: "
         return prompt
 
+    def kv_cache_tokens(self) -> int:
+        """Token positions held in the KV caches of the generations currently running"""
+        # An attention sink cache stops growing at its sink tokens plus window
+        limit = sum(self.attention_window) if self.attention_window is not None else float("inf")
+        return sum(
+            rows * int(min(length + timer.steps, limit)) for rows, length, timer in list(self.running.values())
+        )
+
+    def kv_cache_bytes(self) -> int:
+        return self.kv_cache_tokens() * self.kv_bytes_per_token
+
+    def kv_cache_usage(self) -> Optional[float]:
+        """Share of the device memory taken by running KV caches, None when it is not known"""
+        if not self.device_memory:
+            return None
+        return self.kv_cache_bytes() / self.device_memory
+
+    def device_stats(self) -> Dict[str, Any]:
+        """Accelerator memory from the allocator, so nothing has to spawn nvidia-smi"""
+        if self.device is None or self.device.type != "cuda":
+            return {}
+        stats = {
+            "gpu_memory_allocated_bytes": torch.cuda.memory_allocated(self.device),
+            "gpu_memory_reserved_bytes": torch.cuda.memory_reserved(self.device),
+            "gpu_memory_total_bytes": self.device_memory,
+        }
+        try:
+            stats["gpu_utilization_percent"] = torch.cuda.utilization(self.device)
+        except Exception:
+            # Needs pynvml
+            pass
+        return stats
+
+    def _tokenize(self, prompt: Union[str, List[str]]):
+        """Tokenize one prompt or a left-padded batch of prompts, truncated unless an attention window bounds the cache"""
+        prompts = [prompt] if isinstance(prompt, str) else prompt
+        with self.token_ids_lock:
+            ids = self.token_ids.get(prompts[0]) if len(prompts) == 1 else None
+        if ids is not None and (self.attention_window is not None or len(ids) <= self.tokenizer.model_max_length):
+            # Counted when the chat prompt was fitted into the context window
+            input_ids = torch.tensor([ids], device=self.device)
+            return transformers.BatchEncoding(
+                {"input_ids": input_ids, "attention_mask": torch.ones_like(input_ids)}
+            )
+        return self.tokenizer(
+            prompt, return_tensors="pt", padding=True, truncation=self.attention_window is None
+        ).to(self.device)
+
+    def _shared_prefill(self, inputs, copies: int, cache=None) -> Dict[str, Any]:
+        """Prefill every prompt once and expand its KV cache to `copies` sequences.
+
+        Everything but the last prompt token goes through the model a single
+        time; generate() then only has to process that last token per copy.
+        Copies of the same prompt are adjacent in the expanded batch. A
+        `cache` restored from a session already holds the start of the prompt.
+        With an attention window the prompt goes through in chunks of the
+        window, so attention over a long prompt stays bounded as well.
+        """
+        input_ids = inputs.input_ids
+        attention_mask = inputs.attention_mask
+        cache = cache if cache is not None else self._new_cache()
+        cached = cache.get_seq_length()
+        chunk = input_ids.shape[1]
+        if self.attention_window is not None:
+            cache.set_padding(attention_mask)
+            chunk = self.attention_window[1]
+        # Same positions as generate() derives from a left-padded mask
+        position_ids = (attention_mask.long().cumsum(-1) - 1).clamp(min=0)
+        for start in range(cached, input_ids.shape[1] - 1, chunk):
+            end = min(start + chunk, input_ids.shape[1] - 1)
+            with torch.no_grad():
+                cache = self.model(
+                    input_ids=input_ids[:, start:end],
+                    attention_mask=attention_mask[:, :end],
+                    position_ids=position_ids[:, start:end],
+                    past_key_values=cache,
+                    use_cache=True,
+                ).past_key_values
+        cache.batch_repeat_interleave(copies)
+        return {
+            "input_ids": input_ids.repeat_interleave(copies, dim=0),
+            "attention_mask": attention_mask.repeat_interleave(copies, dim=0),
+            "past_key_values": cache,
+        }
+
+    def _completion_length(self, token_ids: List[int]) -> int:
+        """Number of generated tokens before EOS / padding"""
+        eos_token_id = self.tokenizer.eos_token_id
+        if eos_token_id in token_ids:
+            return token_ids.index(eos_token_id)
+        return len(token_ids)
+
+    def _finish_completion(
+        self,
+        token_ids: List[int],
+        max_tokens: int,
+        stop_sequences: Optional[List[str]] = None,
+        parse_reasoning: bool = True,
+    ) -> Dict[str, Any]:
+        """Decode one generated sequence and apply stop sequences and reasoning parsing"""
+        completion_tokens = self._completion_length(token_ids)
+        finish_reason = "stop" if completion_tokens < max_tokens else "length"
+        generated_text = self.tokenizer.decode(
+            token_ids[:completion_tokens], skip_special_tokens=True
+        )
+
+        # Handle stop sequences
+        if stop_sequences:
+            for stop_seq in stop_sequences:
+                if stop_seq in generated_text:
+                    generated_text = generated_text.split(stop_seq)[0]
+                    finish_reason = "stop"
+                    break
+
+        # Parse reasoning content if enabled
+        clean_text, reasoning_content = generated_text, None
+        if parse_reasoning:
+            clean_text, reasoning_content = self.parse_reasoning_content(generated_text)
+
+        return {
+            "text": clean_text,
+            "reasoning_content": reasoning_content,
+            "finish_reason": finish_reason,
+            "completion_tokens": completion_tokens,
+        }
+
+    def _token_text(self, token_id: int) -> str:
+        text = self.token_texts.get(token_id)
+        if text is None:
+            text = self.token_texts[token_id] = self.tokenizer.decode([token_id])
+        return text
+
+    def _is_byte_level(self) -> bool:
+        if self.byte_level is None:
+            backend = getattr(self.tokenizer, "backend_tokenizer", None)
+            decoder = getattr(backend, "decoder", None)
+            self.byte_level = hasattr(self.tokenizer, "byte_decoder") or "ByteLevel" in repr(decoder)
+        return self.byte_level
+
+    def _token_bytes(self, token_id: int) -> List[int]:
+        """The bytes of a token, a part of a multi-byte character included, which its decoded text loses"""
+        raw = self.token_bytes.get(token_id)
+        if raw is None:
+            token = self.tokenizer.convert_ids_to_tokens(token_id)
+            byte_decoder = _byte_decoder()
+            if token is not None and self._is_byte_level() and all(char in byte_decoder for char in token):
+                raw = [byte_decoder[char] for char in token]
+            else:
+                raw = list(self._token_text(token_id).encode("utf-8"))
+            self.token_bytes[token_id] = raw
+        return raw
+
+    def _logprob_entries(
+        self,
+        token_ids: List[int],
+        chosen: List[float],
+        top_logprobs: List[List[float]],
+        top_ids: List[List[int]],
+    ) -> List[Dict[str, Any]]:
+        """OpenAI style logprobs content for generated tokens"""
+        entries = []
+        for token_id, logprob, values, ids in zip(token_ids, chosen, top_logprobs, top_ids):
+            token = self._token_text(token_id)
+            entries.append({
+                "token": token,
+                "logprob": logprob,
+                "bytes": self._token_bytes(token_id),
+                "top_logprobs": [
+                    {
+                        "token": self._token_text(top_id),
+                        "logprob": value,
+                        "bytes": self._token_bytes(top_id),
+                    }
+                    for top_id, value in zip(ids, values)
+                ],
+            })
+        return entries
+
+    @staticmethod
+    def completion_logprobs(entries: List[Dict[str, Any]], text_offset: int = 0) -> Dict[str, Any]:
+        """Convert logprobs content into the legacy /v1/completions layout"""
+        offsets = []
+        for entry in entries:
+            offsets.append(text_offset)
+            text_offset += len(entry["token"])
+        return {
+            "tokens": [entry["token"] for entry in entries],
+            "token_logprobs": [entry["logprob"] for entry in entries],
+            "top_logprobs": [
+                {top["token"]: top["logprob"] for top in entry["top_logprobs"]}
+                for entry in entries
+            ],
+            "text_offset": offsets,
+        }
+
+    @staticmethod
+    def _sampler(
+        num_prompts: int,
+        copies: int,
+        temperature: Union[float, List[float]],
+        top_p: Union[float, List[float]],
+        top_k: Union[int, List[int]],
+        frequency_penalty: Union[float, List[float]],
+        presence_penalty: Union[float, List[float]],
+        seed: Union[Optional[int], List[Optional[int]]],
+    ) -> Optional["generation.BatchedSampler"]:
+        """Per-row sampler for a batch of `copies` rows per prompt, None if every row is plain greedy.
+
+        Each parameter is one value for all prompts or a list with one value
+        per prompt. Copies of a seeded prompt get consecutive seeds so they
+        still differ from each other.
+        """
+        def per_row(value):
+            values = value if isinstance(value, list) else [value] * num_prompts
+            return [v for v in values for _ in range(copies)]
+
+        temperatures = per_row(temperature)
+        frequency_penalties = per_row(frequency_penalty)
+        presence_penalties = per_row(presence_penalty)
+        if not any(t > 0 for t in temperatures) and not any(frequency_penalties) and not any(presence_penalties):
+            return None
+        seeds = seed if isinstance(seed, list) else [seed] * num_prompts
+        return generation.BatchedSampler(
+            temperature=temperatures,
+            top_p=per_row(top_p),
+            top_k=per_row(top_k),
+            frequency_penalty=frequency_penalties,
+            presence_penalty=presence_penalties,
+            seed=[None if s is None else s + j for s in seeds for j in range(copies)],
+        )
+
+    def _guided_processor(
+        self, num_prompts: int, copies: int, guide: Union[Optional[str], List[Optional[str]]]
+    ) -> Optional["generation.GuidedDecodingProcessor"]:
+        """Token masks for the rows of prompts whose output is constrained to a pattern"""
+        patterns = guide if isinstance(guide, list) else [guide] * num_prompts
+        if all(pattern is None for pattern in patterns):
+            return None
+        indices = [self.guides.get(pattern) if pattern is not None else None for pattern in patterns]
+        return generation.GuidedDecodingProcessor([index for index in indices for _ in range(copies)])
+
+    def track_request(self):
+        """Count one request as in flight, returns the function that releases it, safe to call twice"""
+        with self.in_flight_lock:
+            self.in_flight += 1
+        released = False
+
+        def release():
+            nonlocal released
+            with self.in_flight_lock:
+                if not released:
+                    released = True
+                    self.in_flight -= 1
+
+        return release
+
+    async def generate_text_async(self, **kwargs) -> Dict[str, Any]:
+        """generate_text() in a worker thread, in flight from the call rather than from when a thread picks it up"""
+        release = self.track_request()
+        try:
+            return await asyncio.to_thread(self.generate_text, **kwargs)
+        finally:
+            release()
+
+    @_in_flight
     def generate_text(
         self,
-        prompt: str,
+        prompt: Union[str, List[str]],
         max_tokens: int = 100,
-        temperature: float = 1.0,
-        top_p: float = 1.0,
+        temperature: Union[float, List[float]] = 1.0,
+        top_p: Union[float, List[float]] = 1.0,
         stop_sequences: Optional[List[str]] = None,
+        n: int = 1,
+        best_of: Optional[int] = None,
+        parse_reasoning: bool = True,
+        logprobs: bool = False,
+        top_logprobs: int = 0,
+        top_k: Union[int, List[int]] = 0,
+        frequency_penalty: Union[float, List[float]] = 0.0,
+        presence_penalty: Union[float, List[float]] = 0.0,
+        seed: Union[Optional[int], List[Optional[int]]] = None,
+        guide: Union[Optional[str], List[Optional[str]]] = None,
+        timing: Optional[RequestTiming] = None,
+        session_id: Optional[str] = None,
     ) -> Dict[str, Any]:
-        """Generate text completion"""
+        """Generate `n` text completions per prompt, keeping the best `n` of `best_of` samples.
+
+        A list of prompts is padded and generated as one batch; the choices
+        of prompt i are returned at indices i * n to i * n + n - 1. Sampling
+        parameters may be given per prompt, so prompts with different
+        settings still share the batch. With `logprobs` every choice carries
+        the logprob of each generated token and its `top_logprobs` most
+        likely alternatives. `guide` constrains the output to a regular
+        expression (see transformers_openai.guided). `timing` starts at the
+        arrival of the request and receives the tokenization, prefill and
+        decode times, and its deadline aborts the generation with
+        DeadlineExceeded. With `session_id` a single prompt continues from the
+        KV cache the session's previous turn left, and leaves its own for the next.
+        """
         start_time = time.time()
+        timing = timing or RequestTiming()
+        arrival_time = timing.start
+        best_of = max(best_of or n, n)
+        prompts = [prompt] if isinstance(prompt, str) else prompt
 
         # Tokenize input
-        inputs = self.tokenizer(
-            prompt, return_tensors="pt", padding=True, truncation=True
-        ).to(self.device)
+        with timing.phase("tokenization"):
+            inputs = self._tokenize(prompts)
 
         input_length = inputs.input_ids.shape[1]
+        prompt_tokens = int(inputs.attention_mask.sum())
 
-        # Generation parameters
+        # Generation parameters, sampling is done by BatchedSampler so generate() stays greedy
         generation_kwargs = {
             "max_new_tokens": max_tokens,
-            "temperature": temperature,
-            "top_p": top_p,
-            "do_sample": temperature > 0,
+            "do_sample": False,
             "pad_token_id": self.tokenizer.pad_token_id,
             "eos_token_id": self.tokenizer.eos_token_id,
         }
 
-        if self.static_cache:
-            generation_kwargs["past_key_values"] = self.static_cache
+        logprob_processor = None
+        if best_of > n or logprobs:
+            logprob_processor = generation.LogprobsProcessor(top_logprobs if logprobs else 0)
+        guided_processor = self._guided_processor(len(prompts), best_of, guide)
+        sampler = self._sampler(
+            len(prompts), best_of, temperature, top_p, top_k, frequency_penalty, presence_penalty, seed
+        )
+        timer = generation.StepTimer()
+        # Logprobs are recorded from the raw logits, then disallowed tokens are masked before sampling
+        processors = [p for p in (timer, logprob_processor, guided_processor, sampler) if p is not None]
+        generation_kwargs["logits_processor"] = transformers.LogitsProcessorList(processors)
+        deadline = self._deadline_criteria(timing)
+        if deadline is not None:
+            generation_kwargs["stopping_criteria"] = transformers.StoppingCriteriaList([deadline])
 
         # Generate
-        with torch.no_grad():
-            if config.args.torch_profiling:
-                with torch.autograd.profiler.profile() as prof:
-                    outputs = self.model.generate(**inputs, **generation_kwargs)
-                logger.info(f"Generation profiling: {prof.key_averages()}")
-            else:
-                outputs = self.model.generate(**inputs, **generation_kwargs)
+        self.running[id(timer)] = (len(prompts) * best_of, input_length, timer)
+        generate_start = time.perf_counter()
+        try:
+            with torch.no_grad(), self.profiler.profile("generate") as profiler_steps:
+                if profiler_steps is not None:
+                    generation_kwargs["logits_processor"].insert(0, profiler_steps)
+                session_cache, cached_tokens = self._restore_session(session_id, inputs.input_ids)
+                # Prefill each prompt once and decode all samples as one batch
+                generation_kwargs.update(self._prefill_inputs(inputs, best_of, session_cache))
+                outputs = self.model.generate(**generation_kwargs)
+        finally:
+            del self.running[id(timer)]
+        if deadline is not None and deadline.expired:
+            metrics.deadline_aborted.inc()
+            raise DeadlineExceeded("Request deadline exceeded during generation")
 
+        end_time = time.perf_counter()
         total_time = time.time() - start_time
+        first_step_time = timer.first_step_time or end_time
+        timing.set("prefill", first_step_time - generate_start)
+        timing.set("decode", end_time - first_step_time)
 
-        # Decode output
-        generated_ids = outputs[0][input_length:]
-        generated_text = self.tokenizer.decode(generated_ids, skip_special_tokens=True)
+        generated_ids = outputs[:, input_length:]
+        rows = [i * best_of + j for i in range(len(prompts)) for j in range(n)]
+        if logprob_processor is not None:
+            chosen, top_values, top_ids = logprob_processor.finalize(generated_ids)
+        if best_of > n:
+            # Keep the samples of each prompt with the highest log probability per token
+            valid = generation.completion_mask(generated_ids, self.tokenizer.eos_token_id)
+            logprob_sum = torch.where(valid, chosen, torch.zeros_like(chosen)).sum(dim=1)
+            mean_logprobs = (logprob_sum / valid.sum(dim=1).clamp(min=1)).view(len(prompts), best_of)
+            best = torch.argsort(mean_logprobs, dim=1, descending=True)[:, :n]
+            rows = [i * best_of + j for i, group in enumerate(best.tolist()) for j in group]
+        if logprobs:
+            # Only the returned rows are copied to the host
+            selected = torch.tensor(rows, device=chosen.device)
+            chosen_rows = chosen[selected].tolist()
+            top_value_rows = top_values[selected].tolist()
+            top_id_rows = top_ids[selected].tolist()
 
-        # Handle stop sequences
-        if stop_sequences:
-            for stop_seq in stop_sequences:
-                if stop_seq in generated_text:
-                    generated_text = generated_text.split(stop_seq)[0]
-                    break
+        if session_cache is not None:
+            self._save_session(session_id, generation_kwargs["past_key_values"], outputs, rows[0])
+            metrics.session_cached_tokens.inc(cached_tokens)
 
-        # Parse reasoning content if enabled
-        clean_text, reasoning_content = self.parse_reasoning_content(generated_text)
+        generated_rows = generated_ids.tolist()
+        choices = []
+        for index, row in enumerate(rows):
+            choice = self._finish_completion(
+                generated_rows[row], max_tokens, stop_sequences, parse_reasoning
+            )
+            choice["index"] = index
+            choice["logprobs"] = None
+            if logprobs:
+                length = choice["completion_tokens"]
+                choice["logprobs"] = self._logprob_entries(
+                    generated_rows[row][:length],
+                    chosen_rows[index][:length],
+                    top_value_rows[index][:length],
+                    top_id_rows[index][:length],
+                )
+            choices.append(choice)
 
-        completion_tokens = len(generated_ids)
+        # Every sampled sequence was computed, including the discarded best_of ones
+        completion_lengths = [self._completion_length(ids) for ids in generated_rows]
+        completion_tokens = sum(completion_lengths)
         tokens_per_second = completion_tokens / total_time if total_time > 0 else 0
+        prompt_token_counts = inputs.attention_mask.sum(dim=1).tolist()
+        metrics.record_generation(
+            arrival_time, timer.first_step_time, end_time, generated_ids.shape[1],
+            prompt_token_counts, completion_lengths,
+        )
 
         result = {
-            "text": clean_text,
-            "reasoning_content": reasoning_content,
-            "prompt_tokens": input_length,
+            "text": choices[0]["text"],
+            "reasoning_content": choices[0]["reasoning_content"],
+            "choices": choices,
+            "prompt_token_counts": prompt_token_counts,
+            "prompt_tokens": prompt_tokens,
+            "cached_tokens": cached_tokens,
             "completion_tokens": completion_tokens,
-            "total_tokens": input_length + completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens,
             "total_time": total_time,
             "tokens_per_second": tokens_per_second,
         }
 
         return result
 
+    @staticmethod
+    def _deadline_criteria(timing: RequestTiming) -> Optional["generation.DeadlineCriteria"]:
+        """Stopping criteria that abort generation at the request's deadline, raising if it already passed"""
+        if timing.deadline is None:
+            return None
+        if timing.expired:
+            metrics.deadline_expired_waiting.inc()
+            raise DeadlineExceeded("Request deadline exceeded before generation started")
+        return generation.DeadlineCriteria(timing.deadline)
+
+    def _prefill_inputs(self, inputs, copies: int, cache=None) -> Dict[str, Any]:
+        """generate() inputs for `copies` sequences per prompt, sharing the prompt prefill.
+
+        `cache` is a session's cache, which generate() continues from instead
+        of prefilling the tokens it already holds.
+        """
+        if copies > 1 and self.tensor_parallel:
+            # The worker ranks cannot be handed a prefilled cache, every copy prefills on its own
+            return {k: v.repeat_interleave(copies, dim=0) for k, v in inputs.items()}
+        if copies > 1 or self.attention_window is not None:
+            return self._shared_prefill(inputs, copies, cache)
+        if cache is not None:
+            return {**inputs, "past_key_values": cache}
+        if self.static_cache and inputs.input_ids.shape[0] == 1:
+            return {**inputs, "past_key_values": self.static_cache}
+        if self.kv_quantizers is not None:
+            return {**inputs, "past_key_values": self._new_cache()}
+        return dict(inputs)
+
+    def _generate_for_streamer(
+        self, inputs, copies: int, session_id: Optional[str] = None, session_cache=None, slot=None,
+        **generation_kwargs
+    ):
+        """Run generate() in a worker thread, making sure the streamer is always ended.
+
+        `slot` is handed back as soon as generate() returns, the client may
+        still be reading what the streamer buffered.
+        """
+        streamer = generation_kwargs["streamer"]
+        try:
+            with torch.no_grad(), self.profiler.profile("stream") as profiler_steps:
+                if profiler_steps is not None:
+                    generation_kwargs["logits_processor"].insert(0, profiler_steps)
+                generation_kwargs.update(self._prefill_inputs(inputs, copies, session_cache))
+                outputs = self.model.generate(**generation_kwargs)
+            if session_cache is not None:
+                self._save_session(session_id, generation_kwargs["past_key_values"], outputs, 0)
+        except Exception as e:
+            if isinstance(e, generation.StreamStalled):
+                metrics.stream_stall_aborts.inc()
+            streamer.error = e
+        finally:
+            self.stalled_streams.discard(id(streamer))
+            if slot is not None:
+                slot.release_soon()
+            streamer.end()
+
+    def _stream_stall_callbacks(self, streamer_id: int, slot=None):
+        """Callbacks of a TokenStreamer that pause a stream on a stalled client, freeing its scheduler slot"""
+        def on_stall():
+            metrics.stream_stalls.inc()
+            self.stalled_streams.add(streamer_id)
+            if slot is not None:
+                slot.release_soon()
+
+        def on_resume():
+            self.stalled_streams.discard(streamer_id)
+            if slot is not None:
+                slot.reacquire()
+
+        return on_stall, on_resume
+
+    @_in_flight
     async def generate_text_stream(
         self,
-        prompt: str,
+        prompt: Union[str, List[str]],
         max_tokens: int = 100,
-        temperature: float = 1.0,
-        top_p: float = 1.0,
+        temperature: Union[float, List[float]] = 1.0,
+        top_p: Union[float, List[float]] = 1.0,
         stop_sequences: Optional[List[str]] = None,
+        n: int = 1,
+        parse_reasoning: bool = True,
+        logprobs: bool = False,
+        top_logprobs: int = 0,
+        top_k: Union[int, List[int]] = 0,
+        frequency_penalty: Union[float, List[float]] = 0.0,
+        presence_penalty: Union[float, List[float]] = 0.0,
+        seed: Union[Optional[int], List[Optional[int]]] = None,
+        guide: Union[Optional[str], List[Optional[str]]] = None,
+        timing: Optional[RequestTiming] = None,
+        session_id: Optional[str] = None,
+        slot=None,
     ) -> AsyncGenerator[Dict[str, Any], None]:
-        """Generate text completion with streaming using TextIteratorStreamer"""
+        """Generate text completion with streaming, interleaving the choices by index.
+
+        Indices follow the same layout as generate_text: choice j of prompt i
+        is index i * n + j. `session_id` works as in generate_text.
+
+        Once --stream-buffer-tokens steps wait for a consumer that stopped
+        reading, the generation pauses and hands back `slot`, a
+        scheduler.StreamSlot, until the consumer catches up; after
+        --stream-stall-timeout seconds it is aborted.
+        """
         start_time = time.time()
+        timing = timing or RequestTiming()
+        arrival_time = timing.start
         first_token_time = None
+        prompts = [prompt] if isinstance(prompt, str) else prompt
 
         # Tokenize input
-        inputs = self.tokenizer(
-            prompt, return_tensors="pt", padding=True, truncation=True
-        ).to(self.device)
+        with timing.phase("tokenization"):
+            inputs = self._tokenize(prompts)
 
-        input_length = inputs.input_ids.shape[1]
+        input_length = int(inputs.attention_mask.sum())
+        num_choices = len(prompts) * n
 
-        # Create streamer - add special tokens to be able to filter them
-        streamer = TextIteratorStreamer(
-            self.tokenizer,
+        # Token level streamer, text is decoded per choice below
+        logprob_processor = generation.LogprobsProcessor(top_logprobs) if logprobs else None
+        streamer = generation.TokenStreamer(
             skip_prompt=True,
-            decode_kwargs={
-                "skip_special_tokens": False
-            },  # Keep special tokens for filtering
+            logprobs=logprob_processor,
+            max_buffer=config.args.stream_buffer_tokens,
+            stall_timeout=config.args.stream_stall_timeout,
         )
+        streamer.on_stall, streamer.on_resume = self._stream_stall_callbacks(id(streamer), slot)
+        stop_criteria = generation.StopRowsCriteria(num_choices)
 
-        # Generation parameters
+        # Generation parameters, sampling is done by BatchedSampler so generate() stays greedy
         generation_kwargs = {
-            **inputs,
             "max_new_tokens": max_tokens,
-            "temperature": temperature,
-            "top_p": top_p,
-            "do_sample": temperature > 0,
+            "do_sample": False,
             "pad_token_id": self.tokenizer.pad_token_id,
             "eos_token_id": self.tokenizer.eos_token_id,
             "streamer": streamer,
+            "stopping_criteria": transformers.StoppingCriteriaList([stop_criteria]),
         }
+        # Compiling a new guide walks the whole vocabulary, keep it off the event loop
+        guided_processor = await asyncio.to_thread(self._guided_processor, len(prompts), n, guide)
+        sampler = self._sampler(
+            len(prompts), n, temperature, top_p, top_k, frequency_penalty, presence_penalty, seed
+        )
+        timer = generation.StepTimer()
+        processors = [p for p in (timer, logprob_processor, guided_processor, sampler) if p is not None]
+        generation_kwargs["logits_processor"] = transformers.LogitsProcessorList(processors)
+        deadline = self._deadline_criteria(timing)
+        if deadline is not None:
+            generation_kwargs["stopping_criteria"].append(deadline)
 
-        if self.static_cache:
-            generation_kwargs["past_key_values"] = self.static_cache
-
-        # Start generation in a separate thread
-        generation_thread = Thread(target=self.model.generate, kwargs=generation_kwargs)
+        # Start generation in a separate thread, the shared prefill of the n choices included
+        self.running[id(timer)] = (num_choices, inputs.input_ids.shape[1], timer)
+        generate_start = time.perf_counter()
+        try:
+            # A session demoted to disk is read back off the event loop
+            session_cache, cached_tokens = await asyncio.to_thread(
+                self._restore_session, session_id, inputs.input_ids
+            )
+        except BaseException:
+            self.running.pop(id(timer), None)
+            raise
+        metrics.session_cached_tokens.inc(cached_tokens)
+        generation_thread = Thread(
+            target=self._generate_for_streamer,
+            args=(inputs, n, session_id, session_cache, slot),
+            kwargs=generation_kwargs,
+        )
         generation_thread.start()
 
         # Stream tokens as they become available
-        generated_text = ""
+        detokenizers = [generation.IncrementalDetokenizer(self.tokenizer) for _ in range(num_choices)]
+        think_tags = [generation.ThinkTags() for _ in range(num_choices)]
+        generated_texts = [""] * num_choices
+        finished = [False] * num_choices
+        # Logprobs of tokens whose text has not been sent yet
+        pending_logprobs: List[List[Dict[str, Any]]] = [[] for _ in range(num_choices)]
         completion_tokens = 0
-        accumulated_reasoning = ""
-        in_thinking_mode = False
-        thinking_buffer = ""
+        completion_lengths = [0] * num_choices
+        first_step_time = last_step_time = None
+
+        def make_chunk(index, text, reasoning_delta, finish_reason):
+            chunk_logprobs = pending_logprobs[index] if logprobs else None
+            pending_logprobs[index] = []
+            current_time = time.time()
+            time_to_first_token = (
+                first_token_time - start_time if first_token_time else None
+            )
+            total_time = current_time - start_time
+            tokens_per_second = (
+                completion_tokens / total_time if total_time > 0 else 0
+            )
+            return {
+                "index": index,
+                "text": text,
+                "reasoning_content": reasoning_delta,
+                "finish_reason": finish_reason,
+                "prompt_tokens": input_length,
+                "cached_tokens": cached_tokens,
+                "completion_tokens": completion_tokens,
+                "total_tokens": input_length + completion_tokens,
+                "time_to_first_token": time_to_first_token,
+                "total_time": total_time,
+                "tokens_per_second": tokens_per_second,
+                "logprobs": chunk_logprobs,
+            }
 
         try:
-            for new_text in streamer:
+            async for step, step_logprobs in streamer:
+                last_step_time = time.perf_counter()
                 if first_token_time is None:
                     first_token_time = time.time()
+                    first_step_time = last_step_time
+                    timing.set("prefill", first_step_time - generate_start)
+                timing.set("decode", last_step_time - first_step_time)
 
-                # Filter out unwanted tokens like <|im_end|>
-                if "<|im_end|>" in new_text:
-                    new_text = new_text.replace("<|im_end|>", "")
+                for index, token_id in enumerate(step):
+                    if finished[index]:
+                        continue
 
-                # Skip empty tokens
-                if not new_text:
-                    continue
+                    finish_reason = None
+                    if token_id == self.tokenizer.eos_token_id:
+                        finish_reason = "stop"
+                        new_text = detokenizers[index].flush()
+                    else:
+                        completion_tokens += 1
+                        completion_lengths[index] += 1
+                        new_text = detokenizers[index].push(token_id)
+                        if step_logprobs is not None:
+                            chosen, top_values, top_ids = step_logprobs
+                            pending_logprobs[index].extend(self._logprob_entries(
+                                [token_id], [chosen[index]], [top_values[index]], [top_ids[index]]
+                            ))
 
-                generated_text += new_text
-                completion_tokens += (
-                    1  # Handle DeepSeek R1 reasoning parsing for streaming
-                )
-                chunk_text = new_text
-                reasoning_delta = None
-
-                if config.args.reasoning_parser == "deepseek_r1":
-                    chunk_text, reasoning_delta = self._handle_streaming_reasoning(
-                        new_text, generated_text
-                    )
-
-                # Check for stop sequences
-                finish_reason = None
-                if stop_sequences:
-                    for stop_seq in stop_sequences:
-                        if stop_seq in generated_text:
-                            # Truncate at stop sequence
-                            truncate_pos = generated_text.find(stop_seq)
-                            generated_text = generated_text[:truncate_pos]
+                    # Filter out unwanted tokens like <|im_end|>
+                    if "<|im_end|>" in new_text:
+                        new_text = new_text.replace("<|im_end|>", "")
+
+                    # Skip empty tokens
+                    if not new_text and finish_reason is None:
+                        continue
+
+                    generated_texts[index] += new_text
+                    chunk_text = new_text
+                    reasoning_delta = None
+
+                    # Handle DeepSeek R1 reasoning parsing for streaming
+                    if parse_reasoning and config.args.reasoning_parser == "deepseek_r1":
+                        chunk_text, reasoning_delta = self._handle_streaming_reasoning(
+                            new_text, generated_texts[index], think_tags[index]
+                        )
+
+                    # Check for stop sequences, only where the new text could have completed one
+                    if stop_sequences:
+                        truncate_pos = generation.find_stop(generated_texts[index], stop_sequences, len(new_text))
+                        if truncate_pos >= 0:
+                            sent = len(generated_texts[index]) - len(new_text)
+                            generated_texts[index] = generated_texts[index][:truncate_pos]
+                            # Plain content is cut before the part of the stop sequence in this delta
+                            if chunk_text == new_text:
+                                chunk_text = chunk_text[:max(0, truncate_pos - sent)]
                             finish_reason = "stop"
-                            break
 
-                # Determine if this is the last chunk
-                if not generation_thread.is_alive() and finish_reason is None:
-                    finish_reason = "stop"
+                    if finish_reason:
+                        finished[index] = True
+                        stop_criteria.stop(index)
 
-                # Only yield if we have content to send or it's the final chunk
-                if chunk_text or reasoning_delta or finish_reason:
-                    current_time = time.time()
-                    time_to_first_token = (
-                        first_token_time - start_time if first_token_time else None
-                    )
-                    total_time = current_time - start_time
-                    tokens_per_second = (
-                        completion_tokens / total_time if total_time > 0 else 0
-                    )
-
-                    yield {
-                        "text": chunk_text,
-                        "reasoning_content": reasoning_delta,
-                        "finish_reason": finish_reason,
-                        "prompt_tokens": input_length,
-                        "completion_tokens": completion_tokens,
-                        "total_tokens": input_length + completion_tokens,
-                        "time_to_first_token": time_to_first_token,
-                        "total_time": total_time,
-                        "tokens_per_second": tokens_per_second,
-                    }
+                    # Only yield if we have content to send or it's the final chunk
+                    if chunk_text or reasoning_delta or finish_reason:
+                        yield make_chunk(index, chunk_text, reasoning_delta, finish_reason)
 
-                # Break if we hit a stop sequence
-                if finish_reason == "stop":
+                if all(finished):
                     break
 
-                # Small sleep to allow other coroutines to run
-                await asyncio.sleep(config.args.continuous_batching_microsleep)
+            if deadline is not None and deadline.expired and not all(finished):
+                metrics.deadline_aborted.inc()
+                raise DeadlineExceeded("Request deadline exceeded during generation")
+            # Choices still open at this point ran out of max_tokens
+            for index in range(num_choices):
+                if not finished[index]:
+                    finished[index] = True
+                    yield make_chunk(index, detokenizers[index].flush(), None, "length")
 
         except Exception as e:
             logger.error(f"Error in streaming generation: {e}")
             raise
         finally:
-            # Ensure the generation thread completes
+            # Stop any rows still running and let the generation thread finish
+            stop_criteria.stop()
+            streamer.close()
+            if slot is not None:
+                slot.close()
             if generation_thread.is_alive():
                 generation_thread.join(timeout=1.0)
+            self.running.pop(id(timer), None)
+            # Streams the client dropped early are not counted as finished requests
+            if all(finished):
+                metrics.record_generation(
+                    arrival_time, timer.first_step_time, last_step_time or time.perf_counter(), timer.steps,
+                    inputs.attention_mask.sum(dim=1).tolist(), completion_lengths,
+                )
+
+    @_in_flight
+    def embed(self, texts: List[str]) -> Tuple[List[List[float]], List[int]]:
+        """Pool the last hidden states of a batch of texts into L2-normalized embeddings"""
+        if self.embedding_model is not None:
+            model, tokenizer = self.embedding_model, self.embedding_tokenizer
+        else:
+            # The base model skips the LM head, only hidden states are needed
+            model, tokenizer = self.model.base_model, self.tokenizer
+
+        inputs = tokenizer(
+            texts, return_tensors="pt", padding=True, truncation=True
+        ).to(self.device)
+        attention_mask = inputs["attention_mask"]
+
+        model_inputs = dict(inputs)
+        if self.embedding_model is None:
+            # Positions that ignore the left padding
+            model_inputs["position_ids"] = (attention_mask.long().cumsum(-1) - 1).clamp(min=0)
+
+        with torch.no_grad():
+            hidden_states = model(**model_inputs).last_hidden_state.float()
+
+        if config.args.embedding_pooling == "last":
+            # Last non-padding position, works for either padding side
+            last = attention_mask.shape[1] - 1 - attention_mask.flip(1).argmax(dim=1)
+            pooled = hidden_states[torch.arange(hidden_states.shape[0]), last]
+        else:
+            mask = attention_mask.unsqueeze(-1).to(hidden_states.dtype)
+            pooled = (hidden_states * mask).sum(dim=1) / mask.sum(dim=1).clamp(min=1)
+
+        pooled = torch.nn.functional.normalize(pooled, p=2, dim=-1)
+        return pooled.cpu().tolist(), attention_mask.sum(dim=1).tolist()
 
     def _handle_streaming_reasoning(
-        self, new_text: str, full_text: str
+        self, new_text: str, full_text: str, tags: "generation.ThinkTags"
     ) -> Tuple[str, Optional[str]]:
-        """Handle reasoning content parsing during streaming"""
+        """Handle reasoning content parsing during streaming.
+
+        `tags` carries the tag positions found in earlier calls for the same
+        choice, so each call only looks at the newly added text.
+        """
         # If reasoning parser is not enabled, just return the new text as-is
         if config.args.reasoning_parser != "deepseek_r1":
             return new_text, None
 
+        just_closed = tags.update(full_text)
         # Check if we're currently in a thinking block
-        if "<think>" in full_text and "</think>" not in full_text:
+        if tags.open >= 0 and tags.close < 0:
             # We're currently in a thinking block, don't output the content
             return "", None
-        elif "<think>" in full_text and "</think>" in full_text:
+        elif tags.open >= 0 and tags.close >= 0:
             # Complete thinking block found
-            if "</think>" in new_text:
+            if just_closed:
                 # This token completes the thinking block, extract reasoning
                 clean_text, reasoning = self._parse_deepseek_r1_reasoning(full_text)
                 return "", reasoning
@@ -349,18 +1377,125 @@ class ModelManager:
 
     def _parse_deepseek_r1_reasoning(self, text: str) -> Tuple[str, Optional[str]]:
         """Parse DeepSeek R1 reasoning content from <think> tags"""
-        # More flexible pattern to match <think>...</think> with optional whitespace
-        pattern = r"<think>\s*(.*?)\s*</think>\s*"
-        match = re.search(pattern, text, re.DOTALL)
+        open_tag, close_tag = generation.ThinkTags.OPEN, generation.ThinkTags.CLOSE
+        start = text.find(open_tag)
+        end = text.find(close_tag, start + len(open_tag)) if start >= 0 else -1
+        if end < 0:
+            return text, None
 
-        if match:
-            reasoning_content = match.group(1).strip()
-            # Remove the thinking section from the main content
-            clean_content = re.sub(pattern, "", text, flags=re.DOTALL).strip()
-            return clean_content, reasoning_content
+        # The first block is the reasoning, surrounding whitespace is dropped
+        reasoning_content = text[start + len(open_tag):end].strip()
+        # Remove every thinking section from the main content
+        parts = [text[:start]]
+        rest = text[end + len(close_tag):].lstrip()
+        while True:
+            start = rest.find(open_tag)
+            end = rest.find(close_tag, start + len(open_tag)) if start >= 0 else -1
+            if end < 0:
+                break
+            parts.append(rest[:start])
+            rest = rest[end + len(close_tag):].lstrip()
+        parts.append(rest)
+        clean_content = "".join(parts).strip()
+        return clean_content, reasoning_content
 
-        return text, None
+
+class ServedModel:
+    """The ModelManager that requests go to, replaceable while the server runs.
+
+    Attribute access is forwarded to the current manager when it happens, so
+    a request that has already looked up a method, or is iterating a stream,
+    finishes on the model it started on while new requests go to the
+    replacement. reload() loads the replacement next to the current model and
+    switches over only once it has loaded and warmed up, a failed load leaves
+    the current model in place. retire() then waits for the generations still
+    running on the old model before dropping it.
+    """
+
+    def __init__(self, manager: ModelManager):
+        self.current = manager
+        self.candidate: Optional[ModelManager] = None
+        self.draining: Optional[ModelManager] = None
+        self.reload_state: Dict[str, Any] = {"state": "idle"}
+
+    def __getattr__(self, name: str):
+        return getattr(self.current, name)
+
+    @property
+    def reloading(self) -> bool:
+        return self.candidate is not None or self.draining is not None
+
+    def reload_status(self) -> Dict[str, Any]:
+        """Progress of the latest reload, for the admin endpoint"""
+        status = dict(self.reload_state)
+        if self.candidate is not None:
+            status["load"] = self.candidate.load_status()
+        if self.draining is not None:
+            status["in_flight"] = self.draining.in_flight
+        return status
+
+    async def reload(self, model_name: str, revision: Optional[str] = None) -> Optional[ModelManager]:
+        """Load `model_name` at `revision` and switch new requests to it.
+
+        Returns the previous manager, to be passed to retire(), or None if the
+        load failed and the current model keeps serving.
+        """
+        if self.reloading:
+            raise RuntimeError("A reload is already in progress")
+        previous = self.current
+        candidate = self.candidate = ModelManager(model_name, revision)
+        # The profiler and a dedicated embedding model carry over
+        candidate.profiler = previous.profiler
+        candidate.embedding_model = previous.embedding_model
+        candidate.embedding_tokenizer = previous.embedding_tokenizer
+        self.reload_state = {
+            "state": "loading",
+            "model": model_name,
+            "revision": revision,
+            "previous_model": previous.model_name,
+            "previous_version": previous.model_version,
+            "started_at": int(time.time()),
+        }
+        try:
+            await candidate.initialize()
+        except Exception as e:
+            self.reload_state.update(state="failed", error=f"{type(e).__name__}: {e}", load=candidate.load_status())
+            logger.error(f"Reload of {model_name} failed, still serving {previous.model_name}")
+            return None
+        finally:
+            self.candidate = None
+        self.current, self.draining = candidate, previous
+        self.reload_state.update(state="draining", version=candidate.model_version, load=candidate.load_status())
+        logger.info(f"Switched to {model_name} ({candidate.model_version}), draining {previous.model_name}")
+        return previous
+
+    async def retire(self, previous: ModelManager, timeout: float):
+        """Wait up to `timeout` seconds for the requests in flight on `previous`, then free it.
+
+        Requests still running after the timeout keep their own references, the
+        memory is released when the last of them finishes.
+        """
+        deadline = time.perf_counter() + timeout
+        try:
+            while previous.in_flight and time.perf_counter() < deadline:
+                await asyncio.sleep(0.1)
+            if previous.in_flight:
+                logger.warning(f"{previous.in_flight} requests still in flight on the previous model after {timeout}s")
+        finally:
+            self.draining = None
+        self.reload_state.update(state="completed", finished_at=int(time.time()))
+        if previous.in_flight:
+            return
+        # Callers may still hold the manager, the weights are dropped from it explicitly
+        previous.model = previous.static_cache = None
+        previous.embedding_model = previous.embedding_tokenizer = None
+        if previous.sessions is not None:
+            previous.sessions.clear()
+            previous.sessions = None
+        gc.collect()
+        if torch.cuda.is_available():
+            torch.cuda.empty_cache()
 
 
 # Global model manager instance
-model_manager = ModelManager()
+model_manager = ServedModel(ModelManager())
@@ -9,33 +9,67 @@ class ChatMessage(BaseModel):
     reasoning_content: Optional[str] = Field(None, description="Extracted reasoning/thinking content")
 
 
+class StreamOptions(BaseModel):
+    coalesce_ms: Optional[float] = Field(None, description="Maximum time in milliseconds to hold deltas before flushing them as one chunk")
+    coalesce_tokens: Optional[int] = Field(None, description="Maximum number of deltas to buffer before flushing them as one chunk")
+
+
+class ResponseFormat(BaseModel):
+    type: str = Field("text", description="One of text, json_object or json_schema")
+    json_schema: Optional[Dict[str, Any]] = Field(None, description="Schema definition with name, schema and strict, for type json_schema")
+
+
 class ChatCompletionRequest(BaseModel):
     model: str = Field(..., description="ID of the model to use")
     messages: List[ChatMessage] = Field(..., description="A list of messages comprising the conversation so far")
     max_tokens: Optional[int] = Field(None, description="The maximum number of tokens to generate")
     temperature: Optional[float] = Field(1.0, description="What sampling temperature to use")
     top_p: Optional[float] = Field(1.0, description="An alternative to sampling with temperature")
+    n: Optional[int] = Field(1, description="How many chat completion choices to generate for each input message")
+    best_of: Optional[int] = Field(None, description="Generates best_of samples and returns the n with the highest log probability per token")
+    logprobs: Optional[bool] = Field(False, description="Whether to return log probabilities of the output tokens")
+    top_logprobs: Optional[int] = Field(None, ge=0, le=20, description="Number of most likely tokens to return at each position, requires logprobs")
     stream: Optional[bool] = Field(False, description="Whether to stream back partial progress")
+    stream_options: Optional[StreamOptions] = Field(None, description="Options for streaming responses")
     stop: Optional[Union[str, List[str]]] = Field(None, description="Up to 4 sequences where the API will stop generating further tokens")
-    frequency_penalty: Optional[float] = Field(0.0, description="Number between -2.0 and 2.0")
-    presence_penalty: Optional[float] = Field(0.0, description="Number between -2.0 and 2.0")
+    frequency_penalty: Optional[float] = Field(0.0, ge=-2.0, le=2.0, description="Number between -2.0 and 2.0")
+    presence_penalty: Optional[float] = Field(0.0, ge=-2.0, le=2.0, description="Number between -2.0 and 2.0")
+    top_k: Optional[int] = Field(None, description="Only sample from the k most likely tokens, 0 or unset disables it")
+    seed: Optional[int] = Field(None, description="Seed for reproducible sampling")
+    response_format: Optional[ResponseFormat] = Field(None, description="Constrain the output to JSON, optionally matching a JSON schema")
+    guided_regex: Optional[str] = Field(None, description="Constrain the output to match this regular expression")
     user: Optional[str] = Field(None, description="A unique identifier representing your end-user")
+    session_id: Optional[str] = Field(None, description="Conversation identifier, the next turn with the same id continues from this turn's KV cache")
+    timeout: Optional[float] = Field(None, gt=0, description="Seconds the client waits for the response, past them the request is dropped or aborted; overrides the X-Request-Timeout header and the server default")
 
 
 class ChatCompletionChoice(BaseModel):
     index: int = Field(..., description="The index of the choice in the list of choices")
     message: ChatMessage = Field(..., description="A chat completion message generated by the model")
+    logprobs: Optional[Dict[str, Any]] = Field(None, description="Log probability information for the choice")
     finish_reason: Optional[str] = Field(None, description="The reason the model stopped generating tokens")
 
 
+class UsageTiming(BaseModel):
+    queue: Optional[float] = Field(None, description="Seconds spent waiting for a generation slot")
+    templating: Optional[float] = Field(None, description="Seconds spent applying the chat template")
+    tokenization: Optional[float] = Field(None, description="Seconds spent tokenizing the prompts")
+    prefill: Optional[float] = Field(None, description="Seconds from the start of generation to the first decoding step")
+    decode: Optional[float] = Field(None, description="Seconds from the first to the last decoding step")
+    serialization: Optional[float] = Field(None, description="Seconds spent building and encoding the response")
+    total: Optional[float] = Field(None, description="Seconds from arrival until the usage was reported")
+
+
 class ChatCompletionUsage(BaseModel):
     prompt_tokens: int = Field(..., description="Number of tokens in the prompt")
+    cached_tokens: Optional[int] = Field(None, description="Prompt tokens restored from the session's KV cache instead of prefilled")
     completion_tokens: int = Field(..., description="Number of tokens in the generated completion")
     total_tokens: int = Field(..., description="Total number of tokens used in the request")
     # Enhanced timing and speed information
     time_to_first_token: Optional[float] = Field(None, description="Time to first token in seconds")
     total_time: Optional[float] = Field(None, description="Total generation time in seconds")
     tokens_per_second: Optional[float] = Field(None, description="Generation speed in tokens per second")
+    timing: Optional[UsageTiming] = Field(None, description="Latency breakdown of the request by phase")
 
 
 class ChatCompletionResponse(BaseModel):
@@ -50,6 +84,7 @@ class ChatCompletionResponse(BaseModel):
 class ChatCompletionStreamChoice(BaseModel):
     index: int = Field(..., description="The index of the choice in the list of choices")
     delta: Dict[str, Any] = Field(default_factory=dict, description="A chat completion delta generated by streamed model responses")
+    logprobs: Optional[Dict[str, Any]] = Field(None, description="Log probability information for the delta")
     finish_reason: Optional[str] = Field(None, description="The reason the model stopped generating tokens")
 
 
@@ -62,6 +97,130 @@ class ChatCompletionStreamResponse(BaseModel):
     usage: Optional[ChatCompletionUsage] = Field(None, description="Usage statistics for the completion request")
 
 
+class CompletionRequest(BaseModel):
+    model: str = Field(..., description="ID of the model to use")
+    prompt: Union[str, List[str]] = Field(..., description="The prompt(s) to generate completions for")
+    suffix: Optional[str] = Field(None, description="The suffix that comes after a completion of inserted text (not supported)")
+    max_tokens: Optional[int] = Field(16, description="The maximum number of tokens to generate")
+    temperature: Optional[float] = Field(1.0, description="What sampling temperature to use")
+    top_p: Optional[float] = Field(1.0, description="An alternative to sampling with temperature")
+    n: Optional[int] = Field(1, description="How many completions to generate for each prompt")
+    best_of: Optional[int] = Field(None, description="Generates best_of completions per prompt and returns the n with the highest log probability per token")
+    logprobs: Optional[int] = Field(None, ge=0, le=5, description="Include the log probabilities of this many most likely tokens, as well as the chosen tokens")
+    stream: Optional[bool] = Field(False, description="Whether to stream back partial progress")
+    stream_options: Optional[StreamOptions] = Field(None, description="Options for streaming responses")
+    echo: Optional[bool] = Field(False, description="Echo back the prompt in addition to the completion")
+    stop: Optional[Union[str, List[str]]] = Field(None, description="Up to 4 sequences where the API will stop generating further tokens")
+    frequency_penalty: Optional[float] = Field(0.0, ge=-2.0, le=2.0, description="Number between -2.0 and 2.0")
+    presence_penalty: Optional[float] = Field(0.0, ge=-2.0, le=2.0, description="Number between -2.0 and 2.0")
+    top_k: Optional[int] = Field(None, description="Only sample from the k most likely tokens, 0 or unset disables it")
+    seed: Optional[int] = Field(None, description="Seed for reproducible sampling")
+    response_format: Optional[ResponseFormat] = Field(None, description="Constrain the output to JSON, optionally matching a JSON schema")
+    guided_regex: Optional[str] = Field(None, description="Constrain the output to match this regular expression")
+    user: Optional[str] = Field(None, description="A unique identifier representing your end-user")
+    timeout: Optional[float] = Field(None, gt=0, description="Seconds the client waits for the response, past them the request is dropped or aborted; overrides the X-Request-Timeout header and the server default")
+
+
+class CompletionChoice(BaseModel):
+    index: int = Field(..., description="The index of the choice in the list of choices")
+    text: str = Field(..., description="The generated text")
+    logprobs: Optional[Dict[str, Any]] = Field(None, description="Log probability information for the choice")
+    finish_reason: Optional[str] = Field(None, description="The reason the model stopped generating tokens")
+
+
+class CompletionResponse(BaseModel):
+    id: str = Field(..., description="A unique identifier for the completion")
+    object: str = Field("text_completion", description="The object type")
+    created: int = Field(default_factory=lambda: int(time.time()), description="The Unix timestamp of when the completion was created")
+    model: str = Field(..., description="The model used for the completion")
+    choices: List[CompletionChoice] = Field(..., description="The list of completion choices")
+    usage: Optional[ChatCompletionUsage] = Field(None, description="Usage statistics for the completion request")
+
+
+class EmbeddingRequest(BaseModel):
+    model: str = Field(..., description="ID of the model to use")
+    input: Union[str, List[str]] = Field(..., description="Input text to embed, encoded as a string or array of strings")
+    encoding_format: Optional[str] = Field("float", description="The format to return the embeddings in, either float or base64")
+    user: Optional[str] = Field(None, description="A unique identifier representing your end-user")
+
+
+class EmbeddingData(BaseModel):
+    object: str = Field("embedding", description="The object type")
+    embedding: Union[List[float], str] = Field(..., description="The embedding vector, a list of floats or a base64 string")
+    index: int = Field(..., description="The index of the embedding in the list of embeddings")
+
+
+class EmbeddingUsage(BaseModel):
+    prompt_tokens: int = Field(..., description="Number of tokens in the input")
+    total_tokens: int = Field(..., description="Total number of tokens used by the request")
+
+
+class EmbeddingResponse(BaseModel):
+    object: str = Field("list", description="The object type")
+    data: List[EmbeddingData] = Field(..., description="The list of embeddings")
+    model: str = Field(..., description="The model used for the embeddings")
+    usage: EmbeddingUsage = Field(..., description="Usage statistics for the embedding request")
+
+
+class FileObject(BaseModel):
+    id: str = Field(..., description="The file identifier")
+    object: str = Field("file", description="The object type")
+    bytes: int = Field(..., description="The size of the file in bytes")
+    created_at: int = Field(..., description="The Unix timestamp of when the file was created")
+    filename: str = Field(..., description="The name of the file")
+    purpose: str = Field(..., description="The intended purpose of the file")
+
+
+class FileListResponse(BaseModel):
+    object: str = Field("list", description="The object type")
+    data: List[FileObject] = Field(..., description="The list of files")
+
+
+class BatchCreateRequest(BaseModel):
+    input_file_id: str = Field(..., description="The ID of an uploaded JSONL file with the requests")
+    endpoint: str = Field(..., description="The endpoint used for all requests in the batch")
+    completion_window: str = Field("24h", description="The time frame within which the batch should be processed")
+    metadata: Optional[Dict[str, str]] = Field(None, description="Custom metadata for the batch")
+
+
+class BatchRequestCounts(BaseModel):
+    total: int = Field(..., description="Total number of requests in the batch")
+    completed: int = Field(..., description="Number of requests that have been completed successfully")
+    failed: int = Field(..., description="Number of requests that have failed")
+
+
+class BatchObject(BaseModel):
+    id: str = Field(..., description="The batch identifier")
+    object: str = Field("batch", description="The object type")
+    endpoint: str = Field(..., description="The endpoint used by the batch")
+    errors: Optional[Dict[str, Any]] = Field(None, description="Errors that stopped the batch")
+    input_file_id: str = Field(..., description="The ID of the input file")
+    completion_window: str = Field(..., description="The time frame within which the batch should be processed")
+    status: str = Field(..., description="The current status of the batch")
+    output_file_id: Optional[str] = Field(None, description="The ID of the file with the successful results")
+    error_file_id: Optional[str] = Field(None, description="The ID of the file with the failed requests")
+    created_at: int = Field(..., description="The Unix timestamp of when the batch was created")
+    in_progress_at: Optional[int] = Field(None, description="The Unix timestamp of when the batch started processing")
+    finalizing_at: Optional[int] = Field(None, description="The Unix timestamp of when the batch started finalizing")
+    completed_at: Optional[int] = Field(None, description="The Unix timestamp of when the batch was completed")
+    failed_at: Optional[int] = Field(None, description="The Unix timestamp of when the batch failed")
+    cancelling_at: Optional[int] = Field(None, description="The Unix timestamp of when the batch started cancelling")
+    cancelled_at: Optional[int] = Field(None, description="The Unix timestamp of when the batch was cancelled")
+    request_counts: BatchRequestCounts = Field(..., description="The request counts for the batch")
+    metadata: Optional[Dict[str, str]] = Field(None, description="Custom metadata for the batch")
+
+
+class BatchListResponse(BaseModel):
+    object: str = Field("list", description="The object type")
+    data: List[BatchObject] = Field(..., description="The list of batches")
+    has_more: bool = Field(False, description="Whether there are more batches after this page")
+
+
+class ReloadRequest(BaseModel):
+    model: Optional[str] = Field(None, description="Model to load, defaults to the one being served")
+    revision: Optional[str] = Field(None, description="Branch, tag or commit of the model on the Hugging Face hub")
+
+
 class ModelInfo(BaseModel):
     id: str = Field(..., description="The model identifier")
     object: str = Field("model", description="The object type")
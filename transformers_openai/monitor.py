@@ -1,126 +1,121 @@
 #!/usr/bin/env python3
 """
 API 服务器监控工具
+
+订阅服务器的 /stats/stream 推送，而不是轮询；同时监控多个副本时每个副本只占用一个连接。
 """
+import argparse
+import json
+import os
+import queue
+import threading
 import time
-import requests
-import psutil
 from datetime import datetime
+from typing import Any, Dict, Iterator, List, Optional
 
+import requests
 
-def get_server_stats():
-    """获取服务器统计信息"""
-    try:
-        # API 健康检查
-        health_response = requests.get("http://127.0.0.1:8000/health", timeout=5)
-        api_status = health_response.status_code == 200
-
-        # 系统资源使用
-        cpu_percent = psutil.cpu_percent(interval=1)
-        memory = psutil.virtual_memory()
-        disk = psutil.disk_usage("/")
-
-        # GPU 信息（如果有 nvidia-smi）
-        gpu_info = "N/A"
+DEFAULT_URL = os.getenv("MONITOR_URL", "http://127.0.0.1:7088")
+
+
+def subscribe(url: str, interval: Optional[float] = None) -> Iterator[Dict[str, Any]]:
+    """逐条返回服务器推送的统计快照"""
+    with requests.get(
+        f"{url.rstrip('/')}/stats/stream",
+        params={"interval": interval} if interval else None,
+        stream=True,
+        timeout=(5, None),
+    ) as response:
+        response.raise_for_status()
+        for line in response.iter_lines(decode_unicode=True):
+            if line and line.startswith("data: "):
+                yield json.loads(line[len("data: "):])
+
+
+def _number(value, fmt: str = "{:.1f}", scale: float = 1.0) -> str:
+    return "N/A" if value is None else fmt.format(value / scale)
+
+
+def format_stats(stats: Dict[str, Any]) -> str:
+    """一行显示一个快照"""
+    gib = 1024 ** 3
+    parts = [
+        f"req/s {_number(stats.get('requests_per_second'), '{:.2f}')}",
+        f"tok/s {_number(stats.get('generation_tokens_per_second'))}",
+        f"running {stats.get('num_requests_running', 'N/A')}",
+        f"waiting {stats.get('num_requests_waiting', 'N/A')}",
+        f"kv {stats.get('kv_cache_tokens', 'N/A')} tok",
+        f"cpu {_number(stats.get('process_cpu_percent'))}%",
+        f"rss {_number(stats.get('process_rss_bytes'), scale=gib)}GB",
+    ]
+    if "gpu_memory_allocated_bytes" in stats:
+        parts.append(
+            f"gpu {_number(stats['gpu_memory_allocated_bytes'], scale=gib)}"
+            f"/{_number(stats.get('gpu_memory_total_bytes'), scale=gib)}GB"
+        )
+    return "  ".join(parts)
+
+
+def watch(url: str, interval: Optional[float], updates: queue.Queue):
+    """持续订阅一个副本，断线后自动重连"""
+    delay = 1.0
+    while True:
         try:
-            import subprocess
-
-            gpu_result = subprocess.run(
-                [
-                    "nvidia-smi",
-                    "--query-gpu=utilization.gpu,memory.used,memory.total",
-                    "--format=csv,noheader,nounits",
-                ],
-                capture_output=True,
-                text=True,
-                timeout=5,
-            )
-            if gpu_result.returncode == 0:
-                gpu_data = gpu_result.stdout.strip().split("\n")[0].split(", ")
-                gpu_util, gpu_mem_used, gpu_mem_total = map(int, gpu_data)
-                gpu_info = f"{gpu_util}% GPU, {gpu_mem_used}/{gpu_mem_total}MB"
-        except:
-            pass
-
-        return {
-            "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-            "api_status": "✅ Online" if api_status else "❌ Offline",
-            "cpu_percent": f"{cpu_percent:.1f}%",
-            "memory_percent": f"{memory.percent:.1f}%",
-            "memory_used": f"{memory.used / 1024**3:.1f}GB",
-            "memory_total": f"{memory.total / 1024**3:.1f}GB",
-            "disk_percent": f"{disk.percent:.1f}%",
-            "gpu_info": gpu_info,
-        }
-    except Exception as e:
-        return {"error": str(e)}
-
-
-def test_api_latency():
-    """测试 API 延迟"""
-    try:
-        start_time = time.time()
-        response = requests.get("http://127.0.0.1:8000/health", timeout=10)
-        latency = (time.time() - start_time) * 1000  # 转换为毫秒
+            for stats in subscribe(url, interval):
+                delay = 1.0
+                updates.put((url, stats))
+        except (requests.RequestException, ValueError) as e:
+            updates.put((url, {"error": str(e)}))
+        time.sleep(delay)
+        delay = min(delay * 2, 30.0)
 
-        if response.status_code == 200:
-            return f"{latency:.1f}ms"
-        else:
-            return "Error"
-    except:
-        return "Timeout"
 
-
-def monitor_loop():
+def monitor_loop(urls: List[str], interval: Optional[float] = None):
     """监控循环"""
     print("🖥️  API Server Monitor")
     print("=" * 50)
 
+    updates: queue.Queue = queue.Queue()
+    for url in urls:
+        threading.Thread(target=watch, args=(url, interval, updates), daemon=True).start()
+
     try:
         while True:
-            stats = get_server_stats()
-            latency = test_api_latency()
-
-            # 清屏（可选）
-            # import os
-            # os.system('clear')
-
-            print(f"\n[{stats.get('timestamp', 'N/A')}]")
-            print(f"API Status: {stats.get('api_status', 'Unknown')}")
-            print(f"API Latency: {latency}")
-            print(f"CPU Usage: {stats.get('cpu_percent', 'N/A')}")
-            print(
-                f"Memory: {stats.get('memory_used', 'N/A')} / {stats.get('memory_total', 'N/A')} ({stats.get('memory_percent', 'N/A')})"
-            )
-            print(f"Disk Usage: {stats.get('disk_percent', 'N/A')}")
-            print(f"GPU: {stats.get('gpu_info', 'N/A')}")
-            print("-" * 50)
-
-            time.sleep(5)  # 每5秒更新一次
-
+            url, stats = updates.get()
+            timestamp = datetime.now().strftime("%H:%M:%S")
+            if "error" in stats:
+                print(f"[{timestamp}] {url}  ❌ {stats['error']}")
+            else:
+                print(f"[{timestamp}] {url}  {format_stats(stats)}")
     except KeyboardInterrupt:
         print("\n👋 Monitoring stopped.")
 
 
-def single_check():
+def single_check(url: str):
     """单次检查"""
     print("📊 Server Status Check")
     print("=" * 30)
 
-    stats = get_server_stats()
-    latency = test_api_latency()
+    try:
+        stats = next(subscribe(url))
+    except (requests.RequestException, ValueError, StopIteration) as e:
+        print(f"API Status: ❌ Offline ({e})")
+        return
 
+    print("API Status: ✅ Online")
     for key, value in stats.items():
         if key != "timestamp":
             print(f"{key.replace('_', ' ').title()}: {value}")
 
-    print(f"API Latency: {latency}")
-
 
 if __name__ == "__main__":
-    import sys
-
-    if len(sys.argv) > 1 and sys.argv[1] == "--monitor":
-        monitor_loop()
+    parser = argparse.ArgumentParser(description="Watch the live stats of one or more servers")
+    parser.add_argument("urls", nargs="*", default=[DEFAULT_URL], help=f"Server URLs (default: {DEFAULT_URL}, env: MONITOR_URL)")
+    parser.add_argument("--monitor", action="store_true", help="Keep watching instead of a single check")
+    parser.add_argument("--interval", type=float, default=None, help="Seconds between updates (default: the server's --stats-interval)")
+    args = parser.parse_args()
+
+    if args.monitor:
+        monitor_loop(args.urls, args.interval)
     else:
-        single_check()
+        single_check(args.urls[0])
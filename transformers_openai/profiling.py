@@ -0,0 +1,135 @@
+import contextlib
+import itertools
+import logging
+import os
+import threading
+import time
+from collections import deque
+from typing import Iterator, List, Optional
+
+import torch
+from transformers import LogitsProcessor
+
+logger = logging.getLogger(__name__)
+
+
+class ProfilerSteps(LogitsProcessor):
+    """Advances the profiler schedule once per decoding step and labels prefill and decode.
+
+    It is called between forward passes, so it closes the region of the
+    pass that just ran and opens a "decode" region for the next one. Scores
+    are passed through untouched.
+    """
+
+    def __init__(self, profiler: "torch.profiler.profile"):
+        self.profiler = profiler
+        self.region = None
+
+    def begin(self, name: str):
+        self.region = torch.autograd.profiler.record_function(name)
+        self.region.__enter__()
+
+    def end(self):
+        if self.region is not None:
+            self.region.__exit__(None, None, None)
+            self.region = None
+
+    def __call__(self, input_ids, scores):
+        self.end()
+        self.profiler.step()
+        self.begin("decode")
+        return scores
+
+
+class RequestProfiler:
+    """Profiles sampled generate() calls with torch.profiler and writes Chrome/Perfetto traces.
+
+    Every `every`-th request is profiled (0 disables sampling), and
+    `trigger` marks the next requests for profiling on demand. The schedule
+    runs `warmup` steps over setup work before recording `active` steps,
+    starting with prefill, so the trace shows the same steps whatever the
+    warmup.
+    """
+
+    def __init__(self, every: int = 0, output_dir: str = "profiles", warmup: int = 1, active: int = 32):
+        self.every = every
+        self.output_dir = output_dir
+        self.warmup = max(0, warmup)
+        self.active = max(1, active)
+        self.requests = itertools.count(1)
+        self.pending = 0
+        self.lock = threading.Lock()
+        self.busy = threading.Lock()
+        self.traces: deque = deque(maxlen=20)
+        self.sequence = itertools.count(1)
+
+    def trigger(self, count: int = 1) -> int:
+        """Profile the next `count` requests, returns how many are now waiting to be profiled"""
+        with self.lock:
+            self.pending += count
+            return self.pending
+
+    def _sampled(self) -> bool:
+        number = next(self.requests)
+        if self.pending:
+            with self.lock:
+                if self.pending > 0:
+                    self.pending -= 1
+                    return True
+        return self.every > 0 and number % self.every == 0
+
+    @property
+    def recent_traces(self) -> List[str]:
+        return list(self.traces)
+
+    @contextlib.contextmanager
+    def profile(self, kind: str) -> Iterator[Optional[ProfilerSteps]]:
+        """Profile the generate() call run inside if this request is sampled.
+
+        Yields the processor to add to its logits processors, or None when the
+        request is not profiled. Only one profiler can run at a time, a
+        sampled request that overlaps a running session is skipped and a
+        triggered one stays pending.
+        """
+        if self.busy.locked():
+            next(self.requests)
+            yield None
+            return
+        if not self._sampled() or not self.busy.acquire(blocking=False):
+            yield None
+            return
+        try:
+            with self._session(kind) as steps:
+                yield steps
+        finally:
+            self.busy.release()
+
+    @contextlib.contextmanager
+    def _session(self, kind: str) -> Iterator[ProfilerSteps]:
+        path = os.path.join(
+            self.output_dir,
+            f"{time.strftime('%Y%m%d-%H%M%S')}-{kind}-{next(self.sequence)}.pt.trace.json",
+        )
+
+        def export(profiler):
+            os.makedirs(self.output_dir, exist_ok=True)
+            profiler.export_chrome_trace(path)
+            self.traces.append(path)
+            logger.info(f"Wrote profiler trace to {path}")
+
+        activities = [torch.profiler.ProfilerActivity.CPU]
+        if torch.cuda.is_available():
+            activities.append(torch.profiler.ProfilerActivity.CUDA)
+        schedule = torch.profiler.schedule(wait=0, warmup=self.warmup, active=self.active, repeat=1)
+        with torch.profiler.profile(
+            activities=activities, schedule=schedule, on_trace_ready=export, record_shapes=True
+        ) as profiler:
+            steps = ProfilerSteps(profiler)
+            # Warm up over nothing so the recorded window starts at prefill
+            for _ in range(self.warmup):
+                profiler.step()
+            steps.begin("prefill")
+            try:
+                yield steps
+            finally:
+                steps.end()
@@ -0,0 +1,205 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, AsyncGenerator, Awaitable, Callable, Dict, Optional, Tuple
+
+
+class ResponseCache:
+    """Cache of deterministic generation results with a memory and a disk tier.
+
+    An in-memory LRU sits in front of an optional SQLite store. Entries expire
+    after `ttl` seconds (0 keeps them forever); the memory tier is bounded by
+    entry count and the disk tier by total bytes, evicting the least recently
+    used entries first.
+    """
+
+    def __init__(
+        self,
+        memory_entries: int = 1024,
+        path: str = "",
+        ttl: float = 3600,
+        max_bytes: int = 1024 * 1024 * 1024,
+    ):
+        self.memory_entries = memory_entries
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.memory: "OrderedDict[str, Tuple[float, Dict[str, Any]]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        self.db = None
+        self.disk_bytes = 0
+
+        if path:
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            self.db = sqlite3.connect(path, check_same_thread=False)
+            self.db.execute(
+                "CREATE TABLE IF NOT EXISTS entries ("
+                "key TEXT PRIMARY KEY, value BLOB, created_at REAL, accessed_at REAL, size INTEGER)"
+            )
+            self.db.execute("CREATE INDEX IF NOT EXISTS entries_accessed ON entries (accessed_at)")
+            self.db.execute("CREATE INDEX IF NOT EXISTS entries_created ON entries (created_at)")
+            self.db.commit()
+            self.disk_bytes = self.db.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+
+    @staticmethod
+    def make_key(**parts) -> str:
+        """Canonical hash of everything that determines a response"""
+        canonical = json.dumps(parts, sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+        return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+    def _expired(self, created_at: float) -> bool:
+        return self.ttl > 0 and time.time() - created_at > self.ttl
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        with self.lock:
+            entry = self.memory.get(key)
+            if entry is not None:
+                created_at, value = entry
+                if not self._expired(created_at):
+                    self.memory.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self.memory[key]
+
+            if self.db is not None:
+                row = self.db.execute(
+                    "SELECT value, created_at, size FROM entries WHERE key = ?", (key,)
+                ).fetchone()
+                if row is not None:
+                    value, created_at, size = row
+                    if not self._expired(created_at):
+                        self.db.execute(
+                            "UPDATE entries SET accessed_at = ? WHERE key = ?", (time.time(), key)
+                        )
+                        self.db.commit()
+                        value = json.loads(value)
+                        self._remember(key, created_at, value)
+                        self.hits += 1
+                        return value
+                    self.db.execute("DELETE FROM entries WHERE key = ?", (key,))
+                    self.db.commit()
+                    self.disk_bytes -= size
+
+            self.misses += 1
+            return None
+
+    def put(self, key: str, value: Dict[str, Any]):
+        created_at = time.time()
+        with self.lock:
+            self._remember(key, created_at, value)
+            if self.db is None:
+                return
+
+            blob = json.dumps(value).encode("utf-8")
+            if len(blob) > self.max_bytes:
+                return
+            old = self.db.execute("SELECT size FROM entries WHERE key = ?", (key,)).fetchone()
+            self.db.execute(
+                "INSERT OR REPLACE INTO entries (key, value, created_at, accessed_at, size) VALUES (?, ?, ?, ?, ?)",
+                (key, blob, created_at, created_at, len(blob)),
+            )
+            self.disk_bytes += len(blob) - (old[0] if old else 0)
+            self._evict()
+            self.db.commit()
+
+    def _remember(self, key: str, created_at: float, value: Dict[str, Any]):
+        if self.memory_entries <= 0:
+            return
+        self.memory[key] = (created_at, value)
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.memory_entries:
+            self.memory.popitem(last=False)
+
+    def _evict(self):
+        """Drop expired entries, then least recently used ones until the disk budget fits"""
+        if self.ttl > 0:
+            expired = self.db.execute(
+                "DELETE FROM entries WHERE created_at < ?", (time.time() - self.ttl,)
+            )
+            if expired.rowcount:
+                self.disk_bytes = self.db.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+        while self.disk_bytes > self.max_bytes:
+            row = self.db.execute(
+                "SELECT key, size FROM entries ORDER BY accessed_at LIMIT 1"
+            ).fetchone()
+            if row is None:
+                break
+            self.db.execute("DELETE FROM entries WHERE key = ?", (row[0],))
+            self.disk_bytes -= row[1]
+
+
+def cache_entry(result: Dict[str, Any]) -> Dict[str, Any]:
+    """The part of a generate_text result that is worth caching"""
+    return {
+        "choices": [
+            {
+                "index": choice["index"],
+                "text": choice["text"],
+                "reasoning_content": choice.get("reasoning_content"),
+                "finish_reason": choice["finish_reason"],
+                "logprobs": choice.get("logprobs"),
+            }
+            for choice in result["choices"]
+        ],
+        "prompt_tokens": result["prompt_tokens"],
+        "completion_tokens": result["completion_tokens"],
+        "total_tokens": result["total_tokens"],
+    }
+
+
+async def replay_chunks(result: Dict[str, Any]) -> AsyncGenerator[Dict[str, Any], None]:
+    """Replay a cached result as stream chunks, one complete delta per choice"""
+    for choice in result["choices"]:
+        yield {
+            "index": choice["index"],
+            "text": choice["text"],
+            "reasoning_content": choice.get("reasoning_content"),
+            "finish_reason": choice["finish_reason"],
+            "logprobs": choice.get("logprobs"),
+            "prompt_tokens": result["prompt_tokens"],
+            "completion_tokens": result["completion_tokens"],
+            "total_tokens": result["total_tokens"],
+            "time_to_first_token": 0.0,
+            "total_time": 0.0,
+            "tokens_per_second": None,
+        }
+
+
+async def record_chunks(
+    chunks: AsyncGenerator[Dict[str, Any], None],
+    num_choices: int,
+    on_complete: Callable[[Dict[str, Any]], Awaitable[None]],
+) -> AsyncGenerator[Dict[str, Any], None]:
+    """Pass stream chunks through and hand the assembled result to `on_complete`.
+
+    The result is only reported once all `num_choices` choices have finished,
+    so streams that are cut short never end up in the cache.
+    """
+    choices: Dict[int, Dict[str, Any]] = {}
+    finished = 0
+    async for chunk in chunks:
+        choice = choices.setdefault(
+            chunk.get("index", 0),
+            {"index": chunk.get("index", 0), "text": "", "reasoning_content": None, "finish_reason": None, "logprobs": None},
+        )
+        choice["text"] += chunk.get("text") or ""
+        if chunk.get("reasoning_content"):
+            choice["reasoning_content"] = (choice["reasoning_content"] or "") + chunk["reasoning_content"]
+        if chunk.get("logprobs") is not None:
+            choice["logprobs"] = (choice["logprobs"] or []) + chunk["logprobs"]
+        if chunk.get("finish_reason"):
+            choice["finish_reason"] = chunk["finish_reason"]
+            finished += 1
+            if finished == num_choices:
+                await on_complete({
+                    "choices": [choices[index] for index in sorted(choices)],
+                    "prompt_tokens": chunk.get("prompt_tokens", 0),
+                    "completion_tokens": chunk.get("completion_tokens", 0),
+                    "total_tokens": chunk.get("total_tokens", 0),
+                })
+        yield chunk
@@ -0,0 +1,157 @@
+import asyncio
+import concurrent.futures
+import heapq
+import itertools
+import time
+from contextlib import asynccontextmanager
+from typing import List, Optional, Tuple
+
+from transformers_openai.metrics import metrics
+from transformers_openai.timing import DeadlineExceeded
+
+# Lower values are admitted first
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BATCH = 10
+
+
+class Scheduler:
+    """Admits generation work onto the model in priority order.
+
+    At most `max_running` jobs hold a slot at the same time. Waiting jobs are
+    served by priority, then earliest deadline first, then by arrival, so
+    offline batch work only takes slots that interactive requests leave idle
+    and requests without a deadline go after those that still have to meet
+    one. A job whose deadline (a time.perf_counter() value) passes while it
+    waits leaves the queue with DeadlineExceeded without ever running.
+    """
+
+    def __init__(self, max_running: int):
+        self.max_running = max(1, max_running)
+        self.running = 0
+        self.waiting: List[Tuple[int, float, int, asyncio.Future]] = []
+        self.counter = itertools.count()
+
+    @property
+    def num_waiting(self) -> int:
+        return sum(1 for *_, future in self.waiting if not future.done())
+
+    def has_waiting(self, priority: int) -> bool:
+        """Whether any job with the given or a more urgent priority is waiting"""
+        return any(p <= priority and not f.done() for p, _, _, f in self.waiting)
+
+    async def acquire(self, priority: int = PRIORITY_INTERACTIVE, deadline: Optional[float] = None) -> float:
+        """Wait for a slot, returns the seconds spent waiting"""
+        arrival_time = time.perf_counter()
+        if deadline is not None and arrival_time >= deadline:
+            metrics.deadline_expired_waiting.inc()
+            raise DeadlineExceeded("Request deadline exceeded before it was scheduled")
+        if self.running < self.max_running and not self.has_waiting(priority):
+            self.running += 1
+            self._admitted(priority, 0.0)
+            return 0.0
+
+        future = asyncio.get_running_loop().create_future()
+        order = deadline if deadline is not None else float("inf")
+        heapq.heappush(self.waiting, (priority, order, next(self.counter), future))
+        try:
+            if deadline is None:
+                await future
+            else:
+                await asyncio.wait_for(future, deadline - arrival_time)
+        except asyncio.TimeoutError:
+            # wait_for cancelled the future, release() skips it
+            metrics.deadline_expired_waiting.inc()
+            raise DeadlineExceeded("Request deadline exceeded while waiting for a generation slot")
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # The slot was handed over just before the cancellation
+                self.release()
+            raise
+        queue_time = time.perf_counter() - arrival_time
+        self._admitted(priority, queue_time)
+        return queue_time
+
+    @staticmethod
+    def _admitted(priority: int, queue_time: float):
+        # Offline batches queue behind everything by design, only interactive waits are reported
+        if priority <= PRIORITY_INTERACTIVE:
+            metrics.queue_time.observe(queue_time)
+
+    def release(self):
+        self.running = max(0, self.running - 1)
+        while self.running < self.max_running and self.waiting:
+            *_, future = heapq.heappop(self.waiting)
+            if future.done():
+                continue
+            self.running += 1
+            future.set_result(None)
+
+    @asynccontextmanager
+    async def slot(self, priority: int = PRIORITY_INTERACTIVE, deadline: Optional[float] = None):
+        queue_time = await self.acquire(priority, deadline)
+        try:
+            yield queue_time
+        finally:
+            self.release()
+
+
+class StreamSlot:
+    """The slot of a streaming request, which its generation thread hands back while the client stalls.
+
+    acquire(), release() and close() run on the event loop. A paused stream
+    gives its slot to the next waiter with release_soon() and waits for one
+    again with reacquire(), both from the generation thread. Once closed the
+    slot is released for good and a pending reacquire() is cancelled.
+    """
+
+    def __init__(self, scheduler: Scheduler, deadline: Optional[float] = None):
+        self.scheduler = scheduler
+        self.deadline = deadline
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self.held = False
+        self.closed = False
+        self.waiting: Optional[asyncio.Task] = None
+
+    async def acquire(self) -> float:
+        """Wait for a slot, returns the seconds spent waiting"""
+        self.loop = asyncio.get_running_loop()
+        if self.closed or self.held:
+            return 0.0
+        self.waiting = asyncio.current_task()
+        try:
+            queue_time = await self.scheduler.acquire(deadline=self.deadline)
+        finally:
+            self.waiting = None
+        if self.closed:
+            # Closed while the grant was on its way
+            self.scheduler.release()
+        else:
+            self.held = True
+        return queue_time
+
+    def release(self):
+        if self.held:
+            self.held = False
+            self.scheduler.release()
+
+    def close(self):
+        self.closed = True
+        if self.waiting is not None:
+            self.waiting.cancel()
+        self.release()
+
+    def release_soon(self):
+        """Release from another thread"""
+        self.loop.call_soon_threadsafe(self.release)
+
+    def reacquire(self):
+        """Block the calling thread until the slot is held again or closed, raises DeadlineExceeded like acquire()"""
+        future = asyncio.run_coroutine_threadsafe(self.acquire(), self.loop)
+        # The loop that would cancel the wait may itself be waiting for this thread, so watch for close() here
+        while not future.done():
+            if self.closed:
+                future.cancel()
+                return
+            concurrent.futures.wait([future], timeout=0.1)
+        if not future.cancelled():
+            future.result()
@@ -0,0 +1,186 @@
+import glob
+import hashlib
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+import torch
+
+# Storage tiers from fastest to restore to cheapest to keep
+TIERS = ("device", "host", "disk")
+
+# (keys, values) of every decoder layer for one sequence
+Layers = List[Tuple[torch.Tensor, torch.Tensor]]
+
+
+class SessionEntry:
+    def __init__(self, token_ids: List[int], layers: Layers):
+        self.token_ids = token_ids
+        # None while the entry is on disk
+        self.layers: Optional[Layers] = layers
+        self.nbytes = sum(t.numel() * t.element_size() for layer in layers for t in layer)
+        self.tier = "device"
+        self.last_used = time.monotonic()
+
+
+class SessionStore:
+    """KV caches of finished chat turns by session id, so the next turn only prefills its new messages.
+
+    Entries start on the device and are demoted to host memory, then to a
+    file under `disk_dir`, once they have been idle for `host_after` and
+    `disk_after` seconds, or when their tier is over its byte budget (least
+    recently used first). Entries idle for `ttl` seconds, or pushed out of
+    the last tier, are dropped. take() brings an entry back to the device
+    and removes it, the turn that used it puts the extended cache back.
+    """
+
+    def __init__(
+        self,
+        device: torch.device,
+        device_bytes: int,
+        host_bytes: int,
+        disk_dir: str = "",
+        disk_bytes: int = 0,
+        host_after: float = 30,
+        disk_after: float = 300,
+        ttl: float = 3600,
+    ):
+        self.device = device
+        self.budgets = {"device": device_bytes, "host": host_bytes, "disk": disk_bytes if disk_dir else 0}
+        self.disk_dir = disk_dir
+        self.host_after = host_after
+        self.disk_after = disk_after
+        self.ttl = ttl
+        self.entries: "OrderedDict[str, SessionEntry]" = OrderedDict()
+        self.tier_bytes: Dict[str, int] = {tier: 0 for tier in TIERS}
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        # Stores of a reloaded model and of other processes may share the directory
+        self.prefix = uuid.uuid4().hex[:12]
+        if disk_dir:
+            os.makedirs(disk_dir, exist_ok=True)
+            self._remove_stale_files()
+
+    def _remove_stale_files(self):
+        """Files a process left behind when it did not shut down cleanly, once they are past the ttl"""
+        if self.ttl <= 0:
+            return
+        for path in glob.glob(os.path.join(self.disk_dir, "*.kv")):
+            try:
+                if time.time() - os.path.getmtime(path) > self.ttl:
+                    os.remove(path)
+            except OSError:
+                pass
+
+    def _path(self, session_id: str) -> str:
+        name = hashlib.sha256(session_id.encode("utf-8")).hexdigest()
+        return os.path.join(self.disk_dir, f"{self.prefix}-{name}.kv")
+
+    def _move(self, session_id: str, entry: SessionEntry, tier: str):
+        if tier == entry.tier:
+            return
+        if entry.tier == "disk":
+            path = self._path(session_id)
+            entry.layers = torch.load(path, map_location="cpu")
+            os.remove(path)
+        if tier == "disk":
+            torch.save([(k.cpu(), v.cpu()) for k, v in entry.layers], self._path(session_id))
+            entry.layers = None
+        elif tier == "host":
+            # Pinned host memory copies back to the accelerator asynchronously
+            pin = self.device.type == "cuda"
+            entry.layers = [
+                (k.cpu().pin_memory(), v.cpu().pin_memory()) if pin else (k.cpu(), v.cpu()) for k, v in entry.layers
+            ]
+        else:
+            entry.layers = [
+                (k.to(self.device, non_blocking=True), v.to(self.device, non_blocking=True)) for k, v in entry.layers
+            ]
+        self.tier_bytes[entry.tier] -= entry.nbytes
+        self.tier_bytes[tier] += entry.nbytes
+        entry.tier = tier
+
+    def _drop(self, session_id: str):
+        entry = self.entries.pop(session_id)
+        self.tier_bytes[entry.tier] -= entry.nbytes
+        if entry.tier == "disk":
+            os.remove(self._path(session_id))
+
+    def _demote(self, session_id: str, entry: SessionEntry):
+        """Move an entry one tier down, past tiers without a budget, or drop it from the last"""
+        for tier in TIERS[TIERS.index(entry.tier) + 1:]:
+            if entry.nbytes <= self.budgets[tier]:
+                self._move(session_id, entry, tier)
+                return
+        self._drop(session_id)
+
+    def take(self, session_id: str) -> Optional[Tuple[List[int], Layers]]:
+        """The token ids and device KV of the session's last turn, removed from the store"""
+        with self.lock:
+            self._maintain()
+            entry = self.entries.get(session_id)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._move(session_id, entry, "device")
+            self._drop(session_id)
+            self.hits += 1
+            return entry.token_ids, entry.layers
+
+    def put(self, session_id: str, token_ids: List[int], layers: Layers):
+        """Keep the KV of a session's latest turn, replacing what it had"""
+        entry = SessionEntry(token_ids, layers)
+        with self.lock:
+            if session_id in self.entries:
+                self._drop(session_id)
+            self.entries[session_id] = entry
+            self.tier_bytes["device"] += entry.nbytes
+            if entry.nbytes > self.budgets["device"]:
+                self._demote(session_id, entry)
+            self._maintain()
+
+    def maintain(self):
+        """Apply the idle times, budgets and ttl, also run by take() and put()"""
+        with self.lock:
+            self._maintain()
+
+    def _maintain(self):
+        now = time.monotonic()
+        # Oldest first, so the least recently used entries leave a full tier first
+        for session_id, entry in list(self.entries.items()):
+            idle = now - entry.last_used
+            if self.ttl > 0 and idle > self.ttl:
+                self._drop(session_id)
+                continue
+            target = "device" if idle <= self.host_after else "host" if idle <= self.disk_after else "disk"
+            if target == "disk" and not self.budgets["disk"]:
+                # Without a disk tier idle entries stay in host memory until the ttl
+                target = "host"
+            while session_id in self.entries and TIERS.index(entry.tier) < TIERS.index(target):
+                self._demote(session_id, entry)
+        for tier in TIERS:
+            for session_id, entry in list(self.entries.items()):
+                if self.tier_bytes[tier] <= self.budgets[tier]:
+                    break
+                if entry.tier == tier:
+                    self._demote(session_id, entry)
+
+    def clear(self):
+        """Drop every entry and its file, the KV is only valid for the model that computed it"""
+        with self.lock:
+            for session_id in list(self.entries):
+                self._drop(session_id)
+
+    def stats(self) -> Dict[str, int]:
+        with self.lock:
+            counts = {tier: 0 for tier in TIERS}
+            for entry in self.entries.values():
+                counts[entry.tier] += 1
+            return {
+                **{f"{tier}_sessions": count for tier, count in counts.items()},
+                **{f"{tier}_bytes": size for tier, size in self.tier_bytes.items()},
+            }
@@ -0,0 +1,152 @@
+from typing import Optional
+
+import torch
+from transformers import Cache, DynamicLayer
+
+
+# Rotary embeddings whose frequencies change with the sequence length, sinks rotated once would go stale
+DYNAMIC_ROPE_TYPES = ("dynamic", "longrope")
+
+
+def rotary_inv_freq(model) -> Optional[torch.Tensor]:
+    """Inverse frequencies of the model's rotary position embedding, None if it has no fixed one"""
+    for module in model.modules():
+        inv_freq = getattr(module, "inv_freq", None)
+        if isinstance(inv_freq, torch.Tensor):
+            return None if getattr(module, "rope_type", "default") in DYNAMIC_ROPE_TYPES else inv_freq
+    return None
+
+
+def rotate(states: torch.Tensor, shift: torch.Tensor, inv_freq: torch.Tensor) -> torch.Tensor:
+    """Move states that carry a rotary position embedding `shift` positions further, per batch row.
+
+    Rotations compose, so this is the same as having embedded them at their
+    position plus `shift`. Only the first 2 * len(inv_freq) channels rotate,
+    as with a partial rotary embedding.
+    """
+    rotary_dim = inv_freq.shape[0] * 2
+    angles = shift.to(inv_freq.device, torch.float32)[:, None] * inv_freq.float()[None, :]
+    angles = torch.cat([angles, angles], dim=-1)[:, None, None, :]
+    rotary, rest = states[..., :rotary_dim].float(), states[..., rotary_dim:]
+    half = rotary_dim // 2
+    rotated_half = torch.cat([-rotary[..., half:], rotary[..., :half]], dim=-1)
+    rotary = rotary * angles.cos() + rotated_half * angles.sin()
+    return torch.cat([rotary.to(states.dtype), rest], dim=-1)
+
+
+class SinkCacheLayer(DynamicLayer):
+    """Cache layer that keeps the first `sink_tokens` tokens and a sliding window of the last `window`.
+
+    Attention concentrates on the first tokens of a sequence whatever they
+    say, dropping them is what breaks a plain sliding window; keeping them
+    bounds the cache at sink_tokens + window positions per sequence. The
+    sinks are rotated to sit right before the window, so the distances
+    between queries and cached keys never exceed what the cache holds.
+    Sinks are taken from each row's first real token, after its left
+    padding.
+    """
+
+    def __init__(self, sink_tokens: int, window: int, inv_freq: torch.Tensor):
+        super().__init__()
+        self.sink_tokens = sink_tokens
+        self.window = window
+        self.inv_freq = inv_freq
+        self.cumulative_length = 0
+        # Captured the first time the sequence outgrows sinks plus window
+        self.sink_keys: Optional[torch.Tensor] = None
+        self.sink_values: Optional[torch.Tensor] = None
+        # Left padding of every row, see SinkCache.set_padding()
+        self.padding: Optional[torch.Tensor] = None
+
+    def get_seq_length(self) -> int:
+        return self.cumulative_length
+
+    def get_mask_sizes(self, query_length: int) -> tuple:
+        if self.sink_keys is None:
+            return self.cumulative_length + query_length, 0
+        # The sinks are masked as if they were the positions right before the window
+        held = self.keys.shape[-2]
+        return self.sink_tokens + held + query_length, self.cumulative_length - held - self.sink_tokens
+
+    def _padding(self, batch: int, device) -> torch.Tensor:
+        if self.padding is None:
+            return torch.zeros(batch, dtype=torch.long, device=device)
+        return self.padding.to(device)
+
+    def _capture_sinks(self, keys: torch.Tensor, values: torch.Tensor):
+        batch, heads, tokens, head_dim = keys.shape
+        columns = self._padding(batch, keys.device)[:, None] + torch.arange(self.sink_tokens, device=keys.device)
+        index = columns.clamp(max=tokens - 1)[:, None, :, None].expand(batch, heads, self.sink_tokens, head_dim)
+        self.sink_keys = keys.gather(2, index)
+        self.sink_values = values.gather(2, index)
+
+    def update(self, key_states: torch.Tensor, value_states: torch.Tensor, *args, **kwargs):
+        if not self.is_initialized:
+            self.lazy_initialization(key_states, value_states)
+            self.inv_freq = self.inv_freq.to(self.device)
+        # Before the first update the states are empty 1-d tensors
+        window_start = self.cumulative_length - (self.keys.shape[-2] if self.keys.dim() > 1 else 0)
+        keys = torch.cat([self.keys, key_states], dim=-2)
+        values = torch.cat([self.values, value_states], dim=-2)
+        if self.sink_keys is None:
+            returned = keys, values
+        else:
+            padding = self._padding(keys.shape[0], keys.device)
+            sink_keys = rotate(self.sink_keys, window_start - padding - self.sink_tokens, self.inv_freq)
+            returned = torch.cat([sink_keys, keys], dim=-2), torch.cat([self.sink_values, values], dim=-2)
+
+        self.cumulative_length += key_states.shape[-2]
+        if self.sink_keys is None and keys.shape[-2] > self.sink_tokens + self.window:
+            self._capture_sinks(keys, values)
+        if self.sink_keys is not None and keys.shape[-2] > self.window:
+            keys, values = keys[..., -self.window:, :], values[..., -self.window:, :]
+        self.keys, self.values = keys, values
+        return returned
+
+    def reset(self) -> None:
+        super().reset()
+        self.cumulative_length = 0
+        self.sink_keys = self.sink_values = None
+
+    def crop(self, tokens_to_remove: int) -> None:
+        raise NotImplementedError("An attention sink cache cannot be cropped")
+
+    def _map(self, fn):
+        if self.is_initialized:
+            self.keys, self.values = fn(self.keys), fn(self.values)
+        if self.sink_keys is not None:
+            self.sink_keys, self.sink_values = fn(self.sink_keys), fn(self.sink_values)
+        if self.padding is not None:
+            self.padding = fn(self.padding)
+
+    def batch_repeat_interleave(self, repeats: int) -> None:
+        self._map(lambda t: t.repeat_interleave(repeats, dim=0))
+
+    def batch_select_indices(self, indices: torch.Tensor) -> None:
+        self._map(lambda t: t[indices.to(t.device), ...])
+
+    def reorder_cache(self, beam_idx: torch.LongTensor) -> None:
+        self._map(lambda t: t.index_select(0, beam_idx.to(t.device)))
+
+    def nbytes(self) -> int:
+        """Memory held by the layer, window and sinks"""
+        tensors = [self.sink_keys, self.sink_values]
+        if self.is_initialized:
+            tensors += [self.keys, self.values]
+        return sum(t.numel() * t.element_size() for t in tensors if t is not None)
+
+
+class SinkCache(Cache):
+    """A cache of SinkCacheLayer, one per decoder layer"""
+
+    def __init__(self, num_layers: int, sink_tokens: int, window: int, inv_freq: torch.Tensor):
+        super().__init__(layers=[SinkCacheLayer(sink_tokens, window, inv_freq) for _ in range(num_layers)])
+
+    def set_padding(self, attention_mask: torch.Tensor):
+        """Record the left padding of a batch before its prefill, so every row keeps its own first tokens as sinks"""
+        padding = (attention_mask == 0).sum(dim=-1)
+        for layer in self.layers:
+            layer.padding = padding
+
+    def nbytes(self) -> int:
+        return sum(layer.nbytes() for layer in self.layers)
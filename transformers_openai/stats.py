@@ -0,0 +1,113 @@
+import asyncio
+import json
+import os
+import time
+from typing import Any, AsyncGenerator, Callable, Dict, List, Optional
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+# Counters that are also pushed as per-second rates
+RATE_COUNTERS = {
+    "requests_total": "requests_per_second",
+    "prompt_tokens_total": "prompt_tokens_per_second",
+    "generation_tokens_total": "generation_tokens_per_second",
+}
+
+
+class ProcessStats:
+    """CPU and memory usage of the server process, without blocking to measure it"""
+
+    def __init__(self):
+        self.last_time: Optional[float] = None
+        self.last_cpu = 0.0
+        self.process = psutil.Process() if psutil is not None else None
+
+    def _rss_bytes(self) -> Optional[int]:
+        if self.process is not None:
+            return self.process.memory_info().rss
+        try:
+            with open("/proc/self/statm") as f:
+                return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+        except (OSError, ValueError, AttributeError):
+            return None
+
+    def sample(self) -> Dict[str, Any]:
+        now = time.monotonic()
+        times = os.times()
+        cpu = times.user + times.system
+        # CPU time used since the previous sample, so no sampling interval has to be waited for
+        cpu_percent = None
+        if self.last_time is not None and now > self.last_time:
+            cpu_percent = 100 * (cpu - self.last_cpu) / (now - self.last_time)
+        self.last_time, self.last_cpu = now, cpu
+
+        stats = {"process_cpu_percent": cpu_percent, "process_rss_bytes": self._rss_bytes()}
+        if psutil is not None:
+            stats["system_memory_percent"] = psutil.virtual_memory().percent
+        return stats
+
+
+class StatsHub:
+    """Samples server stats once per interval and pushes the same snapshot to every subscriber.
+
+    Sampling only runs while someone is subscribed, and its cost does not
+    grow with the number of subscribers: each snapshot is serialized once
+    and subscribers that fall behind only ever get the latest one.
+    """
+
+    def __init__(self, sample: Callable[[], Dict[str, Any]], interval: float = 1.0):
+        self.sample = sample
+        self.interval = max(0.01, interval)
+        self.subscribers: List[asyncio.Queue] = []
+        self.task: Optional[asyncio.Task] = None
+        self.previous: Optional[Dict[str, Any]] = None
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Take a sample and add rates against the previous one"""
+        stats = dict(self.sample())
+        now = time.time()
+        stats["timestamp"] = now
+        previous = self.previous
+        for counter, rate in RATE_COUNTERS.items():
+            if counter not in stats:
+                continue
+            elapsed = now - previous["timestamp"] if previous else 0
+            stats[rate] = (stats[counter] - previous.get(counter, 0)) / elapsed if elapsed > 0 else None
+        self.previous = stats
+        return stats
+
+    async def _run(self):
+        while True:
+            message = json.dumps(self.snapshot())
+            for queue in list(self.subscribers):
+                if queue.full():
+                    queue.get_nowait()
+                queue.put_nowait(message)
+            await asyncio.sleep(self.interval)
+
+    async def subscribe(self, interval: Optional[float] = None) -> AsyncGenerator[str, None]:
+        """Serialized snapshots, at most one per `interval` seconds (never faster than the hub)"""
+        interval = max(interval or self.interval, self.interval)
+        queue: asyncio.Queue = asyncio.Queue(maxsize=1)
+        self.subscribers.append(queue)
+        if self.task is None:
+            self.task = asyncio.create_task(self._run())
+        try:
+            last_sent = None
+            while True:
+                message = await queue.get()
+                now = time.monotonic()
+                # Small tolerance so a client asking for the hub rate gets every tick
+                if last_sent is not None and now - last_sent < interval - self.interval / 2:
+                    continue
+                last_sent = now
+                yield message
+        finally:
+            self.subscribers.remove(queue)
+            if not self.subscribers and self.task is not None:
+                self.task.cancel()
+                self.task = None
+                self.previous = None
@@ -0,0 +1,103 @@
+import asyncio
+from typing import Any, AsyncGenerator, AsyncIterator, Dict, List, Tuple
+
+from transformers_openai.config import config
+
+
+def coalesce_policy(stream_options=None) -> Tuple[float, int]:
+    """(max_latency in seconds, max_tokens) for coalesce_chunks(), a request's stream_options over the deployment defaults"""
+    coalesce_ms = config.args.stream_coalesce_ms
+    coalesce_tokens = config.args.stream_coalesce_tokens
+    if stream_options is not None:
+        if stream_options.coalesce_ms is not None:
+            coalesce_ms = stream_options.coalesce_ms
+        if stream_options.coalesce_tokens is not None:
+            coalesce_tokens = stream_options.coalesce_tokens
+    return coalesce_ms / 1000, coalesce_tokens
+
+
+async def coalesce_chunks(
+    chunks: AsyncIterator[Dict[str, Any]],
+    max_latency: float = 0.0,
+    max_tokens: int = 1,
+) -> AsyncGenerator[List[Dict[str, Any]], None]:
+    """Group streamed chunks so they can be flushed as a single SSE frame.
+
+    The first chunk and the final chunk (one carrying a finish_reason) are
+    always flushed immediately. Anything in between is held until either
+    `max_tokens` chunks are buffered or the oldest buffered chunk has waited
+    `max_latency` seconds. A max_tokens of 0 or 1 sets no count bound, so a
+    latency alone groups chunks; with max_latency <= 0 as well every chunk
+    passes straight through.
+    """
+    if max_latency <= 0 and max_tokens <= 1:
+        async for chunk in chunks:
+            yield [chunk]
+        return
+
+    loop = asyncio.get_running_loop()
+    iterator = chunks.__aiter__()
+    pending: List[Dict[str, Any]] = []
+    flush_at = None
+    first = True
+    next_chunk = None
+
+    try:
+        while True:
+            if next_chunk is None:
+                next_chunk = asyncio.ensure_future(iterator.__anext__())
+
+            timeout = None if flush_at is None else max(0.0, flush_at - loop.time())
+            done, _ = await asyncio.wait({next_chunk}, timeout=timeout)
+
+            if not done:
+                # Latency budget of the oldest buffered chunk is used up
+                yield pending
+                pending = []
+                flush_at = None
+                continue
+
+            task, next_chunk = next_chunk, None
+            try:
+                chunk = task.result()
+            except StopAsyncIteration:
+                break
+
+            pending.append(chunk)
+            if (
+                first
+                or chunk.get("finish_reason")
+                or (max_tokens > 1 and len(pending) >= max_tokens)
+            ):
+                first = False
+                yield pending
+                pending = []
+                flush_at = None
+            elif flush_at is None and max_latency > 0:
+                flush_at = loop.time() + max_latency
+
+        if pending:
+            yield pending
+    finally:
+        if next_chunk is not None:
+            next_chunk.cancel()
+            await asyncio.gather(next_chunk, return_exceptions=True)
+
+
+def merge_chunks(chunks: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Merge stream chunks per choice index, concatenating the deltas"""
+    grouped: Dict[int, List[Dict[str, Any]]] = {}
+    for chunk in chunks:
+        grouped.setdefault(chunk.get("index", 0), []).append(chunk)
+
+    merged = []
+    for group in grouped.values():
+        chunk = dict(group[-1])
+        chunk["text"] = "".join(c.get("text") or "" for c in group)
+        chunk["reasoning_content"] = (
+            "".join(c.get("reasoning_content") or "" for c in group) or None
+        )
+        if any(c.get("logprobs") is not None for c in group):
+            chunk["logprobs"] = [entry for c in group for entry in c.get("logprobs") or []]
+        merged.append(chunk)
+    return merged
@@ -0,0 +1,279 @@
+import functools
+import logging
+import os
+import socket
+import threading
+from typing import Any, Dict, List, Optional
+
+import torch
+import torch.distributed as dist
+import torch.multiprocessing as mp
+import transformers
+from transformers import LogitsProcessor, LogitsProcessorList, StoppingCriteria
+
+logger = logging.getLogger(__name__)
+
+# generate() arguments that only rank 0 acts on, the other ranks follow its decisions through StepSync
+RANK_ZERO_ARGS = ("logits_processor", "stopping_criteria", "streamer")
+
+
+class StepSync(LogitsProcessor):
+    """Keeps the ranks of a sharded generate() in lockstep.
+
+    Rank 0 runs its own logits processors here, then broadcasts the token it
+    is about to pick for each row, the other ranks force the same tokens.
+    SyncedStopping does the same for the rows rank 0's stopping criteria
+    end. Sampling, guided decoding and stop sequences therefore only run on
+    rank 0, and no rank can take a decoding step the others do not.
+
+    A rank 0 hook that raises must not leave the other ranks waiting at a
+    broadcast: its error is kept, every row is stopped at the next
+    synchronized stop, and generate() raises it once all ranks are out.
+    """
+
+    def __init__(self, processors: Optional[LogitsProcessorList] = None):
+        self.processors = processors
+        self.error: Optional[Exception] = None
+
+    def fail(self, error: Exception):
+        if self.error is None:
+            self.error = error
+
+    def __call__(self, input_ids, scores):
+        tokens = torch.zeros(scores.shape[0], dtype=torch.long)
+        if dist.get_rank() == 0:
+            if self.processors and self.error is None:
+                try:
+                    scores = self.processors(input_ids, scores)
+                except Exception as e:
+                    self.fail(e)
+            tokens[:] = scores.argmax(dim=-1).cpu()
+        dist.broadcast(tokens, src=0)
+        if dist.get_rank() == 0:
+            return scores
+        forced = torch.full_like(scores, float("-inf"))
+        return forced.scatter_(1, tokens.to(scores.device).unsqueeze(1), 0.0)
+
+
+class SyncedStopping(StoppingCriteria):
+    """Stops the rows rank 0's stopping criteria end, evaluated there once the step's token is appended.
+
+    Every row is stopped once a rank 0 hook failed.
+    """
+
+    def __init__(self, sync: StepSync, criteria: Optional[StoppingCriteria] = None):
+        self.sync = sync
+        self.criteria = criteria
+
+    def __call__(self, input_ids, scores, **kwargs) -> torch.BoolTensor:
+        stopped = torch.zeros(input_ids.shape[0], dtype=torch.long)
+        if dist.get_rank() == 0:
+            if self.criteria is not None and self.sync.error is None:
+                try:
+                    stopped[:] = self.criteria(input_ids, scores, **kwargs).long().cpu()
+                except Exception as e:
+                    self.sync.fail(e)
+            if self.sync.error is not None:
+                stopped[:] = 1
+        dist.broadcast(stopped, src=0)
+        return stopped.bool().to(input_ids.device)
+
+
+class SyncedStreamer:
+    """Rank 0's streamer: a put() that raises, like a stalled stream, stops every row at the next step's stop"""
+
+    def __init__(self, streamer, sync: StepSync):
+        self.streamer = streamer
+        self.sync = sync
+
+    def put(self, value):
+        if self.sync.error is None:
+            try:
+                self.streamer.put(value)
+            except Exception as e:
+                self.sync.fail(e)
+
+    def end(self):
+        if self.sync.error is None:
+            self.streamer.end()
+
+
+class TensorParallelModel:
+    """Rank 0's handle on a model sharded over worker processes.
+
+    A forward pass needs every rank, so generate() and base_model calls are
+    sent to the workers before they run here, one at a time. Everything else
+    is read from the local shard.
+    """
+
+    def __init__(self, model, workers: List[mp.Process], queues: List[Any]):
+        self.model = model
+        self.workers = workers
+        self.queues = queues
+        self.lock = threading.Lock()
+
+    def __getattr__(self, name: str):
+        return getattr(self.model, name)
+
+    def _send(self, command: str, kwargs: Dict[str, Any]):
+        exited = [worker.name for worker in self.workers if not worker.is_alive()]
+        if exited:
+            raise RuntimeError(f"Tensor parallel workers exited: {', '.join(exited)}")
+        tensors = {k: v.tolist() for k, v in kwargs.items() if isinstance(v, torch.Tensor)}
+        options = {k: v for k, v in kwargs.items() if not isinstance(v, torch.Tensor)}
+        for queue in self.queues:
+            queue.put((command, tensors, options))
+
+    def generate(self, **kwargs):
+        if kwargs.get("past_key_values") is not None:
+            raise ValueError("A sharded model cannot continue from a cache computed outside of generate()")
+        sync = StepSync(LogitsProcessorList(kwargs.get("logits_processor") or []))
+        kwargs["logits_processor"] = LogitsProcessorList([sync])
+        kwargs["stopping_criteria"] = transformers.StoppingCriteriaList(
+            [SyncedStopping(sync, transformers.StoppingCriteriaList(kwargs.get("stopping_criteria") or []))]
+        )
+        if kwargs.get("streamer") is not None:
+            kwargs["streamer"] = SyncedStreamer(kwargs["streamer"], sync)
+        outputs = self._run("generate", kwargs, self.model.generate)
+        if sync.error is not None:
+            raise sync.error
+        return outputs
+
+    def _run(self, command: str, kwargs: Dict[str, Any], call):
+        with self.lock:
+            self._send(command, {k: v for k, v in kwargs.items() if k not in RANK_ZERO_ARGS})
+            try:
+                return call(**kwargs)
+            except Exception:
+                # The ranks may now wait at different collectives, stop the workers so later calls fail in _send()
+                # instead of pairing mismatched collectives
+                self._terminate()
+                raise
+
+    def _terminate(self):
+        for worker in self.workers:
+            worker.terminate()
+        for worker in self.workers:
+            worker.join(timeout=10)
+
+    def _forward(self, module: str, **kwargs):
+        return self._run(module, kwargs, getattr(self.model, module))
+
+    @property
+    def base_model(self):
+        return functools.partial(self._forward, "base_model")
+
+    def close(self):
+        """Let the workers leave the process group and exit"""
+        for queue in self.queues:
+            queue.put(("stop", {}, {}))
+        for worker in self.workers:
+            worker.join(timeout=10)
+        dist.destroy_process_group()
+
+
+def _share_cores(rank: int, world_size: int, pin: bool):
+    """Give each rank its own contiguous share of the cores.
+
+    With `pin` the process is bound to its share, so the weight shard is
+    allocated on, and streamed from, the memory of the socket it runs on.
+    """
+    cores = sorted(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else list(range(os.cpu_count() or 1))
+    share = len(cores) // world_size
+    if share == 0:
+        return
+    if pin and hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(0, cores[rank * share:(rank + 1) * share])
+    torch.set_num_threads(share)
+
+
+def _init_process_group(rank: int, world_size: int, port: int):
+    dist.init_process_group(
+        "gloo", init_method=f"tcp://127.0.0.1:{port}", rank=rank, world_size=world_size
+    )
+
+
+def _from_pretrained(model_name: str, revision: Optional[str], dtype: torch.dtype, world_size: int):
+    return transformers.AutoModelForCausalLM.from_pretrained(
+        model_name,
+        revision=revision,
+        dtype=dtype,
+        distributed_config=transformers.DistributedConfig(tp_plan="auto", tp_size=world_size),
+    )
+
+
+def _worker(
+    rank: int,
+    world_size: int,
+    port: int,
+    queue,
+    model_name: str,
+    revision: Optional[str],
+    dtype: torch.dtype,
+    loglevel: int,
+):
+    """Main loop of a worker rank: load the shard, then replay the calls rank 0 sends"""
+    logging.basicConfig(level=loglevel)
+    os.environ.update(RANK=str(rank), LOCAL_RANK=str(rank), WORLD_SIZE=str(world_size))
+    _share_cores(rank, world_size, pin=True)
+    _init_process_group(rank, world_size, port)
+    model = _from_pretrained(model_name, revision, dtype, world_size)
+    logger.info(f"Tensor parallel rank {rank} loaded its shard")
+
+    while True:
+        command, tensors, options = queue.get()
+        if command == "stop":
+            break
+        kwargs = {**{k: torch.tensor(v) for k, v in tensors.items()}, **options}
+        try:
+            with torch.no_grad():
+                if command == "generate":
+                    sync = StepSync()
+                    model.generate(
+                        **kwargs,
+                        logits_processor=LogitsProcessorList([sync]),
+                        stopping_criteria=transformers.StoppingCriteriaList([SyncedStopping(sync)]),
+                    )
+                else:
+                    getattr(model, command)(**kwargs)
+        except Exception:
+            # Rank 0 cannot tell where this rank stopped, exit so it fails fast in _send() instead of waiting on it
+            logger.exception(f"Tensor parallel rank {rank} failed to run {command}, exiting")
+            raise SystemExit(1)
+    dist.destroy_process_group()
+
+
+def _free_port() -> int:
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def load_sharded(
+    model_name: str, revision: Optional[str], dtype: torch.dtype, world_size: int
+) -> TensorParallelModel:
+    """Start world_size - 1 worker processes and load the model sharded over them and this process.
+
+    This process is rank 0: it keeps serving HTTP and scheduling requests and
+    is not pinned to its cores.
+    """
+    port = _free_port()
+    context = mp.get_context("spawn")
+    queues: List[Any] = []
+    workers: List[mp.Process] = []
+    for rank in range(1, world_size):
+        queue = context.SimpleQueue()
+        worker = context.Process(
+            target=_worker,
+            args=(rank, world_size, port, queue, model_name, revision, dtype, logging.getLogger().level),
+            name=f"tensor-parallel-rank-{rank}",
+            daemon=True,
+        )
+        worker.start()
+        queues.append(queue)
+        workers.append(worker)
+
+    _share_cores(0, world_size, pin=False)
+    _init_process_group(0, world_size, port)
+    logger.info(f"Sharding {model_name} over {world_size} processes")
+    return TensorParallelModel(_from_pretrained(model_name, revision, dtype, world_size), workers, queues)
@@ -0,0 +1,58 @@
+import time
+from contextlib import contextmanager
+from typing import Dict, Optional
+
+# Phases of a generation request in the order they happen
+PHASES = ("queue", "templating", "tokenization", "prefill", "decode", "serialization")
+
+
+class DeadlineExceeded(TimeoutError):
+    """The client stopped waiting for the request before its response was ready"""
+
+
+class RequestTiming:
+    """Wall time spent in each phase of one request, measured with time.perf_counter().
+
+    `start` is the arrival of the request. Phases are added by whoever runs
+    them (the endpoint, the scheduler wait, the model manager), and a phase
+    that runs several times, like serializing stream chunks, accumulates.
+    """
+
+    def __init__(self, start: Optional[float] = None, deadline: Optional[float] = None):
+        self.start = start if start is not None else time.perf_counter()
+        self.phases: Dict[str, float] = {}
+        # When the client stops waiting, on the same clock as `start`; None without a deadline
+        self.deadline = deadline
+
+    def add(self, phase: str, seconds: float):
+        self.phases[phase] = self.phases.get(phase, 0.0) + seconds
+
+    def set(self, phase: str, seconds: float):
+        self.phases[phase] = seconds
+
+    @contextmanager
+    def phase(self, phase: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(phase, time.perf_counter() - start)
+
+    def elapsed(self) -> float:
+        return time.perf_counter() - self.start
+
+    @property
+    def expired(self) -> bool:
+        return self.deadline is not None and time.perf_counter() >= self.deadline
+
+    def report(self) -> Dict[str, Optional[float]]:
+        """Seconds per phase, None for phases the request did not go through, and the total so far"""
+        return {**{phase: self.phases.get(phase) for phase in PHASES}, "total": self.elapsed()}
+
+    def server_timing(self) -> str:
+        """The phases as a Server-Timing header value, durations in milliseconds"""
+        entries = [
+            f"{phase};dur={self.phases[phase] * 1e3:.3f}" for phase in PHASES if phase in self.phases
+        ]
+        entries.append(f"total;dur={self.elapsed() * 1e3:.3f}")
+        return ", ".join(entries)